@@ -1,12 +1,14 @@
 # pyrefly: ignore [missing-import]
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, send_file
 import os
 import sys
 import time
-import zipfile
 import io
 import pathlib
 import shutil
+import json
+import sqlite3
+import tempfile
 
 # Ensure we can import 'shared' from parent dir
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -14,10 +16,24 @@ PARENT_DIR = os.path.dirname(CURRENT_DIR)
 if PARENT_DIR not in sys.path:
     sys.path.append(PARENT_DIR)
 
-from shared.config import STATIC_DIR, DATABASE, APP_ASSETS_DIR, IMAGE_DIR
+from shared.config import STATIC_DIR, DATABASE, APP_ASSETS_DIR, APP_DATA_DIR, IMAGE_DIR
 from shared.db import get_db
 from shared.auth import check_password, set_password, get_password
 from shared.countries import get_country_list
+from shared.sequences import DEFAULT_SEQUENCE_FORMATS, init_sequences_table
+from shared.blobstore import pack_text, unpack_row, compress_column, content_hash
+from shared.migrations import latest_schema_version, mark_schema_stale, migrate_to_current
+from shared.instrumentation import snapshot as perf_snapshot
+from shared.profiler import list_profiles, load_profile, profile_stats_path
+from shared.backup import (
+    discard, full_backup_members, restore_archive, restore_database, stream_zip, temporary_snapshot,
+)
+from shared.backup_schedule import (
+    SETTING_DEFAULTS as BACKUP_SETTING_DEFAULTS, backup_members, backup_running, backup_settings,
+    list_backups, load_backup, next_due, read_history, save_backup_settings, start_backup,
+)
+from rent.doc_templates import normalize_headings
+from rent.import_templates import import_docx_folder
 
 app = Flask(
     __name__,
@@ -42,6 +58,8 @@ def init_presets_table():
     conn.commit()
     conn.close()
 
+PDF_TEMPLATE_HTML_COLUMNS = ("header_html", "body_html", "footer_html", "css")
+
 def init_pdf_templates_table():
     conn = get_db()
     cur = conn.cursor()
@@ -57,7 +75,26 @@ def init_pdf_templates_table():
         );
     """)
     
-    # Try to read current filesystem templates
+    sync_system_pdf_template(conn)
+
+    # Custom templates saved before compression was introduced
+    for col in PDF_TEMPLATE_HTML_COLUMNS:
+        compress_column(conn, "pdf_templates", col)
+
+    # Ensure active_pdf_template_id exists
+    cur.execute("SELECT key FROM global_settings WHERE key = 'active_pdf_template_id';")
+    if not cur.fetchone():
+        cur.execute("INSERT INTO global_settings (key, value) VALUES ('active_pdf_template_id', '0');")
+        
+    conn.commit()
+    conn.close()
+
+def sync_system_pdf_template(conn=None):
+    """
+    Copy the offer PDF templates from disk into the read-only 'System Default'
+    row. Skipped when the files are unchanged since the last sync (hash kept in
+    global_settings), so this is cheap enough to run on every start.
+    """
     templates_dir = os.path.join(PARENT_DIR, "offer", "templates")
     css_path = os.path.join(PARENT_DIR, "static", "css", "pdf.css")
     
@@ -73,29 +110,41 @@ def init_pdf_templates_table():
             pdf_css = f.read()
     except Exception as e:
         print(f"Warning: Could not read templates from filesystem: {e}")
+    digest = content_hash("\0".join((header_html, body_html, footer_html, pdf_css)))
 
-    # Initialize or Update 'System Default' (Read-only)
+    own = conn is None
+    conn = conn or get_db()
+    cur = conn.cursor()
     cur.execute("SELECT id FROM pdf_templates WHERE name = 'System Default';")
     row = cur.fetchone()
+    cur.execute("SELECT value FROM global_settings WHERE key = 'system_pdf_template_hash';")
+    stored = cur.fetchone()
+    if row and stored and stored["value"] == digest:
+        if own:
+            conn.close()
+        return False
+
+    # Initialize or Update 'System Default' (Read-only)
     if not row:
         cur.execute("""
             INSERT INTO pdf_templates (name, header_html, body_html, footer_html, css, is_readonly)
             VALUES (?, ?, ?, ?, ?, 1);
-        """, ("System Default", header_html, body_html, footer_html, pdf_css))
+        """, ("System Default", pack_text(header_html), pack_text(body_html),
+              pack_text(footer_html), pack_text(pdf_css)))
     else:
         cur.execute("""
             UPDATE pdf_templates 
             SET header_html=?, body_html=?, footer_html=?, css=?
             WHERE name='System Default';
-        """, (header_html, body_html, footer_html, pdf_css))
-
-    # Ensure active_pdf_template_id exists
-    cur.execute("SELECT key FROM global_settings WHERE key = 'active_pdf_template_id';")
-    if not cur.fetchone():
-        cur.execute("INSERT INTO global_settings (key, value) VALUES ('active_pdf_template_id', '0');")
-        
-    conn.commit()
-    conn.close()
+        """, (pack_text(header_html), pack_text(body_html), pack_text(footer_html), pack_text(pdf_css)))
+    cur.execute("""
+        INSERT INTO global_settings (key, value) VALUES ('system_pdf_template_hash', ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value;
+    """, (digest,))
+    if own:
+        conn.commit()
+        conn.close()
+    return True
 
 def init_rounding_rules_table():
     conn = get_db()
@@ -137,6 +186,23 @@ def init_db():
     init_presets_table()
     init_pdf_templates_table()
     init_rounding_rules_table()
+    conn = get_db()
+    init_sequences_table(conn)
+    conn.close()
+
+def is_admin_request(environ):
+    """True if the WSGI request carries a logged-in admin session (used outside this app, e.g. by the profiler)."""
+    from werkzeug.http import parse_cookie
+    from itsdangerous import BadSignature
+    value = parse_cookie(environ.get("HTTP_COOKIE", "")).get(app.config["SESSION_COOKIE_NAME"])
+    if not value:
+        return False
+    serializer = app.session_interface.get_signing_serializer(app)
+    try:
+        data = serializer.loads(value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return False
+    return bool(data.get("admin_authenticated"))
 
 @app.before_request
 def check_auth():
@@ -230,6 +296,13 @@ def index():
         row = cur.fetchone()
         rent_defaults[key] = row["value"] if row else default
 
+    # Fetch document number formats
+    sequence_formats = {}
+    for series, default in DEFAULT_SEQUENCE_FORMATS.items():
+        cur.execute("SELECT value FROM global_settings WHERE key = ?;", (f"sequence_format_{series}",))
+        row = cur.fetchone()
+        sequence_formats[series] = row["value"] if row else default
+
     # Fetch rent email preset
     _DEFAULT_RENT_EMAIL = (
         "Poštovani,\n\n"
@@ -280,6 +353,7 @@ def index():
         email_offer_body=email_offer_body,
         default_items_per_page=default_items_per_page,
         rent_defaults=rent_defaults,
+        sequence_formats=sequence_formats,
         rent_email_preset=rent_email_preset,
         timestamp=int(time.time()),
         theme=current_theme
@@ -551,6 +625,12 @@ def update_settings():
         if val is not None and val.strip() != '':
             cur.execute("INSERT OR REPLACE INTO global_settings (key, value) VALUES (?, ?);", (key, val.strip()))
 
+    # Document number formats
+    for series in DEFAULT_SEQUENCE_FORMATS:
+        val = request.form.get(f"sequence_format_{series}")
+        if val is not None and val.strip() != '':
+            cur.execute("INSERT OR REPLACE INTO global_settings (key, value) VALUES (?, ?);", (f"sequence_format_{series}", val.strip()))
+
     # Rent email preset
     rent_email_preset_val = request.form.get("rent_email_preset")
     if rent_email_preset_val is not None:
@@ -574,21 +654,28 @@ def update_settings():
 def backup_db():
     if not session.get('admin_authenticated'):
         return redirect(url_for('login'))
-        
-    conn = get_db()
-    conn.close() # Ensure db is closed before reading file
-    
-    file_path = DATABASE
-    if not os.path.exists(file_path):
+
+    if not os.path.exists(DATABASE):
         flash("Database file not found.", "error")
         return redirect(url_for("index"))
-        
+
+    # Consistent copy (WAL included) taken while the apps keep running
+    try:
+        snapshot = temporary_snapshot()
+    except sqlite3.Error as e:
+        flash(f"Error creating backup: {e}", "error")
+        return redirect(url_for("index"))
+
     date_str = time.strftime("%Y-%m-%d")
-    return send_file(
-        file_path,
+    response = send_file(
+        snapshot,
         as_attachment=True,
         download_name=f"full_backup_{date_str}.db"
     )
+    # send_file() sets direct_passthrough, which skips call_on_close callbacks
+    response.direct_passthrough = False
+    response.call_on_close(lambda: discard(snapshot))
+    return response
 
 @app.route("/pdf_templates")
 def list_pdf_templates():
@@ -630,6 +717,113 @@ def add_pdf_template():
     flash("Template created.", "success")
     return redirect(url_for("edit_pdf_template", template_id=new_id))
 
+# Offer size for the render-cost estimate of a PDF template
+PDF_COST_SAMPLE_LINES = 20
+# Flag an estimate this much slower than the previous one for the same template
+PDF_COST_SLOWDOWN_WARNING = 0.25
+
+
+def _pdf_cost_key(template_id):
+    return f"pdf_template_cost_{template_id}"
+
+
+def estimate_pdf_template_cost(template, offer_id=None):
+    """
+    Render a PDF_COST_SAMPLE_LINES-line sample offer (the items of offer_id,
+    or of the newest offer with items if that one is gone, repeated) through
+    an unpacked pdf_templates row and return {"ms", "pages", "kb", "offer_id"},
+    or None when there is no offer with items yet.
+    """
+    # Imported here: the offer app is only needed for this admin action
+    from offer.app import app as offer_app, render_offer_pdf
+    from pypdf import PdfReader
+
+    conn = get_db()
+    cur = conn.cursor()
+    offer = None
+    if offer_id:
+        cur.execute("""
+            SELECT * FROM offers
+            WHERE id = ? AND EXISTS (SELECT 1 FROM offer_items WHERE offer_id = offers.id);
+        """, (offer_id,))
+        offer = cur.fetchone()
+    if not offer:
+        cur.execute("""
+            SELECT * FROM offers
+            WHERE id = (SELECT MAX(offer_id) FROM offer_items);
+        """)
+        offer = cur.fetchone()
+    if not offer:
+        conn.close()
+        return None
+    cur.execute("SELECT * FROM offer_items WHERE offer_id = ? ORDER BY line_order, id;", (offer["id"],))
+    items = cur.fetchall()
+    cur.execute("SELECT value FROM global_settings WHERE key = 'language';")
+    row = cur.fetchone()
+    language = row["value"] if row else "en"
+    conn.close()
+
+    sample = [dict(items[i % len(items)], line_order=i + 1) for i in range(PDF_COST_SAMPLE_LINES)]
+    with offer_app.test_request_context("/"):
+        # Warm-up: the first PDF in a process also pays the WeasyPrint import and font setup
+        render_offer_pdf(offer, sample[:1], template, language)
+        started = time.perf_counter()
+        pdf_bytes = render_offer_pdf(offer, sample, template, language)
+        seconds = time.perf_counter() - started
+    return {
+        "ms": round(seconds * 1000),
+        "pages": len(PdfReader(io.BytesIO(pdf_bytes)).pages),
+        "kb": round(len(pdf_bytes) / 1024),
+        "offer_id": offer["id"],
+    }
+
+
+def record_pdf_template_cost(template_id):
+    """Measure a template's render cost, store it in global_settings and flash the result."""
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM pdf_templates WHERE id = ?;", (template_id,))
+    template = cur.fetchone()
+    cur.execute("SELECT value FROM global_settings WHERE key = ?;", (_pdf_cost_key(template_id),))
+    row = cur.fetchone()
+    conn.close()
+    if not template:
+        return
+    previous = json.loads(row["value"]) if row else None
+
+    try:
+        # Same sample offer as last time, so the comparison below measures the template, not the data
+        cost = estimate_pdf_template_cost(unpack_row(template, *PDF_TEMPLATE_HTML_COLUMNS),
+                                          previous.get("offer_id") if previous else None)
+    except Exception as e:
+        flash(f"Render cost could not be measured: {e}", "error")
+        return
+    if cost is None:
+        flash("Render cost not measured: create an offer with items first.", "error")
+        return
+
+    cost["measured_at"] = time.strftime("%Y-%m-%d %H:%M")
+    conn = get_db()
+    conn.execute("""
+        INSERT INTO global_settings (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value;
+    """, (_pdf_cost_key(template_id), json.dumps(cost)))
+    conn.commit()
+    conn.close()
+
+    message = (f"Estimated render cost: {cost['ms']} ms for a {PDF_COST_SAMPLE_LINES}-line offer "
+               f"({cost['pages']} pages, {cost['kb']} KB).")
+    category = "success"
+    if previous and previous.get("ms") and previous.get("offer_id") != cost["offer_id"]:
+        message += f" Not compared with the previous {previous['ms']} ms, measured on a different sample offer."
+    elif previous and previous.get("ms"):
+        change = cost["ms"] / previous["ms"] - 1
+        message += f" Previously {previous['ms']} ms ({change * 100:+.0f}%)."
+        if change > PDF_COST_SLOWDOWN_WARNING:
+            category = "error"
+    flash(message, category)
+
+
 @app.route("/edit_pdf_template/<int:template_id>", methods=["GET", "POST"])
 def edit_pdf_template(template_id):
     conn = get_db()
@@ -651,12 +845,20 @@ def edit_pdf_template(template_id):
                 UPDATE pdf_templates 
                 SET name=?, header_html=?, body_html=?, footer_html=?, css=?
                 WHERE id=?;
-            """, (name, header, body, footer, css, template_id))
+            """, (name, pack_text(header), pack_text(body), pack_text(footer), pack_text(css), template_id))
             conn.commit()
             flash("Template updated.", "success")
+            if request.form.get("estimate_cost"):
+                record_pdf_template_cost(template_id)
             
     cur.execute("SELECT * FROM pdf_templates WHERE id = ?;", (template_id,))
     template = cur.fetchone()
+    if template:
+        template = unpack_row(template, *PDF_TEMPLATE_HTML_COLUMNS)
+
+    cur.execute("SELECT value FROM global_settings WHERE key = ?;", (_pdf_cost_key(template_id),))
+    row = cur.fetchone()
+    render_cost = json.loads(row["value"]) if row else None
     
     # For preview testing: get all offers
     cur.execute("SELECT id, client_name, offer_number FROM offers ORDER BY date DESC, id DESC;")
@@ -666,7 +868,14 @@ def edit_pdf_template(template_id):
     if not template:
         return "Template not found", 404
         
-    return render_template("pdf_template_edit.html", template=template, offers=offers)
+    return render_template("pdf_template_edit.html", template=template, offers=offers,
+                           render_cost=render_cost, cost_sample_lines=PDF_COST_SAMPLE_LINES)
+
+
+@app.route("/pdf_template_cost/<int:template_id>", methods=["POST"])
+def measure_pdf_template_cost(template_id):
+    record_pdf_template_cost(template_id)
+    return redirect(url_for("edit_pdf_template", template_id=template_id))
 
 import re
 
@@ -760,6 +969,7 @@ def delete_pdf_template():
         flash("Cannot delete system template.", "error")
     else:
         cur.execute("DELETE FROM pdf_templates WHERE id = ?;", (tpl_id,))
+        cur.execute("DELETE FROM global_settings WHERE key = ?;", (_pdf_cost_key(tpl_id),))
         # If it was active, reset to 0
         cur.execute("SELECT value FROM global_settings WHERE key = 'active_pdf_template_id';")
         r = cur.fetchone()
@@ -782,6 +992,48 @@ def set_active_pdf_template():
     flash("Active template updated.", "success")
     return redirect(url_for("list_pdf_templates"))
 
+# Cached sale snapshots and rent projections are keyed by these counters
+_REVISION_KEYS = ("catalog_revision", "rent_contracts_revision")
+
+def _revisions():
+    conn = get_db()
+    rows = conn.execute("SELECT key, value FROM global_settings WHERE key IN (?, ?);", _REVISION_KEYS).fetchall()
+    conn.close()
+    values = dict.fromkeys(_REVISION_KEYS, 0)
+    for row in rows:
+        try:
+            values[row["key"]] = int(row["value"])
+        except (TypeError, ValueError):
+            pass
+    return values
+
+def _catalog_changes_version():
+    """Catalog version of the offline Sale sync (sale/sync.py): the catalog_changes id counter."""
+    conn = get_db()
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'catalog_changes';").fetchone()
+    conn.close()
+    return row["seq"] if row else 0
+
+def _after_restore(revisions_before, changes_version_before):
+    """Migrate a restored (possibly older) database and move every cache key past old values.
+
+    The Sale change log is emptied and its version moved past the pre-restore
+    one, so every offline client (whatever version it holds) gets a full
+    reset on its next sync instead of deltas that skip the lost changes.
+    """
+    migrate_to_current()
+    restored = _revisions()
+    changes_version = max(_catalog_changes_version(), changes_version_before) + 1
+    conn = get_db()
+    for key in _REVISION_KEYS:
+        conn.execute("INSERT OR REPLACE INTO global_settings (key, value) VALUES (?, ?);",
+                     (key, str(max(restored[key], revisions_before[key]) + 1)))
+    conn.execute("DELETE FROM catalog_changes;")
+    conn.execute("DELETE FROM sqlite_sequence WHERE name = 'catalog_changes';")
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('catalog_changes', ?);", (changes_version,))
+    conn.commit()
+    conn.close()
+
 @app.route("/restore_db", methods=["POST"])
 def restore_db():
     current_admin_pass = request.form.get("current_admin_password")
@@ -796,12 +1048,12 @@ def restore_db():
         if not f.filename.endswith(".db") and not f.filename.endswith(".sqlite"):
             flash("Invalid file extension. Please upload a .db file.", "error")
             return redirect(url_for("index"))
-            
-        # We need to overwrite the database file.
-        # Ensure no active connections (not 100% possible with threading but we try)
-        # In this simple app, just overwriting usually works on Linux.
+
+        # Staged, checked, then swapped into the live database in one transaction (shared/backup.py)
         try:
-            f.save(DATABASE)
+            revisions, changes_version = _revisions(), _catalog_changes_version()
+            restore_database(f.stream, latest_schema_version())
+            _after_restore(revisions, changes_version)
             flash("Database restored successfully.", "success")
         except Exception as e:
             flash(f"Error restoring database: {e}", "error")
@@ -810,55 +1062,65 @@ def restore_db():
 
     return redirect(url_for("index"))
 def generate_full_backup_zip():
-    # Ensure DB is flushed
-    conn = get_db()
-    conn.commit()
-    conn.close()
-    
-    # Create in-memory zip
-    memory_file = io.BytesIO()
-    with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        # 1. Add Database
-        if os.path.exists(DATABASE):
-            zf.write(DATABASE, arcname="pricing.db")
-            
-        # 2. Add Product Images
-        # Walk through IMAGE_DIR and add all files
-        if os.path.exists(IMAGE_DIR):
-            for root, dirs, files in os.walk(IMAGE_DIR):
-                for file in files:
-                    abs_path = os.path.join(root, file)
-                    # rel_path determines the path inside the zip
-                    # We want 'product_images/filename.jpg'
-                    rel_path = os.path.relpath(abs_path, os.path.dirname(IMAGE_DIR))
-                    zf.write(abs_path, arcname=rel_path)
-
-        # 3. Add App Assets (Logos etc)
-        if os.path.exists(APP_ASSETS_DIR):
-             for root, dirs, files in os.walk(APP_ASSETS_DIR):
-                for file in files:
-                    abs_path = os.path.join(root, file)
-                    # We want 'app_assets/filename.jpg'
-                    rel_path = os.path.relpath(abs_path, os.path.dirname(APP_ASSETS_DIR))
-                    zf.write(abs_path, arcname=rel_path)
-                    
-    memory_file.seek(0)
-    return memory_file
+    """Snapshot the database now; return (ZIP chunk iterator, snapshot path to discard() afterwards).
+
+    The archive holds pricing.db, product_images/ and app_assets/ and is built
+    while it is being read, so memory use does not grow with the image store.
+    """
+    snapshot = temporary_snapshot()
+    return stream_zip(full_backup_members(snapshot)), snapshot
 
 @app.route("/backup_full")
 def backup_full():
     if not session.get('admin_authenticated'):
         return redirect(url_for('login'))
-        
-    memory_file = generate_full_backup_zip()
-    
+
+    try:
+        chunks, snapshot = generate_full_backup_zip()
+    except sqlite3.Error as e:
+        flash(f"Error creating backup: {e}", "error")
+        return redirect(url_for("index"))
+
     date_str = time.strftime("%Y-%m-%d")
-    return send_file(
-        memory_file,
-        as_attachment=True,
-        download_name=f"FULL_SYSTEM_BACKUP_{date_str}.zip",
-        mimetype="application/zip"
-    )
+    response = Response(chunks, mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", filename=f"FULL_SYSTEM_BACKUP_{date_str}.zip")
+    response.call_on_close(lambda: discard(snapshot))
+    return response
+
+@app.route("/backups")
+def backups():
+    settings = backup_settings()
+    return render_template("admin_backups.html", backups=list_backups(), history=read_history(),
+                           settings=settings, next_due=next_due(settings), running=backup_running())
+
+@app.route("/backups/settings", methods=["POST"])
+def save_backup_schedule():
+    try:
+        values = {key: int(request.form.get(key, "")) for key in BACKUP_SETTING_DEFAULTS}
+    except ValueError:
+        flash("Backup settings must be whole numbers.", "error")
+        return redirect(url_for("backups"))
+    values["backup_start_hour"] = min(values["backup_start_hour"], 23)
+    save_backup_settings(values)
+    flash("Backup schedule saved.", "success")
+    return redirect(url_for("backups"))
+
+@app.route("/backups/run", methods=["POST"])
+def run_backup_now():
+    if start_backup():
+        flash("Backup started. It shows up below when it has finished.", "success")
+    else:
+        flash("A backup is already running.", "error")
+    return redirect(url_for("backups"))
+
+@app.route("/backups/<backup_id>/download")
+def download_backup(backup_id):
+    if load_backup(backup_id) is None:
+        return "Backup not found", 404
+    # Same layout as the Full System Backup, so it restores the same way
+    response = Response(stream_zip(backup_members(backup_id)), mimetype="application/zip")
+    response.headers.set("Content-Disposition", "attachment", filename=f"BACKUP_{backup_id}.zip")
+    return response
 
 @app.route("/restore_full", methods=["POST"])
 def restore_full():
@@ -877,62 +1139,12 @@ def restore_full():
         flash("Invalid file extension. Please upload a .zip file.", "error")
         return redirect(url_for("index"))
         
+    # Streamed into staging, checked, then swapped in (database by backup API, folders by rename)
     try:
-        # Create temp file to extract from
-        # Or Just use ZipFile on the file object if strictly supported, but safer to save to temp
-        # Using io.BytesIO for in-memory handling if file is specialized
-        
-        # Check if zip is valid
-        with zipfile.ZipFile(f) as zf:
-            # Check for pricing.db
-            if "pricing.db" not in zf.namelist():
-                flash("Invalid Backup: pricing.db not found in archive.", "error")
-                return redirect(url_for("index"))
-            
-            # 1. Restore Database
-            # We enforce the target to be DATABASE path
-            with open(DATABASE, 'wb') as db_out:
-                db_out.write(zf.read("pricing.db"))
-                
-            # 2. Restore Images and Assets
-            # We iterate and extract only if path starts with product_images/ or app_assets/
-            for member in zf.namelist():
-                if member.startswith("product_images/") or member.startswith("app_assets/"):
-                    # Prevent path traversal (simple check)
-                    if ".." in member or member.startswith("/"):
-                        continue
-                        
-                    # Target path
-                    # member is like "product_images/123.jpg"
-                    # We extracting to APP_DATA_DIR's parent basically? 
-                    # Wait, IMAGE_DIR is .../app_data/product_images
-                    
-                    # We need to map:
-                    # zip: product_images/foo.jpg -> filesystem: .../app_data/product_images/foo.jpg
-                    # zip: app_assets/logo.jpg -> filesystem: .../app_assets/logo.jpg
-                    
-                    # Determine target directory base
-                    target_abs_path = None
-                    
-                    if member.startswith("product_images/"):
-                        # Remove prefix
-                        rel = member[len("product_images/"):]
-                        if not rel: continue # Directory entry
-                        target_abs_path = os.path.join(IMAGE_DIR, rel)
-                        
-                    elif member.startswith("app_assets/"):
-                        rel = member[len("app_assets/"):]
-                        if not rel: continue
-                        target_abs_path = os.path.join(APP_ASSETS_DIR, rel)
-                        
-                    if target_abs_path:
-                        # Ensure dir exists
-                        os.makedirs(os.path.dirname(target_abs_path), exist_ok=True)
-                        with open(target_abs_path, "wb") as out_f:
-                            out_f.write(zf.read(member))
-                            
+        revisions, changes_version = _revisions(), _catalog_changes_version()
+        restore_archive(f.stream, latest_schema_version())
+        _after_restore(revisions, changes_version)
         flash("Full System Restore successful.", "success")
-        
     except Exception as e:
         flash(f"Error restoring backup: {e}", "error")
         print(f"Restore Error: {e}")
@@ -947,9 +1159,15 @@ def factory_reset():
         flash("Invalid current Admin password. Factory reset aborted.", "error")
         return redirect(url_for("index"))
         
-    # 1. Create FULL Backup in memory using the helper
+    # 1. Create FULL Backup using the helper (spooled to a temp file on disk, not memory)
     try:
-        memory_file = generate_full_backup_zip()
+        chunks, snapshot = generate_full_backup_zip()
+        backup_file = tempfile.TemporaryFile(dir=APP_DATA_DIR)
+        try:
+            for chunk in chunks:
+                backup_file.write(chunk)
+        finally:
+            discard(snapshot)
     except Exception as e:
         flash(f"Error creating backup before reset: {e}", "error")
         return redirect(url_for("index"))
@@ -968,11 +1186,20 @@ def factory_reset():
             "products", "prices", "offers", "offer_items", "brands", 
             "category_pricing_defaults", "text_presets", "price_rounding_rules",
             "rent_clients", "rent_equipment", "rent_contracts",
-            "rent_contract_documents", "rent_templates"
+            "rent_contract_documents", "rent_templates", "document_sequences"
         ]
         for table in tables_to_clear:
             cur.execute(f"DELETE FROM {table};")
+
+        # Invalidate cached rent portfolio projections
+        cur.execute("""
+            INSERT INTO global_settings (key, value) VALUES ('rent_contracts_revision', '1')
+            ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;
+        """)
         
+        # Seeded tables (rounding rules, rent templates) were emptied; re-seed on next start
+        mark_schema_stale(conn)
+
         # Reset PDF Templates (keep only 'System Default' and make it read-only)
         cur.execute("DELETE FROM pdf_templates WHERE name != 'System Default';")
         cur.execute("UPDATE pdf_templates SET is_readonly = 1 WHERE name = 'System Default';")
@@ -1002,6 +1229,8 @@ def factory_reset():
             'rent_default_salvage_value_percent': '20.0',
             'rent_default_downpayment_percent': '20.0',
             'rent_default_period_months': '48',
+            'sequence_format_offer': DEFAULT_SEQUENCE_FORMATS['offer'],
+            'sequence_format_rent_contract': DEFAULT_SEQUENCE_FORMATS['rent_contract'],
         }
         
         for key, value in defaults.items():
@@ -1068,11 +1297,11 @@ def factory_reset():
         flash(f"Warning: Database reset but error restoring branding: {e}", "warning")
 
     # 5. Return the backup ZIP as download
-    memory_file.seek(0)
+    backup_file.seek(0)
     date_str = time.strftime("%Y-%m-%d_%H%M%S")
     
     return send_file(
-        memory_file,
+        backup_file,
         as_attachment=True,
         download_name=f"FACTORY_RESET_BACKUP_{date_str}.zip",
         mimetype="application/zip"
@@ -1093,6 +1322,26 @@ def list_rounding_rules():
     conn.close()
     return render_template("rounding_rules.html", rules_by_target=rules_by_target)
 
+@app.route("/performance")
+def performance():
+    return render_template("admin_performance.html", stats=perf_snapshot())
+
+@app.route("/profiles")
+@app.route("/profiles/<profile_id>")
+def profiles(profile_id=None):
+    selected = load_profile(profile_id) if profile_id else None
+    if profile_id and selected is None:
+        return "Profile not found", 404
+    return render_template("admin_profiles.html", profiles=list_profiles(), selected=selected)
+
+@app.route("/profiles/<profile_id>/download")
+def download_profile(profile_id):
+    path = profile_stats_path(profile_id)
+    if path is None:
+        return "Profile not found", 404
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True,
+                     download_name=f"{profile_id}.prof")
+
 @app.route("/add_rounding_rule", methods=["POST"])
 def add_rounding_rule():
     target = request.form.get("target")
@@ -1177,11 +1426,26 @@ def admin_rent_templates():
     subj_row = cur.fetchone()
     rent_email_subject = subj_row["value"] if subj_row else "Ugovor i prilozi za zakup opreme - {{ contract_number }} - {{ client_name }}"
     conn.close()
-    return render_template("admin_rent_templates.html", templates=templates, selected=None, msg=None,
+    return render_template("admin_rent_templates.html", templates=templates, selected=None,
+                           msg=request.args.get("msg"),
                            rent_email_preset=rent_email_preset,
                            rent_email_subject=rent_email_subject)
 
 
+@app.route("/rent/reimport_templates", methods=["POST"])
+def admin_rent_templates_reimport():
+    """Re-import master templates from the Word source folder; unchanged files are skipped."""
+    if not session.get("admin_authenticated"):
+        return redirect(url_for("login"))
+    conn = get_db()
+    stats = import_docx_folder(conn, force=bool(request.form.get("force")))
+    conn.close()
+    msg = (f"✓ Uvoz iz .docx: novih {stats['imported']}, izmenjenih {stats['updated']}, "
+           f"bez promena {stats['unchanged']}, zadržanih ručnih izmena {stats['kept']}, "
+           f"neuspešnih {stats['failed']}.")
+    return redirect(url_for("admin_rent_templates", msg=msg))
+
+
 @app.route("/rent/templates/<slug>", methods=["GET", "POST"])
 def admin_rent_template_edit(slug):
     if not session.get("admin_authenticated"):
@@ -1199,13 +1463,17 @@ def admin_rent_template_edit(slug):
 
     msg = None
     if request.method == "POST":
-        new_html = request.form.get("content_html", "")
-        cur.execute("UPDATE rent_templates SET content_html=? WHERE slug=?;", (new_html, slug))
+        # Headings are normalized once here instead of on every document view
+        new_html = normalize_headings(request.form.get("content_html", ""))
+        # No source_hash: the template no longer matches its .docx, so a reimport keeps this edit
+        cur.execute("UPDATE rent_templates SET content_html=?, source_hash=NULL WHERE slug=?;",
+                    (pack_text(new_html), slug))
         conn.commit()
         msg = "✓ Šablon je uspešno sačuvan."
         # Re-fetch updated
         cur.execute("SELECT * FROM rent_templates WHERE slug=?;", (slug,))
         selected = cur.fetchone()
+    selected = unpack_row(selected, "content_html")
 
     cur.execute("SELECT value FROM global_settings WHERE key='rent_email_preset';")
     ep_row = cur.fetchone()
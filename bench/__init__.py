@@ -0,0 +1,10 @@
+# bench/__init__.py
+"""
+Performance benchmarks (not shipped with the app).
+
+    python -m bench.run --help
+
+bench.dataset builds a deterministic synthetic data set in bench_data/ and
+points the apps at it via QP_APP_DATA_DIR, so the real app_data is never
+touched; bench.run drives the apps against it and stores JSON results.
+"""
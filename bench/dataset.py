@@ -0,0 +1,408 @@
+# bench/dataset.py
+"""
+Deterministic synthetic data set for the benchmarks.
+
+The same scale and seed always produce the same rows, so runs on different
+commits (or machines) measure the same work. The schema, seeded settings and
+templates come from main.init_databases(), exactly as on a production start;
+the generator only bulk-loads business data on top:
+
+    products, prices          (pricing, sale price list)
+    offers, offer_items       (offer app)
+    rent clients, equipment, contracts with stored calculations, documents
+    PDF fixture offers        PDF_FIXTURE_LINES lines each, without and with
+                              product photos (generated JPEGs), for bench.pdf
+
+Data sets live in bench_data/<scale>-<seed>/ (an app_data layout) and are
+reused until GENERATOR_VERSION changes or --rebuild is given. The "large"
+scale is sized like a big tenant and takes about a minute to build.
+"""
+import json
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+from datetime import date, timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DATA_DIR = os.path.join(BASE_DIR, "bench_data")
+
+# Bump when the generated data changes, so stale data sets are rebuilt
+GENERATOR_VERSION = 2
+DEFAULT_SEED = 1
+
+# Row counts per scale; prices, offer items and documents are averages
+SCALES = {
+    "small": dict(products=2_000, prices_per_product=5, offers=1_000, items_per_offer=10,
+                  contracts=500, clients=100, equipment=50),
+    "medium": dict(products=20_000, prices_per_product=10, offers=10_000, items_per_offer=20,
+                   contracts=2_000, clients=500, equipment=150),
+    "large": dict(products=100_000, prices_per_product=20, offers=50_000, items_per_offer=20,
+                  contracts=10_000, clients=2_000, equipment=300),
+}
+
+# Offer sizes rendered by bench.pdf; fixture offers are numbered pdf_fixture_number()
+PDF_FIXTURE_LINES = (1, 20, 100, 500)
+
+_BATCH = 20_000
+_PHOTOS = 24
+_SYLLABLES = ["ka", "ro", "mi", "tel", "dan", "ex", "vo", "lin", "sa", "pro",
+              "ter", "nu", "ax", "del", "ma", "zen", "or", "qui", "bel", "tro"]
+_FEATURES = ["Touch screen", "Wi-Fi", "Self-test", "Low noise", "Stainless steel",
+             "USB export", "Battery backup", "Auto calibration", "LED display", "Foot pedal"]
+
+
+def data_dir_for(scale, seed=DEFAULT_SEED):
+    return os.path.join(BENCH_DATA_DIR, f"{scale}-{seed}")
+
+
+def pdf_fixture_number(lines, photos):
+    return f"PDF-{lines:04d}" + ("-FOTO" if photos else "")
+
+
+def prepare(scale="small", seed=DEFAULT_SEED, rebuild=False):
+    """
+    Point the apps at the data set for scale/seed (QP_APP_DATA_DIR), building
+    it first if needed, and return its manifest. Must run before main or any
+    shared module is imported, since shared.config reads the path on import.
+    """
+    if scale not in SCALES:
+        raise ValueError(f"Unknown scale {scale!r}; choose from {', '.join(SCALES)}")
+    data_dir = data_dir_for(scale, seed)
+    config = sys.modules.get("shared.config")
+    if config is not None and os.path.abspath(config.APP_DATA_DIR) != data_dir:
+        raise RuntimeError("shared.config was imported before bench.dataset.prepare()")
+    os.environ["QP_APP_DATA_DIR"] = data_dir
+
+    manifest = _read_manifest(data_dir)
+    if rebuild or manifest is None or manifest.get("generator_version") != GENERATOR_VERSION:
+        shutil.rmtree(data_dir, ignore_errors=True)
+        os.makedirs(data_dir)
+        manifest = generate(data_dir, scale, seed)
+    return manifest
+
+
+def _read_manifest(data_dir):
+    try:
+        with open(os.path.join(data_dir, "dataset.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# ─── Generation ────────────────────────────────────────────────────────────────
+
+def generate(data_dir, scale, seed):
+    sizes = SCALES[scale]
+    started = time.perf_counter()
+    print(f"Building {scale} data set (seed {seed}) in {data_dir} ...")
+
+    # Schema, default settings, PDF and rent templates, exactly as production
+    from main import init_databases
+    init_databases()
+
+    conn = sqlite3.connect(os.path.join(data_dir, "pricing.db"))
+    conn.execute("PRAGMA synchronous = OFF;")
+    # Change-log and revision triggers would fire per row; drop them for the
+    # bulk load and recreate them afterwards
+    triggers = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger';").fetchall()
+    for name, _ in triggers:
+        conn.execute(f"DROP TRIGGER {name};")
+
+    rng = random.Random(seed)
+    brands = sorted({_word(rng, 2).capitalize() for _ in range(80)})[:60]
+    categories = sorted({_word(rng, 3).capitalize() for _ in range(60)})[:40]
+    counts = {}
+    counts["products"], counts["prices"] = _products(conn, rng, sizes, brands, categories)
+    counts["offers"], counts["offer_items"] = _offers(conn, rng, sizes)
+    counts["rent_contracts"], counts["rent_contract_documents"] = _rent(conn, rng, sizes)
+    counts["pdf_fixture_offers"] = _pdf_fixtures(conn, rng, os.path.join(data_dir, "product_images"))
+
+    for _, sql in triggers:
+        conn.execute(sql)
+    conn.execute("""
+        INSERT INTO global_settings (key, value) VALUES ('catalog_revision', '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;
+    """)
+    conn.commit()
+    conn.execute("ANALYZE;")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+    conn.close()
+
+    manifest = {
+        "generator_version": GENERATOR_VERSION,
+        "scale": scale,
+        "seed": seed,
+        "counts": counts,
+        "build_seconds": round(time.perf_counter() - started, 1),
+    }
+    with open(os.path.join(data_dir, "dataset.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Data set ready in {manifest['build_seconds']} s: {counts}")
+    return manifest
+
+
+def _word(rng, syllables):
+    return "".join(rng.choice(_SYLLABLES) for _ in range(syllables))
+
+
+def _description(rng, name):
+    features = rng.sample(_FEATURES, rng.randint(2, 5))
+    lines = [f"**{name}** for daily clinical use, {rng.randint(1, 5)} year warranty.",
+             *(f"- {feature}" for feature in features),
+             "",
+             f"Power: {rng.randint(50, 2000)} W, weight {rng.randint(2, 150)} kg."]
+    return "\n".join(lines)
+
+
+def _batched(conn, sql, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= _BATCH:
+            conn.executemany(sql, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(sql, batch)
+
+
+def _products(conn, rng, sizes, brands, categories):
+    conn.executemany("INSERT OR IGNORE INTO brands (name) VALUES (?);", [(b,) for b in brands])
+    conn.executemany("""
+        INSERT OR IGNORE INTO category_pricing_defaults
+            (category, import_percent, margin_percent, domestic_transport, default_extras)
+        VALUES (?, ?, ?, ?, ?);
+    """, [(c, rng.choice([0.05, 0.07, 0.1]), rng.choice([0.25, 0.4, 0.6]), rng.choice([0, 20, 50]), 0)
+          for c in categories])
+
+    n_products = sizes["products"]
+    start_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM products;").fetchone()[0]) + 1
+
+    def product_rows():
+        for i in range(n_products):
+            brand = rng.choice(brands)
+            name = f"{brand} {_word(rng, 2).upper()}-{rng.randint(100, 9999)}"
+            yield (start_id + i, name, _description(rng, name), rng.choice(categories), brand)
+
+    _batched(conn, """
+        INSERT INTO products (id, name, description, category, brand)
+        VALUES (?, ?, ?, ?, ?);
+    """, product_rows())
+
+    first_day = date(2019, 1, 1)
+    span_days = (date(2025, 12, 31) - first_day).days
+    n_prices = 0
+
+    def price_rows():
+        nonlocal n_prices
+        avg = sizes["prices_per_product"]
+        for product_id in range(start_id, start_id + n_products):
+            base_price = round(math.exp(rng.uniform(3, 10)), 2)
+            days = sorted(rng.sample(range(span_days), rng.randint(1, 2 * avg - 1)))
+            for day in days:
+                base_price = round(base_price * rng.uniform(0.97, 1.08), 2)
+                import_percent, margin_percent, transport = 0.07, rng.choice([0.25, 0.4, 0.6]), 20.0
+                cost_total = base_price * (1 + import_percent) + transport
+                calculated = cost_total * (1 + margin_percent)
+                final_price = math.ceil(calculated / 10) * 10
+                discount_percent = rng.choice([0, 0, 0.05, 0.1])
+                discount_price = round(final_price * (1 - discount_percent), 2) if discount_percent else None
+                n_prices += 1
+                yield (product_id, (first_day + timedelta(days=day)).isoformat(), base_price, 0,
+                       import_percent, margin_percent, transport, base_price, cost_total, calculated,
+                       final_price, final_price - cost_total, discount_percent, discount_price,
+                       (discount_price - cost_total) if discount_price else None)
+
+    _batched(conn, """
+        INSERT INTO prices (product_id, date, base_price, extras, import_percent, margin_percent,
+                            domestic_transport, base_total, cost_total, calculated_price,
+                            final_price, profit_final, discount_percent, discount_price, profit_discount)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """, price_rows())
+    conn.commit()
+    return n_products, n_prices
+
+
+def _offers(conn, rng, sizes):
+    n_offers = sizes["offers"]
+    products = conn.execute("""
+        SELECT p.id, p.name, p.description, COALESCE(pr.final_price, 0)
+        FROM products p
+        LEFT JOIN prices pr ON pr.id = (SELECT MAX(id) FROM prices WHERE product_id = p.id);
+    """).fetchall()
+    clients = [f"{_word(rng, 3).capitalize()} d.o.o." for _ in range(max(50, n_offers // 20))]
+    start_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM offers;").fetchone()[0]) + 1
+    first_day = date(2020, 1, 1)
+    offers, n_items = [], 0
+
+    def item_rows():
+        nonlocal n_items
+        avg = sizes["items_per_offer"]
+        for offer_id in range(start_id, start_id + n_offers):
+            total_net = 0.0
+            for line in range(rng.randint(1, 2 * avg - 1)):
+                product_id, name, description, price = rng.choice(products)
+                quantity = rng.choice([1, 1, 1, 2, 3, 5, 10])
+                discount = rng.choice([0, 0, 0, 5, 10])
+                line_net = quantity * price * (1 - discount / 100.0)
+                total_net += line_net
+                n_items += 1
+                yield (offer_id, product_id, line + 1, name, description, quantity, price, line_net, discount)
+            offers.append((offer_id, total_net))
+
+    _batched(conn, """
+        INSERT INTO offer_items (offer_id, product_id, line_order, item_name, item_description,
+                                 quantity, unit_price, line_net, discount_percent)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """, item_rows())
+
+    def offer_rows():
+        for offer_id, total_net in offers:
+            day = first_day + timedelta(days=(offer_id - start_id) * 2000 // max(n_offers, 1))
+            discount = rng.choice([0, 0, 0.05, 0.1])
+            net_after = total_net * (1 - discount)
+            vat = net_after * 0.2
+            yield (offer_id, f"{day.year}-{offer_id:06d}", day.isoformat(), rng.choice(clients),
+                   "Bulevar 1, Beograd", "office@example.com", rng.choice(["EUR", "RSD"]), 117.2,
+                   discount, 0.2, total_net, total_net - net_after, net_after, net_after, net_after,
+                   vat, net_after + vat, "Avans", "30 dana", 30, int(rng.random() < 0.01))
+
+    _batched(conn, """
+        INSERT INTO offers (id, offer_number, date, client_name, client_address, client_email,
+                            currency, exchange_rate, discount_percent, vat_percent, total_net,
+                            total_discount, total_net_after_discount, total_net_after_special_discount,
+                            total_net_after_third_discount, total_vat, total_gross,
+                            payment_terms, delivery_terms, validity_days, is_template)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """, offer_rows())
+    conn.commit()
+    return n_offers, n_items
+
+
+def _rent(conn, rng, sizes):
+    from rent.app import RENT_CALC_COLUMNS, contract_calc_values
+    from shared.blobstore import content_hash, pack_text
+
+    clients = [(f"{_word(rng, 3).capitalize()} d.o.o.", f"{rng.randint(10**7, 10**8 - 1)}",
+                f"{rng.randint(10**8, 10**9 - 1)}") for _ in range(sizes["clients"])]
+    conn.executemany("""
+        INSERT INTO rent_clients (name, mb, pib, address, representative, email)
+        VALUES (?, ?, ?, 'Bulevar 1, Beograd', 'Direktor', 'office@example.com');
+    """, clients)
+    equipment = [(f"{_word(rng, 2).capitalize()} {rng.randint(100, 999)}", round(rng.uniform(2_000, 80_000), -1))
+                 for _ in range(sizes["equipment"])]
+    conn.executemany("INSERT INTO rent_equipment (name, price) VALUES (?, ?);", equipment)
+
+    slugs = [row[0] for row in conn.execute("SELECT slug FROM rent_templates ORDER BY id;")]
+    start_id = (conn.execute("SELECT COALESCE(MAX(id), 0) FROM rent_contracts;").fetchone()[0]) + 1
+    n_contracts = sizes["contracts"]
+    first_day = date(2021, 1, 1)
+    columns = ["id", "contract_number", "contract_date", "client_name", "client_mb", "client_pib",
+               "equipment_model", "price", "vat_percent", "period_months", "downpayment_percent",
+               "salvage_value_percent", "interest_rate", "insurance_rate", "guarantee_rate", "admin_fee",
+               *RENT_CALC_COLUMNS]
+    documents = []
+
+    def contract_rows():
+        for contract_id in range(start_id, start_id + n_contracts):
+            client = rng.choice(clients)
+            model, price = rng.choice(equipment)
+            day = first_day + timedelta(days=(contract_id - start_id) * 1800 // max(n_contracts, 1))
+            c = {
+                "id": contract_id, "contract_number": f"{contract_id:05d}/{day.year}",
+                "contract_date": day.isoformat(), "client_name": client[0], "client_mb": client[1],
+                "client_pib": client[2], "equipment_model": model, "price": price, "vat_percent": 20.0,
+                "period_months": rng.choice([24, 36, 48, 60]), "downpayment_percent": rng.choice([10.0, 20.0, 30.0]),
+                "salvage_value_percent": 20.0, "interest_rate": rng.choice([9.0, 12.0, 14.0]),
+                "insurance_rate": 1.13, "guarantee_rate": 5.0, "admin_fee": 50.0,
+            }
+            c.update(contract_calc_values(c))
+            # Most documents are untouched copies of the template (stored empty); some were edited
+            for slug in rng.sample(slugs, min(len(slugs), rng.randint(1, 3))):
+                if rng.random() < 0.3:
+                    text = f"<h1>Ugovor {c['contract_number']}</h1>" + "<p>Izmenjen član ugovora.</p>" * rng.randint(5, 40)
+                    documents.append((contract_id, slug, pack_text(text), content_hash(text), day.isoformat()))
+                else:
+                    documents.append((contract_id, slug, "", None, day.isoformat()))
+            yield tuple(c[col] for col in columns)
+
+    _batched(conn, f"""
+        INSERT INTO rent_contracts ({', '.join(columns)})
+        VALUES ({', '.join('?' * len(columns))});
+    """, contract_rows())
+    _batched(conn, """
+        INSERT INTO rent_contract_documents (contract_id, template_slug, custom_content_html, content_hash, updated_at)
+        VALUES (?, ?, ?, ?, ?);
+    """, documents)
+    conn.commit()
+    return n_contracts, len(documents)
+
+
+def _photo(rng, path):
+    # Busy gradients and shapes, so the JPEG is about as heavy as a real product photo
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (800, 600))
+    draw = ImageDraw.Draw(image)
+    base = [rng.randint(0, 255) for _ in range(3)]
+    for y in range(600):
+        draw.line([(0, y), (800, y)], fill=tuple((c + y // 3) % 256 for c in base))
+    for _ in range(60):
+        x, y = rng.randint(0, 780), rng.randint(0, 580)
+        draw.ellipse([x, y, x + rng.randint(10, 200), y + rng.randint(10, 200)],
+                     fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    image.save(path, "JPEG", quality=85)
+
+
+def _pdf_fixtures(conn, rng, image_dir):
+    os.makedirs(image_dir, exist_ok=True)
+    photos = []
+    for i in range(_PHOTOS):
+        name = f"bench_photo_{i:02d}.jpg"
+        _photo(rng, os.path.join(image_dir, name))
+        photos.append(name)
+
+    products = conn.execute("""
+        SELECT p.id, p.name, p.description, COALESCE(pr.final_price, 0)
+        FROM products p
+        LEFT JOIN prices pr ON pr.id = (SELECT MAX(id) FROM prices WHERE product_id = p.id)
+        ORDER BY p.id LIMIT 1000;
+    """).fetchall()
+    count = 0
+    for lines in PDF_FIXTURE_LINES:
+        for with_photos in (False, True):
+            cur = conn.execute("""
+                INSERT INTO offers (offer_number, date, client_name, client_address, client_email,
+                                    currency, exchange_rate, discount_percent, vat_percent,
+                                    payment_terms, delivery_terms, validity_days, notes, is_template)
+                VALUES (?, '2025-06-01', 'Benchmark Klinika d.o.o.', 'Bulevar 1, Beograd',
+                        'office@example.com', 'EUR', 117.2, 0.05, 0.2, 'Avans', '30 dana', 30,
+                        'Cene su izražene bez PDV-a.', 0);
+            """, (pdf_fixture_number(lines, with_photos),))
+            offer_id = cur.lastrowid
+            items = []
+            for line in range(lines):
+                product_id, name, description, price = products[line % len(products)]
+                photo = photos[line % len(photos)] if with_photos else None
+                items.append((offer_id, product_id, line + 1, name, description, photo, 1, price, price, 0))
+            conn.executemany("""
+                INSERT INTO offer_items (offer_id, product_id, line_order, item_name, item_description,
+                                         item_photo_path, quantity, unit_price, line_net, discount_percent)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+            """, items)
+            total_net = sum(item[8] for item in items)
+            net_after = total_net * 0.95
+            conn.execute("""
+                UPDATE offers
+                SET total_net = ?, total_discount = ?, total_net_after_discount = ?,
+                    total_net_after_special_discount = ?, total_net_after_third_discount = ?,
+                    total_vat = ?, total_gross = ?
+                WHERE id = ?;
+            """, (total_net, total_net - net_after, net_after, net_after, net_after,
+                  net_after * 0.2, net_after * 1.2, offer_id))
+            count += 1
+    conn.commit()
+    return count
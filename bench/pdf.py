@@ -0,0 +1,193 @@
+# bench/pdf.py
+"""
+PDF rendering benchmark and regression gate.
+
+    python -m bench.pdf --save-baseline      # measure and store as the baseline
+    python -m bench.pdf                      # measure; exit 1 on a regression
+    python -m bench.pdf --lines 20 --lines 100 --repeat 5
+
+Every PDF template (each pdf_templates row, plus the filesystem default)
+renders the bench.dataset fixture offers of 1, 20, 100 and 500 lines,
+without and with product photos, through the real offer_pdf route. Each
+case runs in a fresh process after one warm-up render of the 1-line
+offer (which pays the WeasyPrint import and font setup), so the peak RSS
+belongs to that template and offer size alone.
+
+Per case: median request time, median WeasyPrint time (Server-Timing),
+peak RSS, PDF size and page count. Against the baseline a case fails when
+it is more than --max-slowdown slower, --max-rss-growth hungrier or
+--max-size-growth bigger; changes below the noise floors are ignored.
+Baselines are machine specific, so keep one per machine (or CI runner).
+"""
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from bench.dataset import DEFAULT_SEED, PDF_FIXTURE_LINES, SCALES, pdf_fixture_number, prepare
+from bench.run import RESULTS_DIR, git_commit, have_weasyprint, logged_in_client, percentiles, server_timing
+
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "pdf-baseline.json")
+
+# Absolute changes below these never fail the gate (timer and allocator noise)
+NOISE_MS = 50.0
+NOISE_RSS_MB = 10.0
+NOISE_SIZE_KB = 10.0
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _render(client, offer_id, template_id):
+    url = f"/offer/offers/{offer_id}/pdf?preview_template_id={template_id}"
+    started = time.perf_counter()
+    response = client.get(url)
+    data = response.get_data()
+    response.close()
+    elapsed = (time.perf_counter() - started) * 1000
+    if response.status_code != 200:
+        raise RuntimeError(f"GET {url} returned {response.status_code}")
+    return elapsed, server_timing(response).get("pdf", 0.0), data
+
+
+def _measure(case):
+    """One template/offer case, in its own process (QP_APP_DATA_DIR is inherited)."""
+    from pypdf import PdfReader
+    from shared.instrumentation import access_log
+    from shared.db import get_db
+
+    access_log.setLevel(logging.WARNING)
+    client = logged_in_client()
+    conn = get_db()
+    ids = dict(conn.execute("SELECT offer_number, id FROM offers WHERE offer_number LIKE 'PDF-%';").fetchall())
+    conn.close()
+
+    _render(client, ids[pdf_fixture_number(1, False)], case["template_id"])
+    times, pdf_times = [], []
+    for _ in range(case["repeat"]):
+        elapsed, pdf_ms, data = _render(client, ids[pdf_fixture_number(case["lines"], case["photos"])],
+                                        case["template_id"])
+        times.append(elapsed)
+        pdf_times.append(pdf_ms)
+    return {
+        **case,
+        "ms": percentiles(times)["p50"],
+        "pdf_ms": percentiles(pdf_times)["p50"],
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "size_kb": round(len(data) / 1024, 1),
+        "pages": len(PdfReader(io.BytesIO(data)).pages),
+    }
+
+
+def _case_name(case):
+    return f"{case['template']} / {case['lines']} lines" + (" + photos" if case["photos"] else "")
+
+
+def _templates():
+    from shared.db import get_db
+
+    conn = get_db()
+    rows = conn.execute("SELECT id, name FROM pdf_templates ORDER BY id;").fetchall()
+    conn.close()
+    # preview_template_id=0 selects the filesystem template (offer/templates/pdf_offer.html)
+    return [(0, "Filesystem default")] + [(row["id"], row["name"]) for row in rows]
+
+
+def run_cases(lines, repeat):
+    cases = [{"template_id": template_id, "template": name, "lines": n, "photos": photos, "repeat": repeat}
+             for template_id, name in _templates() for n in lines for photos in (False, True)]
+    results = {}
+    # A new process per case: peak RSS is per process and cannot be reset
+    with multiprocessing.get_context("spawn").Pool(1, maxtasksperchild=1) as pool:
+        for result in pool.imap(_measure, cases, chunksize=1):
+            name = _case_name(result)
+            results[name] = result
+            print(f"  {name:<45} {result['ms']:9.1f} ms  (pdf {result['pdf_ms']:9.1f} ms)  "
+                  f"{result['peak_rss_mb']:7.1f} MB peak  {result['size_kb']:8.1f} KB  {result['pages']:3d} p.")
+    return results
+
+
+# ─── Gate ──────────────────────────────────────────────────────────────────────
+
+def regressions(baseline, results, max_slowdown, max_rss_growth, max_size_growth):
+    """Human-readable failures of results against baseline (empty when the gate passes)."""
+    failures = []
+    checks = [("ms", max_slowdown, NOISE_MS, "ms"),
+              ("peak_rss_mb", max_rss_growth, NOISE_RSS_MB, "MB peak RSS"),
+              ("size_kb", max_size_growth, NOISE_SIZE_KB, "KB")]
+    for name, new in results.items():
+        old = baseline.get("cases", {}).get(name)
+        if not old:
+            continue
+        for key, allowed, noise, unit in checks:
+            limit = old[key] * (1 + allowed)
+            if new[key] > limit and new[key] - old[key] > noise:
+                failures.append(f"{name}: {old[key]:.1f} -> {new[key]:.1f} {unit} "
+                                f"({(new[key] / old[key] - 1) * 100:+.0f}%, allowed +{allowed * 100:.0f}%)")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.pdf", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--lines", type=int, action="append", choices=PDF_FIXTURE_LINES,
+                        help="offer size to render (repeatable; default all)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed renders per case (default 3)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="baseline file (default bench/results/pdf-baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--max-slowdown", type=float, default=0.25, help="allowed render time growth (default 0.25)")
+    parser.add_argument("--max-rss-growth", type=float, default=0.25, help="allowed peak RSS growth (default 0.25)")
+    parser.add_argument("--max-size-growth", type=float, default=0.10, help="allowed PDF size growth (default 0.10)")
+    parser.add_argument("--output", help="result file (default bench/results/pdf-<time>.json)")
+    args = parser.parse_args(argv)
+
+    manifest = prepare(args.scale, args.seed)
+    if not have_weasyprint():
+        print("WeasyPrint is not available; cannot render PDFs.")
+        return 2
+
+    print(f"\nPDF rendering ({args.repeat} renders per case, median):")
+    results = run_cases(sorted(args.lines or PDF_FIXTURE_LINES), args.repeat)
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "dataset": manifest,
+        "repeat": args.repeat,
+        "cases": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("pdf-%Y%m%d-%H%M%S.json"))
+    for path in [output] + ([args.baseline] if args.save_baseline else []):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    print(f"\nResults written to {output}")
+    if args.save_baseline:
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline yet; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    failures = regressions(baseline, results, args.max_slowdown, args.max_rss_growth, args.max_size_growth)
+    print(f"\nCompared with baseline {baseline.get('created')} ({baseline.get('commit') or 'unknown commit'}):")
+    if failures:
+        for failure in failures:
+            print(f"  REGRESSION {failure}")
+        return 1
+    print("  no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
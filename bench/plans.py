@@ -0,0 +1,244 @@
+# bench/plans.py
+"""
+Query-plan regression checks for the hot SQL.
+
+    python -m bench.plans             # report; exit 1 when a check fails
+    python -m bench.plans --verbose   # print every plan, not just failures
+
+Each check requests a page of the real apps (bench data set, medium scale
+by default so the planner sees realistic statistics) with the request
+profiler on, takes the statements that request actually executed and
+their EXPLAIN QUERY PLAN from the profile, and checks the statement that
+matches the check's pattern:
+
+- every index in "indexes" is used,
+- no table or index is scanned ("SCAN t", "SCAN t USING INDEX i" walk
+  every row just the same), no temporary B-tree is built for ORDER BY /
+  DISTINCT / GROUP BY, and no automatic index is created, unless the
+  check allows it (with the reason).
+
+Because the SQL comes from the running code, a query edit that stops
+using an index fails just like a schema change that drops it; a pattern
+that no longer matches anything fails too.
+"""
+import argparse
+import logging
+import re
+import sys
+
+from bench.dataset import DEFAULT_SEED, SCALES, prepare
+from bench.run import logged_in_client
+
+# url placeholders are filled from the data set (see _url_values)
+HOT_QUERIES = [
+    {
+        "name": "Latest price per product (product list, price sort)",
+        "url": "/pricing/products?brand=&category=&search=&sort=price_asc&page=3",
+        "statement": r"LEFT JOIN prices pr.*LIMIT",
+        "indexes": ["idx_prices_product_id"],
+        "allow": {
+            "SCAN p": "every product is ranked by its current price",
+            "TEMP B-TREE FOR ORDER BY": "the sort key is the joined latest price",
+        },
+    },
+    {
+        "name": "Latest price per product (product list, brand filter)",
+        "url": "/pricing/products?brand={brand}&category=&search=&sort=name_asc&page=1",
+        "statement": r"LEFT JOIN prices pr.*LIMIT",
+        "indexes": ["idx_prices_product_id", "idx_products_brand"],
+        "allow": {"TEMP B-TREE FOR ORDER BY": "one brand's products are sorted by name"},
+    },
+    {
+        "name": "Offer list",
+        "url": "/offer/offers?view=offers&search=&date_from=&date_to=&item=&country=&page=2",
+        "statement": r"SELECT \*\s+FROM offers.*ORDER BY date DESC",
+        "indexes": ["idx_offers_template_date"],
+        "allow": {},
+    },
+    {
+        "name": "Offer list count",
+        "url": "/offer/offers?view=offers&search=&date_from=&date_to=&item=&country=&page=1",
+        "statement": r"SELECT COUNT\(\*\) AS total_count\s+FROM offers",
+        "indexes": ["idx_offers_template_date"],
+        "allow": {},
+    },
+    {
+        "name": "Offer list, date range filter",
+        "url": "/offer/offers?view=offers&search=&date_from={date_from}&date_to={date_to}&item=&country=&page=1",
+        "statement": r"SELECT \*\s+FROM offers.*date >= \?",
+        "indexes": ["idx_offers_template_date"],
+        "allow": {},
+    },
+    {
+        "name": "Offer list, client search",
+        "url": "/offer/offers?view=offers&search={client}&date_from=&date_to=&item=&country=&page=1",
+        "statement": r"SELECT \*\s+FROM offers.*client_name LIKE",
+        "indexes": ["idx_offers_template_date"],
+        "allow": {},
+    },
+    {
+        "name": "Offer list, item filter join",
+        "url": "/offer/offers?view=offers&search=&date_from=&date_to=&item={product_id}&country=&page=1",
+        "statement": r"SELECT DISTINCT o\.\*",
+        "indexes": ["idx_offer_items_product_id"],
+        "allow": {
+            "TEMP B-TREE FOR DISTINCT": "only the offers containing the product",
+            "TEMP B-TREE FOR ORDER BY": "only the offers containing the product",
+        },
+    },
+    {
+        "name": "Offer list, item filter count",
+        "url": "/offer/offers?view=offers&search=&date_from=&date_to=&item={product_id}&country=&page=1",
+        "statement": r"COUNT\(DISTINCT o\.id\)",
+        "indexes": ["idx_offer_items_product_id"],
+        "allow": {"TEMP B-TREE FOR count(DISTINCT)": "only the offers containing the product"},
+    },
+    {
+        "name": "Offer items (edit offer)",
+        "url": "/offer/offers/{offer_id}/edit",
+        "statement": r"FROM offer_items\s+WHERE offer_id = \?",
+        "indexes": ["idx_offer_items_offer_id"],
+        "allow": {"TEMP B-TREE FOR ORDER BY": "one offer's lines are sorted by line order"},
+    },
+    {
+        "name": "Rent contract list",
+        "url": "/rent/contracts?sort=date_desc&page=2",
+        "statement": r"SELECT \* FROM rent_contracts.*LIMIT",
+        "indexes": ["idx_rent_contracts_date"],
+        "allow": {
+            "SCAN rent_contracts USING INDEX idx_rent_contracts_date":
+                "rows are read in date order and the walk stops after one page",
+        },
+    },
+    {
+        "name": "Rent contract list, date range",
+        "url": "/rent/contracts?date_from={date_from}&date_to={date_to}&sort=rata_desc",
+        "statement": r"SELECT \* FROM rent_contracts.*contract_date >= \?.*LIMIT",
+        "indexes": ["idx_rent_contracts_date"],
+        "allow": {"TEMP B-TREE FOR ORDER BY": "only the contracts in the date range are sorted"},
+    },
+    {
+        "name": "Rent contract search",
+        "url": "/rent/contracts?search={client}&sort=rata_desc",
+        "statement": r"SELECT \* FROM rent_contracts.*LIKE.*LIMIT",
+        "indexes": ["idx_rent_contracts_rata_bruto"],
+        "allow": {
+            "SCAN rent_contracts USING INDEX idx_rent_contracts_rata_bruto":
+                "a substring LIKE cannot search a B-tree; matches are found in sort order "
+                "and the walk stops after one page of them",
+        },
+    },
+    {
+        "name": "Rent client typeahead",
+        "url": "/rent/api/clients/search?q={rent_client}&limit=20",
+        "statement": r"FROM rent_clients\s+WHERE name",
+        "indexes": ["idx_rent_clients_name (name>? AND name<?)"],
+        "allow": {},
+    },
+    {
+        "name": "Rent equipment typeahead",
+        "url": "/rent/api/equipment/search?q={rent_equipment}&limit=20",
+        "statement": r"FROM rent_equipment\s+WHERE name",
+        "indexes": ["idx_rent_equipment_name (name>? AND name<?)"],
+        "allow": {},
+    },
+]
+
+_SCAN_RE = re.compile(r"^SCAN \S+")
+_PROBLEM_MARKERS = ("TEMP B-TREE", "AUTOMATIC")
+
+
+def _url_values():
+    from shared.db import get_db
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT brand FROM products GROUP BY brand ORDER BY COUNT(*) DESC LIMIT 1;")
+    brand = cur.fetchone()[0]
+    cur.execute("SELECT product_id FROM offer_items WHERE offer_id = (SELECT MAX(offer_id) FROM offer_items);")
+    product_id = cur.fetchone()[0]
+    cur.execute("SELECT MAX(id), MAX(date), MAX(client_name) FROM offers WHERE is_template = 0;")
+    offer_id, last, client = cur.fetchone()
+    cur.execute("SELECT MAX(name) FROM rent_clients;")
+    rent_client = cur.fetchone()[0]
+    cur.execute("SELECT MAX(name) FROM rent_equipment;")
+    rent_equipment = cur.fetchone()[0]
+    conn.close()
+    return {
+        "brand": brand, "product_id": product_id, "offer_id": offer_id, "client": client[:4],
+        "date_from": f"{last[:4]}-01-01", "date_to": f"{last[:4]}-03-31",
+        "rent_client": rent_client[:2].lower(), "rent_equipment": rent_equipment[:2].lower(),
+    }
+
+
+def problems(plan, allow):
+    """Plan lines that break the rules and are not allowed by the check."""
+    found = []
+    for line in plan:
+        detail = line.strip()
+        if not (_SCAN_RE.match(detail) or any(marker in detail for marker in _PROBLEM_MARKERS)):
+            continue
+        if not any(re.search(rf"(?<!\S){re.escape(allowed)}(?!\S)", detail) for allowed in allow):
+            found.append(detail)
+    return found
+
+
+def run_check(client, check, values):
+    """(ok, statement, plan, failures) for one check."""
+    from shared.profiler import load_profile
+
+    response = client.get(check["url"].format(**values), headers={"X-QP-Profile": "1"})
+    response.close()
+    profile_id = response.headers.get("X-QP-Profile")
+    if response.status_code != 200 or not profile_id:
+        return False, None, [], [f"request failed ({response.status_code}) or was not profiled"]
+
+    pattern = re.compile(check["statement"], re.S)
+    queries = [q for q in load_profile(profile_id)["queries"] if pattern.search(q["sql"])]
+    if not queries:
+        return False, None, [], ["no executed statement matches the check's pattern (query changed?)"]
+
+    failures = []
+    for query in queries:
+        used = "\n".join(query["plan"])
+        failures += [f"index {name} not used" for name in check["indexes"] if name not in used]
+        failures += problems(query["plan"], check["allow"])
+    return not failures, queries[0]["sql"], queries[0]["plan"], failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.plans", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=list(SCALES), default="medium")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--verbose", action="store_true", help="print the plan of passing checks too")
+    args = parser.parse_args(argv)
+
+    prepare(args.scale, args.seed)
+    from shared.instrumentation import access_log
+    access_log.setLevel(logging.WARNING)
+
+    client = logged_in_client()
+    values = _url_values()
+    failed = 0
+    print()
+    for check in HOT_QUERIES:
+        ok, sql, plan, failures = run_check(client, check, values)
+        failed += not ok
+        print(f"{'PASS' if ok else 'FAIL'}  {check['name']}")
+        if ok and not args.verbose:
+            continue
+        if sql:
+            print("      " + " ".join(sql.split())[:200])
+        for line in plan:
+            print("        " + line)
+        for failure in failures:
+            print(f"      ! {failure}")
+        for allowed, reason in check["allow"].items():
+            print(f"      allowed: {allowed} ({reason})")
+        print()
+    print(f"\n{len(HOT_QUERIES) - failed} passed, {failed} failed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
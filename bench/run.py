@@ -0,0 +1,283 @@
+# bench/run.py
+"""
+Route and function benchmarks against the synthetic data set.
+
+    python -m bench.run                      # small data set, all benchmarks
+    python -m bench.run --scale large        # big tenant (built on first use)
+    python -m bench.run --only offer --iterations 100
+    python -m bench.run --compare bench/results/<earlier run>.json
+
+Routes are driven through the merged WSGI app (main.application) with the
+Werkzeug test client, logged in like a user, so routing, sessions, templates
+and SQL are all included; network and gunicorn are not. Each route reports
+p50/p95/p99 wall time plus SQL statements per request (Server-Timing).
+Microbenchmarks time single calls of hot helpers.
+
+Results are written as JSON to bench/results/ (or --output); --compare
+prints the change against an earlier result file.
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import time
+
+from bench.dataset import BASE_DIR, DEFAULT_SEED, SCALES, prepare
+
+RESULTS_DIR = os.path.join(BASE_DIR, "bench", "results")
+RESULT_VERSION = 1
+
+# name, URL (formatted with a random offer_id, page and search term), iterations factor
+ROUTES = [
+    ("pricing.list_products name", "/pricing/products?brand=&category=&search=&sort=name_asc&page={page}", 1),
+    ("pricing.list_products price", "/pricing/products?brand=&category=&search=&sort=price_asc&page={page}", 1),
+    ("pricing.list_products search", "/pricing/products?brand=&category=&search={term}&sort=price_desc&page=1", 1),
+    ("offer.list_offers", "/offer/offers?page={page}", 1),
+    ("offer.edit_offer", "/offer/offers/{offer_id}/edit", 1),
+    ("offer.offer_pdf", "/offer/offers/{offer_id}/pdf", 0.2),
+    ("rent.list_contracts", "/rent/contracts?sort=date_desc&page={page}", 1),
+    ("rent.list_contracts search", "/rent/contracts?search={term}&sort=rata_desc", 1),
+    ("sale.list_sale", "/sale/pricelist?brand=&category=&search=&sort=price_asc&page={page}", 1),
+]
+
+# Admin too: its session unlocks the request profiler (bench.plans)
+LOGINS = [("/pricing/login", "pricing"), ("/offer/login", "offer"), ("/rent/login", "rent"), ("/admin/login", "admin")]
+
+_SERVER_TIMING_RE = re.compile(r'(\w+);dur=([\d.]+)(?:;desc="(\d+) queries")?')
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+    return {
+        "n": len(ordered),
+        "p50": round(rank(50), 3),
+        "p95": round(rank(95), 3),
+        "p99": round(rank(99), 3),
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "max": round(ordered[-1], 3),
+    }
+
+
+def server_timing(response):
+    """{"app": ms, "sql": ms, "sql_count": n, "pdf": ms} from the Server-Timing header."""
+    timing = {}
+    for name, dur, count in _SERVER_TIMING_RE.findall(response.headers.get("Server-Timing", "")):
+        timing[name] = float(dur)
+        if count:
+            timing[f"{name}_count"] = int(count)
+    return timing
+
+
+# ─── Routes ────────────────────────────────────────────────────────────────────
+
+def logged_in_client():
+    """Werkzeug test client for main.application, logged in to every app that has a login."""
+    from werkzeug.test import Client
+    from main import application
+    from shared.auth import DEFAULT_PASSWORDS
+
+    client = Client(application)
+    for path, app_name in LOGINS:
+        response = client.post(path, data={"password": DEFAULT_PASSWORDS[app_name]})
+        response.close()
+        if response.status_code != 302:
+            raise RuntimeError(f"Login to {path} failed ({response.status_code})")
+    return client
+
+
+def _url_params(rng):
+    from shared.db import get_db
+
+    conn = get_db()
+    offer_ids = [r[0] for r in conn.execute("""
+        SELECT id FROM offers WHERE is_template = 0 AND offer_number NOT LIKE 'PDF-%';
+    """)]
+    names = [r[0] for r in conn.execute("SELECT client_name FROM rent_contracts LIMIT 200;")]
+    brands = [r[0] for r in conn.execute("SELECT name FROM brands;")]
+    conn.close()
+    return lambda: {
+        "offer_id": rng.choice(offer_ids),
+        "page": rng.randint(1, 40),
+        "term": rng.choice(names + brands)[:4],
+    }
+
+
+def have_weasyprint():
+    try:
+        import weasyprint  # noqa: F401
+        return True
+    except (ImportError, OSError):  # not installed, or its system libraries are missing
+        return False
+
+
+def bench_routes(iterations, only=None):
+    have_pdf = have_weasyprint()
+    client = logged_in_client()
+    params = _url_params(random.Random(DEFAULT_SEED))
+    results = {}
+    for name, template, factor in ROUTES:
+        if only and not any(o in name for o in only):
+            continue
+        if "pdf" in name and not have_pdf:
+            print(f"  {name:<30} skipped (WeasyPrint not available)")
+            continue
+        count = max(3, int(iterations * factor))
+        times, sql_counts, sql_ms, errors = [], [], [], 0
+        for i in range(count + 2):
+            url = template.format(**params())
+            started = time.perf_counter()
+            response = client.get(url)
+            response.get_data()
+            response.close()
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                errors += 1
+            if i < 2:
+                continue  # warm-up: imports, template compilation, snapshot build
+            times.append(elapsed)
+            timing = server_timing(response)
+            if "sql_count" in timing:
+                sql_ms.append(timing["sql"])
+                sql_counts.append(timing["sql_count"])
+        entry = {"url": template, **percentiles(times), "errors": errors}
+        if sql_counts:
+            entry["sql_per_request"] = round(sum(sql_counts) / len(sql_counts), 1)
+            entry["sql_ms_mean"] = round(sum(sql_ms) / len(sql_ms), 3)
+        results[name] = entry
+        print(f"  {name:<30} p50 {entry['p50']:9.2f} ms  p95 {entry['p95']:9.2f} ms  "
+              f"p99 {entry['p99']:9.2f} ms  sql/req {entry.get('sql_per_request', 0):6.1f}"
+              + (f"  ERRORS {errors}" if errors else ""))
+    return results
+
+
+# ─── Functions ─────────────────────────────────────────────────────────────────
+
+def _micro_cases(rng):
+    from pricing.app import apply_rounding
+    from rent.app import calculate_rent
+    from shared.markdown_render import clear_markdown_cache, render_markdown
+    from shared.utils import format_amount
+    from shared.db import get_db
+
+    conn = get_db()
+    texts = [r[0] for r in conn.execute("SELECT description FROM products ORDER BY id LIMIT 500;")]
+    conn.close()
+    rent_args = [(rng.uniform(2_000, 80_000), rng.choice([24, 36, 48, 60]), 20.0, 20.0,
+                  rng.choice([9.0, 14.0]), 1.13, 5.0, 20.0, 50.0) for _ in range(200)]
+    amounts = [rng.uniform(0, 1_000_000) for _ in range(200)]
+
+    def markdown_cold(text):
+        clear_markdown_cache()
+        return render_markdown(text)
+
+    # name, function, argument list, calls
+    return [
+        ("calculate_rent", lambda a: calculate_rent(*a), rent_args, 5_000),
+        ("apply_rounding", apply_rounding, amounts, 1_000),
+        ("format_amount", format_amount, amounts, 5_000),
+        ("render_markdown cached", render_markdown, texts[:20], 5_000),
+        ("render_markdown cold", markdown_cold, texts, 1_000),
+    ]
+
+
+def bench_functions(scale_factor, only=None):
+    results = {}
+    for name, func, args, calls in _micro_cases(random.Random(DEFAULT_SEED)):
+        if only and not any(o in name for o in only):
+            continue
+        calls = max(50, int(calls * scale_factor))
+        for a in args[:5]:
+            func(a)
+        times = []
+        for i in range(calls):
+            a = args[i % len(args)]
+            started = time.perf_counter_ns()
+            func(a)
+            times.append((time.perf_counter_ns() - started) / 1000)
+        results[name] = percentiles(times)
+        entry = results[name]
+        print(f"  {name:<30} p50 {entry['p50']:9.2f} µs  p95 {entry['p95']:9.2f} µs  p99 {entry['p99']:9.2f} µs")
+    return results
+
+
+# ─── Results ───────────────────────────────────────────────────────────────────
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline, result):
+    """Print p50/p95 of result against baseline for every benchmark both contain."""
+    print(f"\nCompared with {baseline.get('created')} ({baseline.get('commit') or 'unknown commit'}):")
+    for section, unit in (("routes", "ms"), ("functions", "µs")):
+        for name, new in result.get(section, {}).items():
+            old = baseline.get(section, {}).get(name)
+            if not old:
+                continue
+            changes = []
+            for key in ("p50", "p95"):
+                delta = (new[key] - old[key]) / old[key] * 100 if old[key] else 0.0
+                changes.append(f"{key} {old[key]:9.2f} -> {new[key]:9.2f} {unit} ({delta:+6.1f}%)")
+            print(f"  {name:<30} " + "   ".join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.run", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=list(SCALES), default="small")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--rebuild", action="store_true", help="regenerate the data set")
+    parser.add_argument("--iterations", type=int, default=50, help="requests per route (default 50)")
+    parser.add_argument("--only", action="append", help="run benchmarks whose name contains this (repeatable)")
+    parser.add_argument("--output", help="result file (default bench/results/<time>-<scale>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare with")
+    args = parser.parse_args(argv)
+
+    manifest = prepare(args.scale, args.seed, rebuild=args.rebuild)
+    # One JSON line per request would drown the report
+    from shared.instrumentation import access_log
+    access_log.setLevel(logging.WARNING)
+
+    print(f"\nRoutes ({args.iterations} requests each):")
+    routes = bench_routes(args.iterations, args.only)
+    print("\nFunctions:")
+    functions = bench_functions(args.iterations / 50, args.only)
+
+    result = {
+        "version": RESULT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "dataset": manifest,
+        "iterations": args.iterations,
+        "routes": routes,
+        "functions": functions,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + f"-{args.scale}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Production server settings for the merged QP-CRM app.
+
+    venv/bin/gunicorn -c gunicorn.conf.py main:application
+
+The app is imported once in the master process (preload_app) and the
+databases are initialized there, before the workers are forked, so workers
+start warm and migrations never run concurrently. Each worker serves
+requests on a small thread pool; several workers let list pages and PDF
+generation use all cores. Reloader and debugger are never enabled here.
+
+Signals to the master (pid in app_data/gunicorn.pid):
+    HUP   re-read this file and gracefully replace all workers
+    TERM  graceful shutdown (in-flight requests finish, up to graceful_timeout)
+    TTIN / TTOU  add / remove one worker
+
+With preload_app, HUP does not pick up code changes; restart (run_apps.sh)
+after updating the code.
+
+Every setting can be overridden from the environment:
+QP_BIND, QP_WORKERS, QP_THREADS, QP_MAX_REQUESTS, QP_TIMEOUT.
+"""
+import multiprocessing
+import os
+
+_BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+_APP_DATA_DIR = os.path.join(_BASE_DIR, "app_data")
+
+chdir = _BASE_DIR
+bind = os.environ.get("QP_BIND", "0.0.0.0:5000")
+
+# One worker per core; threads cover requests that mostly wait on SQLite or I/O
+workers = int(os.environ.get("QP_WORKERS", multiprocessing.cpu_count()))
+# Read by the app to share the cores out between the workers' PDF render pools (rent/pdf_bundle.py)
+os.environ["QP_WORKERS"] = str(workers)
+worker_class = "gthread"
+threads = int(os.environ.get("QP_THREADS", 4))
+
+preload_app = True
+
+# Recycle workers after N requests (jittered so they do not restart together)
+max_requests = int(os.environ.get("QP_MAX_REQUESTS", 1000))
+max_requests_jitter = max_requests // 10
+
+# PDF bundles and imports can take a while
+timeout = int(os.environ.get("QP_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+
+pidfile = os.path.join(_APP_DATA_DIR, "gunicorn.pid")
+# The app writes its own structured access log (shared/instrumentation.py)
+errorlog = "-"
+
+
+def on_starting(server):
+    # Runs once in the master, after the preloaded import and before any fork
+    os.makedirs(_APP_DATA_DIR, exist_ok=True)
+    from main import init_databases
+    server.log.info("Initializing databases...")
+    init_databases()
+
+
+def post_fork(server, worker):
+    # Every worker runs the backup scheduler; a lock file lets only one of them back up at a time
+    from shared.backup_schedule import start_scheduler
+    start_scheduler()
+
+
+def worker_exit(server, worker):
+    # Keep the request metrics of recycled workers in the /metrics totals
+    from shared.instrumentation import retire_worker
+    retire_worker()
@@ -1,24 +1,37 @@
+import hmac
 import os
 import sys
+import time
+
+_STARTED = time.perf_counter()
 
 # Ensure shared modules can be imported
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 if CURRENT_DIR not in sys.path:
     sys.path.append(CURRENT_DIR)
 
-from flask import Flask, render_template, send_from_directory
+from flask import Flask, Response, render_template, request, send_from_directory
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 
 # Import the existing apps
 # Note: These imports might trigger some initialization code, which is fine.
 # We assume they have `if __name__ == "__main__":` blocks to prevent running servers.
-from pricing.app import app as pricing_app, init_db as pricing_init_db, migrate_schema as pricing_migrate_schema
+from pricing.app import app as pricing_app, init_db as pricing_init_db, migrate_schema as pricing_migrate_schema, prune_catalog_changes
 from offer.app import app as offer_app, init_db as offer_init_db
-from admin.app import app as admin_app, init_db as admin_init_db
+from admin.app import app as admin_app, init_db as admin_init_db, is_admin_request
 from sale.app import app as sale_app
 from settings.app import app as settings_app
 from rent.app import app as rent_app, init_db as rent_init_db
-from shared.config import STATIC_DIR, APP_ASSETS_DIR
+from shared.config import STATIC_DIR, APP_ASSETS_DIR, PDF_CACHE_DIR
+from shared.migrations import run_migrations, schema_version
+from admin.app import sync_system_pdf_template
+from shared.instrumentation import InstrumentationMiddleware, instrument_app, metrics_text, reset_metrics
+from shared.profiler import ProfilerMiddleware
+from shared.backup import recover_interrupted_restores, remove_stale_snapshots
+from rent.pdf_bundle import prune_cache as prune_pdf_cache
+
+# Seconds spent importing the apps (shown in the startup report)
+IMPORT_SECONDS = time.perf_counter() - _STARTED
 
 # Initialize the main landing app
 # We explicitly set static_folder to the shared one so it can serve css/js for the landing page
@@ -33,6 +46,24 @@ def index():
 def app_assets(filename):
     return send_from_directory(APP_ASSETS_DIR, filename)
 
+# Bearer token for Prometheus (`authorization: {credentials: ...}` in the scrape config);
+# without it /metrics is only served to a logged-in admin
+METRICS_TOKEN = os.environ.get("QP_METRICS_TOKEN", "")
+
+def _metrics_allowed():
+    if is_admin_request(request.environ):
+        return True
+    auth = request.headers.get("Authorization", "")
+    token = auth[7:].strip() if auth[:7].lower() == "bearer " else ""
+    return bool(METRICS_TOKEN) and hmac.compare_digest(token, METRICS_TOKEN)
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus text format; request latency, SQL and PDF time per sub-app/endpoint
+    if not _metrics_allowed():
+        return Response("Forbidden\n", status=403, mimetype="text/plain")
+    return Response(metrics_text(), mimetype="text/plain; version=0.0.4")
+
 from shared.utils import _, get_current_language
 
 # Inject translation helpers into all apps
@@ -43,26 +74,83 @@ def inject_i18n():
 for sub_app in [pricing_app, offer_app, admin_app, sale_app, settings_app, rent_app, app]:
     sub_app.context_processor(inject_i18n)
 
-# Merge the applications using DispatcherMiddleware
-application = DispatcherMiddleware(app, {
+SUB_APPS = {
     '/pricing': pricing_app,
     '/sale': sale_app,
     '/offer': offer_app,
     '/admin': admin_app,
     '/settings': settings_app,
     '/rent': rent_app
-})
+}
 
-if __name__ == "__main__":
-    from werkzeug.serving import run_simple
-    
-    # Run database initializations and migrations
-    print("Initializing databases...")
+for flask_app in [*SUB_APPS.values(), app]:
+    instrument_app(flask_app)
+
+# Merge the applications using DispatcherMiddleware; every request is timed
+# (Server-Timing header, JSON access log, /metrics, admin Performance page)
+# and admins can profile a single request with ?_profile=1 (admin Profiles page)
+application = InstrumentationMiddleware(
+    ProfilerMiddleware(DispatcherMiddleware(app, SUB_APPS), is_allowed=is_admin_request),
+    SUB_APPS
+)
+
+def _initial_schema():
     pricing_init_db()
     pricing_migrate_schema()
     offer_init_db()
     admin_init_db()
     rent_init_db()
+
+# Schema steps, applied in order by shared.migrations.run_migrations() and
+# recorded in PRAGMA user_version. Append a new step (next number) that
+# re-runs the affected init function whenever one of them changes.
+MIGRATIONS = [
+    (1, "Initial schema (pricing, offer, admin, rent)", _initial_schema),
+    (2, "Offer list indexes (is_template/date, offer_items.product_id)", offer_init_db),
+    (3, "Catalog change log pruning trigger", pricing_migrate_schema),
+    (4, "Rent contract number index", rent_init_db),
+]
+
+def init_databases():
+    """Bring the database schema up to date and print a startup-time report. Run once per start."""
+    started = time.perf_counter()
+    # Before anything opens the database: finish (or drop) a restore a crash interrupted
+    recover_interrupted_restores()
+    ran = run_migrations(MIGRATIONS)
+    migrations_seconds = time.perf_counter() - started
+
+    # Every start, but cheap: template sync compares a hash of the files first
+    started = time.perf_counter()
+    sync_system_pdf_template()
+    prune_catalog_changes()
+    reset_metrics()
+    remove_stale_snapshots()
+    prune_pdf_cache(PDF_CACHE_DIR)
+    maintenance_seconds = time.perf_counter() - started
+
+    lines = [("imports", IMPORT_SECONDS, "")]
+    if ran:
+        lines += [(f"migration {version}", seconds, description) for version, description, seconds in ran]
+    else:
+        lines.append((f"schema v{schema_version()}", migrations_seconds, "up to date, nothing to migrate"))
+    lines.append(("maintenance", maintenance_seconds, "pdf template sync, change log pruning, metrics reset, stale backup snapshots, pdf cache pruning"))
+    lines.append(("total", time.perf_counter() - _STARTED, ""))
+    print("Startup report:")
+    for label, seconds, note in lines:
+        print(f"  {label:<18} {seconds * 1000:8.1f} ms  {note}".rstrip())
+
+# Production: `gunicorn -c gunicorn.conf.py main:application` (see gunicorn.conf.py).
+# `python main.py` below is the development server with reloader and debugger.
+if __name__ == "__main__":
+    from werkzeug.serving import run_simple
+    
+    # Run database initializations and migrations
+    print("Initializing databases...")
+    init_databases()
+
+    # Scheduled backups (gunicorn starts this in each worker, see gunicorn.conf.py)
+    from shared.backup_schedule import start_scheduler
+    start_scheduler()
     
     # We use run_simple to run the WSGI application
     # This replaces app.run() for the combined app
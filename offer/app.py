@@ -4,8 +4,6 @@ import os
 import sys
 import io
 # pdfkit removed
-import requests
-from weasyprint import HTML, CSS
 from datetime import date
 from pathlib import Path
 
@@ -23,12 +21,15 @@ CUSTOM_LIBS_DIR = os.path.join(PARENT_DIR, 'custom_libs')
 if CUSTOM_LIBS_DIR not in sys.path:
     sys.path.append(CUSTOM_LIBS_DIR)
 
-import markdown
+from shared.markdown_render import render_markdown
 
 from shared.config import BASE_DIR, APP_DATA_DIR, DATABASE, IMAGE_DIR, APP_ASSETS_DIR, STATIC_DIR
 from shared.db import get_db
 from shared.auth import check_password
 from shared.countries import get_country_list
+from shared.sequences import init_sequences_table, next_document_number
+from shared.blobstore import unpack_row
+from shared.instrumentation import pdf_timer
 
 #  common_utils app import
 # it's in PARENT_DIR which is already in sys.path
@@ -179,7 +180,14 @@ def init_db():
     except sqlite3.OperationalError:
         pass
 
+    # Offer list: WHERE is_template = ? ORDER BY date DESC, id DESC, and its item filter join
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_template_date ON offers(is_template, date, id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_offer_items_product_id ON offer_items(product_id);")
+
     conn.commit()
+
+    # Offer numbers left empty are allocated from document_sequences
+    init_sequences_table(conn)
     conn.close()
 
 
@@ -192,35 +200,9 @@ def _format_date_filter(date_str, fmt=None):
         fmt = get_date_format()
     return format_date(date_str, fmt)
 
-import re
-
-def fix_markdown_lists(text):
-    if not text:
-        return text
-    lines = text.split('\n')
-    fixed_lines = []
-    in_list = False
-    for line in lines:
-        is_list_item = bool(re.match(r'^[ \t]*([*+-]|\d+\.)[ \t]+', line))
-        is_empty = not line.strip()
-        if is_list_item and not in_list and fixed_lines and fixed_lines[-1].strip():
-            fixed_lines.append('')
-        if is_list_item and line.strip().startswith('*') and not line.startswith(' '):
-             # Ensure there is a space after bullet if the user forgot but the regex caught it? No, regex already requires space.
-             pass
-        fixed_lines.append(line)
-        if is_empty:
-            in_list = False
-        elif is_list_item:
-            in_list = True
-    return '\n'.join(fixed_lines)
-
 @app.template_filter('md')
-def render_markdown(text):
-    if not text:
-        return ""
-    text = fix_markdown_lists(text)
-    return markdown.markdown(text, extensions=['extra', 'nl2br'])
+def _md_filter(text):
+    return render_markdown(text)
 
 @app.context_processor
 def inject_helpers():
@@ -607,7 +589,7 @@ def new_offer():
         row_dup = cur.fetchone()
         allow_dup = row_dup["value"] == "true" if row_dup else False
         
-        if not allow_dup:
+        if not allow_dup and offer_number:
             cur.execute("SELECT id FROM offers WHERE offer_number = ?;", (offer_number,))
             existing = cur.fetchone()
             if existing:
@@ -648,6 +630,10 @@ def new_offer():
                                        countries=get_country_list(),
                                        current_language=current_language)
 
+        # Auto-number regular offers left without a number (templates stay unnumbered)
+        if not offer_number and not is_template:
+            offer_number = next_document_number(conn, 'offer', date_str, unique_in=('offers', 'offer_number'))
+
         cur.execute("""
             INSERT INTO offers (
                 offer_number, date,
@@ -743,16 +729,23 @@ def new_offer():
                            current_language=current_language)
 
 
-def recalc_totals(offer_id):
-    """Recalculate totals for an offer based on its items and discount/VAT."""
-    conn = get_db()
+def recalc_totals(offer_id, conn=None):
+    """
+    Recalculate totals for an offer based on its items and discount/VAT.
+    When an open connection is passed in, the update joins its transaction
+    and the caller is responsible for commit/close.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db()
     cur = conn.cursor()
 
     # Load offer
     cur.execute("SELECT * FROM offers WHERE id = ?;", (offer_id,))
     offer = cur.fetchone()
     if offer is None:
-        conn.close()
+        if own_conn:
+            conn.close()
         return
 
     discount_percent = offer["discount_percent"] or 0.0
@@ -794,8 +787,84 @@ def recalc_totals(offer_id):
         third_discount_percent, total_third_discount, total_net_after_third_discount,
         total_vat, total_gross, offer_id
     ))
-    conn.commit()
-    conn.close()
+    if own_conn:
+        conn.commit()
+        conn.close()
+
+
+# Columns copied verbatim by copy_offer (everything except id, number, date, template flag)
+_OFFER_COPY_COLUMNS = [
+    "client_name", "client_address", "client_email", "client_phone", "client_pib", "client_mb", "country",
+    "currency", "exchange_rate",
+    "discount_percent", "special_discount_percent", "third_discount_percent", "vat_percent",
+    "total_net", "total_discount", "total_net_after_discount",
+    "total_special_discount", "total_net_after_special_discount",
+    "total_third_discount", "total_net_after_third_discount",
+    "total_vat", "total_gross",
+    "payment_terms", "delivery_terms", "validity_days", "notes", "napomena",
+]
+
+
+def copy_offer(conn, offer_id, offer_number="", reset_date=True, reprice=False, is_template=0):
+    """
+    Duplicate an offer (or instantiate a template offer) with set-based SQL.
+
+    The header is copied with one INSERT ... SELECT and all lines with a second
+    INSERT ... SELECT, so the number of statements does not depend on how many
+    items the offer has.
+
+    - offer_number: number for the new offer ("" lets the user fill it in later)
+    - reset_date:   use today's date instead of the source offer's date
+    - reprice:      replace unit prices with each product's latest final price
+                    (free-text lines and products without prices keep their price)
+    - is_template:  template flag of the new offer
+
+    Returns the new offer id, or None if the source offer does not exist.
+    The caller commits.
+    """
+    cur = conn.cursor()
+    cols = ", ".join(_OFFER_COPY_COLUMNS)
+    cur.execute(f"""
+        INSERT INTO offers (offer_number, date, is_template, {cols})
+        SELECT ?, CASE WHEN ? THEN ? ELSE date END, ?, {cols}
+        FROM offers
+        WHERE id = ?;
+    """, (offer_number, 1 if reset_date else 0, date.today().isoformat(), is_template, offer_id))
+    if cur.rowcount == 0:
+        return None
+    new_offer_id = cur.lastrowid
+
+    cur.execute("""
+        INSERT INTO offer_items (
+            offer_id, product_id, line_order,
+            item_name, item_description, item_photo_path,
+            quantity, unit_price, discount_percent, line_net
+        )
+        SELECT ?, product_id, line_order,
+               item_name, item_description, item_photo_path,
+               quantity, new_price, discount_percent,
+               quantity * new_price * (1 - COALESCE(discount_percent, 0))
+        FROM (
+            SELECT oi.*,
+                   CASE WHEN ? AND oi.product_id IS NOT NULL THEN
+                       COALESCE((
+                           SELECT pr.final_price
+                           FROM prices pr
+                           WHERE pr.product_id = oi.product_id
+                           ORDER BY pr.date DESC, pr.id DESC
+                           LIMIT 1
+                       ), oi.unit_price)
+                   ELSE oi.unit_price END AS new_price
+            FROM offer_items oi
+            WHERE oi.offer_id = ?
+        )
+        ORDER BY line_order, id;
+    """, (new_offer_id, 1 if reprice else 0, offer_id))
+
+    if reprice:
+        recalc_totals(new_offer_id, conn=conn)
+
+    return new_offer_id
 
 
 @app.route("/offers/<int:offer_id>/edit", methods=["GET", "POST"])
@@ -1003,9 +1072,9 @@ def edit_offer(offer_id):
                     new_prod_id = existing["id"]
                 else:
                     cur.execute("""
-                        INSERT INTO products (name, brand, category, description)
-                        VALUES (?, ?, ?, ?);
-                    """, (new_name, "TEMP", "TEMP", new_desc))
+                        INSERT INTO products (name, brand, category, description, description_html)
+                        VALUES (?, ?, ?, ?, ?);
+                    """, (new_name, "TEMP", "TEMP", new_desc, render_markdown(new_desc)))
                     conn.commit()
                     new_prod_id = cur.lastrowid
 
@@ -1199,27 +1268,12 @@ from flask import send_file, request
 
 from pathlib import Path
 
-@app.route("/offers/<int:offer_id>/pdf")
-def offer_pdf(offer_id):
-    conn = get_db()
-    cur = conn.cursor()
-
-    # Load offer
-    cur.execute("SELECT * FROM offers WHERE id = ?", (offer_id,))
-    offer = cur.fetchone()
-    if not offer:
-        conn.close()
-        return "Offer not found", 404
-
-    # Load items
-    cur.execute("""
-        SELECT *
-        FROM offer_items
-        WHERE offer_id = ?
-        ORDER BY line_order, id
-    """, (offer_id,))
-    items = cur.fetchall()
-
+def render_offer_pdf(offer, items, custom_tpl=None, current_language="en"):
+    """
+    PDF bytes for an offer row and its item rows, through an (unpacked)
+    pdf_templates row or, without one, the filesystem template. Needs this
+    app's context; the admin template render-cost estimate calls it too.
+    """
     # ---- Build file:// URIs for product images ----
     items_for_pdf = []
     for row in items:
@@ -1235,29 +1289,6 @@ def offer_pdf(offer_id):
             d["item_photo_uri"] = None
         items_for_pdf.append(d)
 
-    # ---- Template Selection ----
-    preview_tpl_id = request.args.get("preview_template_id")
-    active_tpl_id = 0
-    
-    if preview_tpl_id:
-        active_tpl_id = int(preview_tpl_id)
-    else:
-        # Get active template from global_settings
-        cur.execute("SELECT value FROM global_settings WHERE key = 'active_pdf_template_id';")
-        row = cur.fetchone()
-        active_tpl_id = int(row["value"]) if row else 0
-
-    custom_tpl = None
-    if active_tpl_id > 0:
-        cur.execute("SELECT * FROM pdf_templates WHERE id = ?;", (active_tpl_id,))
-        custom_tpl = cur.fetchone()
-
-    cur.execute("SELECT value FROM global_settings WHERE key = 'language';")
-    row = cur.fetchone()
-    current_language = row["value"] if row else "en"
-
-    conn.close()
-
     # ---- Logo URI ----
     logo_path = os.path.join(APP_ASSETS_DIR, "logo_company.jpg")
     logo_uri = Path(logo_path).as_uri()
@@ -1286,6 +1317,9 @@ def offer_pdf(offer_id):
     ctx["_"] = lambda x: x
     ctx["gettext"] = lambda x: x
 
+    # WeasyPrint is slow to import; load it on the first PDF rather than at startup
+    from weasyprint import HTML, CSS
+
     if custom_tpl:
         # Render parts from DB
         header_html = render_template_string(custom_tpl["header_html"], **ctx)
@@ -1305,9 +1339,10 @@ def offer_pdf(offer_id):
         </body>
         </html>
         """
-        pdf_bytes = HTML(string=html_string).write_pdf(
-            stylesheets=[CSS(string=custom_css)]
-        )
+        with pdf_timer():
+            pdf_bytes = HTML(string=html_string).write_pdf(
+                stylesheets=[CSS(string=custom_css)]
+            )
     else:
         # Fallback to filesystem
         html_string = render_template(
@@ -1315,9 +1350,60 @@ def offer_pdf(offer_id):
             **ctx
         )
         pdf_css_path = os.path.join(BASE_DIR, "static", "css", "pdf.css")
-        pdf_bytes = HTML(string=html_string).write_pdf(
-            stylesheets=[CSS(filename=pdf_css_path)]
-        )
+        with pdf_timer():
+            pdf_bytes = HTML(string=html_string).write_pdf(
+                stylesheets=[CSS(filename=pdf_css_path)]
+            )
+
+    return pdf_bytes
+
+@app.route("/offers/<int:offer_id>/pdf")
+def offer_pdf(offer_id):
+    conn = get_db()
+    cur = conn.cursor()
+
+    # Load offer
+    cur.execute("SELECT * FROM offers WHERE id = ?", (offer_id,))
+    offer = cur.fetchone()
+    if not offer:
+        conn.close()
+        return "Offer not found", 404
+
+    # Load items
+    cur.execute("""
+        SELECT *
+        FROM offer_items
+        WHERE offer_id = ?
+        ORDER BY line_order, id
+    """, (offer_id,))
+    items = cur.fetchall()
+
+    # ---- Template Selection ----
+    preview_tpl_id = request.args.get("preview_template_id")
+    active_tpl_id = 0
+    
+    if preview_tpl_id:
+        active_tpl_id = int(preview_tpl_id)
+    else:
+        # Get active template from global_settings
+        cur.execute("SELECT value FROM global_settings WHERE key = 'active_pdf_template_id';")
+        row = cur.fetchone()
+        active_tpl_id = int(row["value"]) if row else 0
+
+    custom_tpl = None
+    if active_tpl_id > 0:
+        cur.execute("SELECT * FROM pdf_templates WHERE id = ?;", (active_tpl_id,))
+        custom_tpl = cur.fetchone()
+        if custom_tpl:
+            custom_tpl = unpack_row(custom_tpl, "header_html", "body_html", "footer_html", "css")
+
+    cur.execute("SELECT value FROM global_settings WHERE key = 'language';")
+    row = cur.fetchone()
+    current_language = row["value"] if row else "en"
+
+    conn.close()
+
+    pdf_bytes = render_offer_pdf(offer, items, custom_tpl, current_language)
 
     num = offer["offer_number"] or offer["id"]
     filename = f"{num}.pdf"
@@ -1331,66 +1417,25 @@ def offer_pdf(offer_id):
 
 @app.route("/offers/<int:offer_id>/duplicate", methods=["POST"])
 def duplicate_offer(offer_id):
-    conn = get_db()
-    cur = conn.cursor()
+    # The new offer is never a template and gets the next number from the offer
+    # sequence. Date is reset to today unless keep_date is sent.
+    reprice = request.form.get("reprice") == "1"
+    reset_date = request.form.get("keep_date") != "1"
 
-    # 1. Fetch original offer
-    cur.execute("SELECT * FROM offers WHERE id = ?;", (offer_id,))
-    offer = cur.fetchone()
-    if not offer:
+    conn = get_db()
+    try:
+        source = conn.execute("SELECT date FROM offers WHERE id = ?;", (offer_id,)).fetchone()
+        if source is None:
+            return "Offer not found", 404
+        # The number's period ({yyyy}, ...) follows the date the copy gets
+        offer_number = next_document_number(conn, 'offer', on_date=None if reset_date else source["date"],
+                                            unique_in=('offers', 'offer_number'))
+        new_offer_id = copy_offer(conn, offer_id, offer_number=offer_number, reset_date=reset_date, reprice=reprice)
+        if new_offer_id is None:
+            return "Offer not found", 404
+        conn.commit()
+    finally:
         conn.close()
-        return "Offer not found", 404
-
-    # 2. Insert new offer based on original
-    # We set is_template=0 for the new offer, and clear the offer_number so user can set a new one
-    # Also set today's date
-    today = date.today().isoformat()
-    
-    cur.execute("""
-        INSERT INTO offers (
-            offer_number, date,
-            client_name, client_address, client_email, client_phone, client_pib, client_mb,
-            currency, exchange_rate,
-            discount_percent, special_discount_percent, third_discount_percent, vat_percent,
-            total_net, total_discount, total_net_after_discount,
-            total_special_discount, total_net_after_special_discount,
-            total_third_discount, total_net_after_third_discount,
-            total_vat, total_gross,
-            payment_terms, delivery_terms, validity_days, notes, napomena, is_template, country
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?);
-    """, (
-        "", today,
-        offer["client_name"], offer["client_address"], offer["client_email"], offer["client_phone"], offer["client_pib"], offer["client_mb"],
-        offer["currency"], offer["exchange_rate"],
-        offer["discount_percent"], offer["special_discount_percent"], offer["third_discount_percent"], offer["vat_percent"],
-        offer["total_net"], offer["total_discount"], offer["total_net_after_discount"],
-        offer["total_special_discount"], offer["total_net_after_special_discount"],
-        offer["total_third_discount"], offer["total_net_after_third_discount"],
-        offer["total_vat"], offer["total_gross"],
-        offer["payment_terms"], offer["delivery_terms"], offer["validity_days"], offer["notes"], offer["napomena"], offer["country"]
-    ))
-    new_offer_id = cur.lastrowid
-
-    # 3. Copy items
-    cur.execute("SELECT * FROM offer_items WHERE offer_id = ? ORDER BY line_order;", (offer_id,))
-    items = cur.fetchall()
-    for item in items:
-        cur.execute("""
-            INSERT INTO offer_items (
-                offer_id, product_id, line_order,
-                item_name, item_description, item_photo_path,
-                quantity, unit_price, discount_percent, line_net
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
-        """, (
-            new_offer_id, item["product_id"], item["line_order"],
-            item["item_name"], item["item_description"], item["item_photo_path"],
-            item["quantity"], item["unit_price"], item["discount_percent"], item["line_net"]
-        ))
-
-    conn.commit()
-    conn.close()
 
     return redirect(url_for("edit_offer", offer_id=new_offer_id))
 
@@ -1434,33 +1479,282 @@ def update_item_order(offer_id):
 
     return jsonify({"success": True})
 
-@app.route("/compare")
-def compare_offers():
-    """Comparison tool - pure JS based, no DB saving."""
+COMPARE_PAGE_SIZE = 50
+COMPARE_MAX_PAGE_SIZE = 200
+
+
+def _compare_totals(lines, discount_percent, vat_percent):
+    """Aggregate one comparison side. Percentages are given as 0-100."""
+    multiplier = 1 - discount_percent / 100.0
+    rows = []
+    total_net = 0.0
+    for idx, line in enumerate(lines, start=1):
+        quantity = line["quantity"]
+        unit_price = line["unit_price"]
+        line_sum = quantity * unit_price
+        rows.append({
+            "nr": idx,
+            "product_id": line.get("product_id"),
+            "name": line.get("name") or "",
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "line_sum": line_sum,
+            "line_sum_after": line_sum * multiplier,
+        })
+        total_net += line_sum
+
+    total_discount = total_net * discount_percent / 100.0
+    total_after_discount = total_net - total_discount
+    total_vat = total_after_discount * vat_percent / 100.0
+    return {
+        "lines": rows,
+        "discount_percent": discount_percent,
+        "vat_percent": vat_percent,
+        "total_net": total_net,
+        "total_discount": total_discount,
+        "total_after_discount": total_after_discount,
+        "total_vat": total_vat,
+        "total_gross": total_after_discount + total_vat,
+    }
+
+
+def _is_id(value):
+    """True for a missing id or a scalar that int() accepts; lists, objects and booleans are not ids."""
+    if value is None or value == "":
+        return True
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        return False
+    try:
+        int(value)
+    except (ValueError, OverflowError):
+        return False
+    return True
+
+
+def _latest_prices(cur, product_ids):
+    """Return {product_id: final_price} for the given products in one query."""
+    product_ids = sorted({int(pid) for pid in product_ids if pid})
+    if not product_ids:
+        return {}
+    placeholders = ", ".join(["?"] * len(product_ids))
+    cur.execute(f"""
+        SELECT p.id, p.name,
+               (
+                   SELECT pr.final_price
+                   FROM prices pr
+                   WHERE pr.product_id = p.id
+                   ORDER BY pr.date DESC, pr.id DESC
+                   LIMIT 1
+               ) AS latest_price
+        FROM products p
+        WHERE p.id IN ({placeholders});
+    """, product_ids)
+    return {row["id"]: dict(row) for row in cur.fetchall()}
+
+
+@app.route("/api/compare/products")
+def api_compare_products():
+    """Paginated product feed for the Compare tool (search / brand / category)."""
+    search_term = (request.args.get("search") or "").strip()
+    brand_filter = (request.args.get("brand") or "").strip()
+    category_filter = (request.args.get("category") or "").strip()
+    page = max(request.args.get("page", 1, type=int) or 1, 1)
+    per_page = request.args.get("per_page", COMPARE_PAGE_SIZE, type=int) or COMPARE_PAGE_SIZE
+    per_page = min(max(per_page, 1), COMPARE_MAX_PAGE_SIZE)
+    offset = (page - 1) * per_page
+
+    clauses = []
+    params = []
+    if brand_filter:
+        clauses.append("p.brand = ?")
+        params.append(brand_filter)
+    if category_filter:
+        clauses.append("p.category = ?")
+        params.append(category_filter)
+    if search_term:
+        clauses.append("p.name LIKE ?")
+        params.append(f"%{search_term}%")
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
     conn = get_db()
     cur = conn.cursor()
-    
-    # Build products query with latest price
-    query = """
-        SELECT 
-            p.id, 
-            p.name, 
-            p.brand, 
-            p.category, 
-            p.description,
-            p.photo_path,
+    cur.execute(f"SELECT COUNT(*) AS total_count FROM products p{where};", params)
+    total_count = cur.fetchone()["total_count"]
+
+    # Latest price is resolved only for the rows on this page
+    cur.execute(f"""
+        SELECT
+            p.id,
+            p.name,
+            p.brand,
+            p.category,
             (
-                SELECT pr.final_price 
-                FROM prices pr 
-                WHERE pr.product_id = p.id 
-                ORDER BY pr.date DESC 
+                SELECT pr.final_price
+                FROM prices pr
+                WHERE pr.product_id = p.id
+                ORDER BY pr.date DESC, pr.id DESC
                 LIMIT 1
             ) AS latest_price
         FROM products p
-        ORDER BY p.name;
+        {where}
+        ORDER BY p.name
+        LIMIT ? OFFSET ?;
+    """, params + [per_page, offset])
+    rows = cur.fetchall()
+    conn.close()
+
+    import math
+    return jsonify({
+        "items": [
+            {
+                "id": r["id"],
+                "name": r["name"],
+                "brand": r["brand"] or "",
+                "category": r["category"] or "",
+                "price": r["latest_price"] if r["latest_price"] is not None else 0,
+            }
+            for r in rows
+        ],
+        "page": page,
+        "per_page": per_page,
+        "total_count": total_count,
+        "total_pages": math.ceil(total_count / per_page) if total_count else 1,
+    })
+
+
+@app.route("/api/compare/offers")
+def api_compare_offers():
+    """Paginated offer feed so a saved offer can be loaded into a comparison side."""
+    search_term = (request.args.get("search") or "").strip()
+    page = max(request.args.get("page", 1, type=int) or 1, 1)
+    per_page = min(max(request.args.get("per_page", COMPARE_PAGE_SIZE, type=int) or COMPARE_PAGE_SIZE, 1),
+                   COMPARE_MAX_PAGE_SIZE)
+    offset = (page - 1) * per_page
+
+    clauses = []
+    params = []
+    if search_term:
+        clauses.append("(client_name LIKE ? OR offer_number LIKE ?)")
+        params.extend([f"%{search_term}%", f"%{search_term}%"])
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT id, offer_number, date, client_name, total_gross, is_template
+        FROM offers
+        {where}
+        ORDER BY date DESC, id DESC
+        LIMIT ? OFFSET ?;
+    """, params + [per_page, offset])
+    rows = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return jsonify({"items": rows, "page": page, "per_page": per_page})
+
+
+@app.route("/api/compare", methods=["POST"])
+def api_compare():
     """
-    cur.execute(query)
-    products = cur.fetchall()
+    Server-side comparison.
+
+    Body: {"sides": {"a": {...}, "b": {...}}} where each side is either
+      {"offer_id": 12}  – compare a saved offer with its own discount/VAT, or
+      {"discount_percent": 5, "vat_percent": 20,
+       "lines": [{"product_id": 3, "quantity": 2}, {"name": "Free text", "quantity": 1, "unit_price": 100}]}
+    A product line without unit_price uses the product's latest final price.
+    """
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Request body must be a JSON object"}), 400
+    sides = data.get("sides") or {}
+    if not isinstance(sides, dict) or not sides:
+        return jsonify({"success": False, "message": "No sides provided"}), 400
+    for key, side in sides.items():
+        if not isinstance(side, dict):
+            return jsonify({"success": False, "message": f"Side {key} must be an object"}), 400
+        lines = side.get("lines") or []
+        if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+            return jsonify({"success": False, "message": f"Side {key}: lines must be a list of objects"}), 400
+        if not _is_id(side.get("offer_id")):
+            return jsonify({"success": False, "message": f"Side {key}: offer_id must be a number"}), 400
+        if not all(_is_id(line.get("product_id")) for line in lines):
+            return jsonify({"success": False, "message": f"Side {key}: product_id must be a number"}), 400
+
+    conn = get_db()
+    cur = conn.cursor()
+    try:
+        # Resolve every product referenced by any side in a single query
+        product_ids = [
+            line.get("product_id")
+            for side in sides.values()
+            for line in (side.get("lines") or [])
+        ]
+        latest = _latest_prices(cur, product_ids)
+
+        result = {}
+        for key, side in sides.items():
+            offer_id = side.get("offer_id")
+            if offer_id:
+                cur.execute("SELECT * FROM offers WHERE id = ?;", (offer_id,))
+                offer = cur.fetchone()
+                if offer is None:
+                    return jsonify({"success": False, "message": f"Offer {offer_id} not found"}), 404
+                cur.execute("""
+                    SELECT product_id, item_name, quantity, unit_price
+                    FROM offer_items
+                    WHERE offer_id = ?
+                    ORDER BY line_order, id;
+                """, (offer_id,))
+                lines = [
+                    {
+                        "product_id": r["product_id"],
+                        "name": r["item_name"],
+                        "quantity": r["quantity"] or 0.0,
+                        "unit_price": r["unit_price"] or 0.0,
+                    }
+                    for r in cur.fetchall()
+                ]
+                side_result = _compare_totals(
+                    lines,
+                    (offer["discount_percent"] or 0.0) * 100,
+                    (offer["vat_percent"] or 0.0) * 100,
+                )
+                side_result["offer_id"] = offer["id"]
+                side_result["offer_number"] = offer["offer_number"]
+                result[key] = side_result
+                continue
+
+            lines = []
+            for line in (side.get("lines") or []):
+                product_id = line.get("product_id")
+                info = latest.get(int(product_id)) if product_id else None
+                unit_price = line.get("unit_price")
+                if unit_price in (None, ""):
+                    unit_price = (info or {}).get("latest_price") or 0.0
+                lines.append({
+                    "product_id": int(product_id) if product_id else None,
+                    "name": line.get("name") or (info or {}).get("name") or "",
+                    "quantity": float(line.get("quantity") or 0),
+                    "unit_price": float(unit_price or 0),
+                })
+            result[key] = _compare_totals(
+                lines,
+                float(side.get("discount_percent") or 0),
+                float(side.get("vat_percent") or 0),
+            )
+    except (TypeError, ValueError) as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    finally:
+        conn.close()
+
+    return jsonify({"success": True, "sides": result})
+
+
+@app.route("/compare")
+def compare_offers():
+    """Comparison tool - products are loaded on demand via /api/compare/*, no DB saving."""
+    conn = get_db()
+    cur = conn.cursor()
 
     # Brand options for dropdown
     cur.execute("""
@@ -1484,9 +1778,9 @@ def compare_offers():
 
     conn.close()
     
-    return render_template("compare.html", 
-                           products=products, 
-                           brand_options=brand_options, 
+    return render_template("compare.html",
+                           page_size=COMPARE_PAGE_SIZE,
+                           brand_options=brand_options,
                            category_options=category_options)
 
 
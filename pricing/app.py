@@ -1,5 +1,4 @@
 from flask import Flask, render_template, request, redirect, url_for, send_from_directory, send_file, session, jsonify
-import requests
 import sqlite3
 import os
 import sys
@@ -7,7 +6,6 @@ import re
 import csv
 import io
 import zipfile
-from PIL import Image
 from datetime import date
 
 # Base directory = the "QP-CRM" folder (parent of this app folder)
@@ -26,7 +24,7 @@ CUSTOM_LIBS_DIR = os.path.join(PARENT_DIR, 'custom_libs')
 if CUSTOM_LIBS_DIR not in sys.path:
     sys.path.append(CUSTOM_LIBS_DIR)
 
-import markdown
+from shared.markdown_render import render_markdown
 
 from shared.config import BASE_DIR, APP_DATA_DIR, DATABASE, IMAGE_DIR, STATIC_DIR
 from shared.db import get_db
@@ -35,6 +33,7 @@ from shared.auth import check_password
 # import common_utils (it's in PARENT_DIR)
 # we already added PARENT_DIR to sys.path above
 from shared.utils import format_amount, format_date, get_nbs_rate
+from pricing import catalog_pdf
 
 app = Flask(
     __name__,
@@ -191,6 +190,8 @@ def init_db():
     cur.execute("CREATE INDEX IF NOT EXISTS idx_products_brand ON products(brand);")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products(category);")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_prices_product_id ON prices(product_id);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_prices_product_date ON prices(product_id, date);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products(name);")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_client_name ON offers(client_name);")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_offers_offer_number ON offers(offer_number);")
     cur.execute("CREATE INDEX IF NOT EXISTS idx_offer_items_offer_id ON offer_items(offer_id);")
@@ -215,6 +216,14 @@ def init_db():
     conn.commit()
     conn.close()
 
+# Tables whose changes bump global_settings 'catalog_revision' (see migrate_schema)
+CATALOG_TABLES = ("products", "prices", "category_pricing_defaults")
+
+# Entries of catalog_changes kept (offline Sale clients sync from it); the log
+# is pruned at startup and by a trigger every CATALOG_CHANGES_PRUNE_EVERY entries
+CATALOG_CHANGES_KEEP = 100000
+CATALOG_CHANGES_PRUNE_EVERY = 1000
+
 def migrate_schema():
     conn = get_db()
     cur = conn.cursor()
@@ -252,7 +261,13 @@ def migrate_schema():
         except sqlite3.OperationalError:
             pass
 
-    # 4. Remove UNIQUE constraint from prices if present
+    # 4. Pre-rendered Markdown of products.description (filled on write)
+    try:
+        cur.execute("ALTER TABLE products ADD COLUMN description_html TEXT")
+    except sqlite3.OperationalError:
+        pass
+
+    # 5. Remove UNIQUE constraint from prices if present
     cur.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='prices'")
     row = cur.fetchone()
     # Check if constraint exists in definition
@@ -301,11 +316,69 @@ def migrate_schema():
         # Since we added columns to prices_old (step 2), schemas match
         cur.execute("INSERT INTO prices SELECT * FROM prices_old")
         cur.execute("DROP TABLE prices_old")
-        
+
+    # 6. Catalog revision: bumped by triggers on every product/price/category
+    #    change, so readers (the Sale snapshot) can tell when to rebuild
+    #    without each writer having to remember to do it.
+    for table in CATALOG_TABLES:
+        for op in ("INSERT", "UPDATE", "DELETE"):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_catalog_revision
+                AFTER {op} ON {table}
+                BEGIN
+                    INSERT INTO global_settings (key, value) VALUES ('catalog_revision', '1')
+                        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;
+                    INSERT INTO global_settings (key, value)
+                        VALUES ('catalog_updated_at', strftime('%Y-%m-%dT%H:%M:%SZ', 'now'))
+                        ON CONFLICT(key) DO UPDATE SET value = excluded.value;
+                END;
+            """)
+
+    # 7. Per-product change log for the offline Sale client: every product or
+    #    price write appends the product id; the log id is the catalog version.
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_id INTEGER NOT NULL
+        );
+    """)
+    for table, key in (("products", "id"), ("prices", "product_id")):
+        for op, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            cur.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{op.lower()}_catalog_changes
+                AFTER {op} ON {table}
+                BEGIN
+                    INSERT INTO catalog_changes (product_id) VALUES ({row}.{key});
+                END;
+            """)
+    # Bulk price updates log several entries per product, and with a preloaded
+    # gunicorn master startup pruning alone would let the log grow until the
+    # next restart; every PRUNE_EVERY-th entry trims it back to KEEP (by rowid).
+    cur.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_catalog_changes_prune
+        AFTER INSERT ON catalog_changes
+        WHEN NEW.id % {int(CATALOG_CHANGES_PRUNE_EVERY)} = 0
+        BEGIN
+            DELETE FROM catalog_changes WHERE id <= NEW.id - {int(CATALOG_CHANGES_KEEP)};
+        END;
+    """)
+    prune_catalog_changes(conn)
+
     conn.commit()
     conn.close()
 
-from PIL import Image
+def prune_catalog_changes(conn=None):
+    """Keep the change log bounded; clients older than the oldest entry do a full resync."""
+    own = conn is None
+    conn = conn or get_db()
+    conn.execute("""
+        DELETE FROM catalog_changes
+        WHERE id <= (SELECT MAX(id) FROM catalog_changes) - ?;
+    """, (CATALOG_CHANGES_KEEP,))
+    if own:
+        conn.commit()
+        conn.close()
+
 import os
 import re
 
@@ -381,6 +454,8 @@ def save_product_image(image_stream, orig_filename, product_name):
     os.makedirs(IMAGE_DIR, exist_ok=True)
     dest_path = os.path.join(IMAGE_DIR, filename)
 
+    from PIL import Image
+
     try:
         img = Image.open(image_stream)
 
@@ -426,13 +501,13 @@ def get_theme():
     from flask import request
     return request.cookies.get("theme", "dark")
 
-import requests
-
 def download_image_from_url(url):
     """
     Download image from URL, validate it's an image.
     Returns (stream, filename) or raises ValueError.
     """
+    import requests
+
     try:
         resp = requests.get(url, timeout=10, stream=True)
         resp.raise_for_status()
@@ -495,30 +570,9 @@ def _format_date_filter(date_str):
 
 import re
 
-def fix_markdown_lists(text):
-    if not text:
-        return text
-    lines = text.split('\n')
-    fixed_lines = []
-    in_list = False
-    for line in lines:
-        is_list_item = bool(re.match(r'^[ \t]*([*+-]|\d+\.)[ \t]+', line))
-        is_empty = not line.strip()
-        if is_list_item and not in_list and fixed_lines and fixed_lines[-1].strip():
-            fixed_lines.append('')
-        fixed_lines.append(line)
-        if is_empty:
-            in_list = False
-        elif is_list_item:
-            in_list = True
-    return '\n'.join(fixed_lines)
-
 @app.template_filter('md')
-def render_markdown(text):
-    if not text:
-        return ""
-    text = fix_markdown_lists(text)
-    return markdown.markdown(text, extensions=['extra', 'nl2br'])
+def _md_filter(text):
+    return render_markdown(text)
 
 @app.context_processor
 def inject_helpers():
@@ -977,9 +1031,9 @@ def add_product():
             )
 
         cur.execute("""
-            INSERT INTO products (name, description, category, brand, photo_path)
-            VALUES (?, ?, ?, ?, ?);
-        """, (name, description, category, brand, photo_path))
+            INSERT INTO products (name, description, description_html, category, brand, photo_path)
+            VALUES (?, ?, ?, ?, ?, ?);
+        """, (name, description, render_markdown(description), category, brand, photo_path))
         
         new_product_id = cur.lastrowid
         conn.commit()
@@ -1142,9 +1196,9 @@ def edit_product(product_id):
 
         cur.execute("""
             UPDATE products
-            SET name = ?, description = ?, category = ?, brand = ?, photo_path = ?
+            SET name = ?, description = ?, description_html = ?, category = ?, brand = ?, photo_path = ?
             WHERE id = ?;
-        """, (name, description, category, brand, photo_path, product_id))
+        """, (name, description, render_markdown(description), category, brand, photo_path, product_id))
         conn.commit()
         conn.close()
 
@@ -1768,6 +1822,35 @@ def delete_price(product_id, price_id):
 
     return redirect(url_for("price_history", product_id=product_id))
 
+# ---------- CATALOG PDF ----------
+
+@app.route("/catalog_pdf/start", methods=["POST"])
+def catalog_pdf_start():
+    # Same filters as the product list; the form posts them explicitly
+    job_id = catalog_pdf.start_job(
+        brand=request.form.get("brand", ""),
+        category=request.form.get("category", ""),
+        search=request.form.get("search", ""),
+        group_by=request.form.get("group_by", "brand"),
+        chunk_size=request.form.get("chunk_size", catalog_pdf.DEFAULT_CHUNK_SIZE, type=int),
+    )
+    return jsonify({"job_id": job_id})
+
+@app.route("/catalog_pdf/status/<job_id>")
+def catalog_pdf_status(job_id):
+    status = catalog_pdf.job_status(job_id)
+    if status is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(status)
+
+@app.route("/catalog_pdf/download/<job_id>")
+def catalog_pdf_download(job_id):
+    path = catalog_pdf.job_pdf_path(job_id)
+    if path is None:
+        return "Catalog PDF not found", 404
+    return send_file(path, mimetype="application/pdf", as_attachment=True,
+                     download_name=f"cenovnik_{date.today().isoformat()}.pdf")
+
 # ---------- END ----------
 if __name__ == "__main__":
     init_db()
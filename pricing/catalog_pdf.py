@@ -0,0 +1,471 @@
+"""
+Printable catalog PDF of the (filtered) price list.
+
+The product list is split into sections of `chunk_size` products. Each
+section is rendered to its own PDF in a worker process, which reads only its
+own rows and downsized thumbnails, so memory stays bounded by the section
+size rather than the catalog size. The sections are then concatenated.
+
+Generation runs as a background job. Job state lives in a small JSON file
+under CATALOG_JOBS_DIR, so any web process can report progress and serve
+the result. The job thread lives in one web worker; if that worker is
+recycled or restarted mid-job, job_status() reports the job as failed once
+its process is gone or its status has not moved for _JOB_STALE_SECONDS.
+
+The sections are concatenated by streaming their objects to the output one
+section at a time, so merging does not hold the whole catalog in memory.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date
+from pathlib import Path
+
+from shared.config import CATALOG_JOBS_DIR, IMAGE_DIR, PDF_CACHE_DIR, BASE_DIR
+from shared.db import get_readonly_db
+
+DEFAULT_CHUNK_SIZE = 50
+MAX_CHUNK_SIZE = 500
+GROUP_OPTIONS = ("brand", "category")
+
+_MAX_WORKERS = 4
+_THUMB_SIZE = (240, 240)
+_THUMB_DIR = os.path.join(PDF_CACHE_DIR, "thumbs")
+_JOB_MAX_AGE_SECONDS = 24 * 3600
+_JOB_STALE_SECONDS = 15 * 60
+_ACTIVE_STATES = ("queued", "running", "merging")
+_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+
+# Job bookkeeping
+
+def _job_dir(job_id):
+    # Job ids are generated here as hex; reject anything else before touching the filesystem
+    if not job_id or not all(ch in "0123456789abcdef" for ch in job_id):
+        return None
+    return os.path.join(CATALOG_JOBS_DIR, job_id)
+
+
+def _write_status(job_id, **status):
+    status["pid"] = os.getpid()
+    path = os.path.join(_job_dir(job_id), "status.json")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(status, f)
+    os.replace(tmp, path)
+
+
+def job_status(job_id):
+    """Status dict of a job (state, done, total, error, ...) or None if unknown."""
+    d = _job_dir(job_id)
+    if not d:
+        return None
+    path = os.path.join(d, "status.json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            status = json.load(f)
+        age = time.time() - os.path.getmtime(path)
+    except (OSError, ValueError):
+        return None
+    if status.get("state") in _ACTIVE_STATES:
+        if not _process_alive(status.get("pid")):
+            status.update(state="error", error="Generisanje je prekinuto (proces je zaustavljen).")
+        elif age > _JOB_STALE_SECONDS:
+            status.update(state="error", error="Generisanje je prekinuto (nema napretka).")
+    return status
+
+
+def _process_alive(pid):
+    if not pid:
+        return True  # status written before pids were recorded; the age check still applies
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # alive, owned by another user
+    return True
+
+
+def job_pdf_path(job_id):
+    d = _job_dir(job_id)
+    path = os.path.join(d, "catalog.pdf") if d else None
+    return path if path and os.path.exists(path) else None
+
+
+def _prune_old_jobs():
+    if not os.path.isdir(CATALOG_JOBS_DIR):
+        return
+    cutoff = time.time() - _JOB_MAX_AGE_SECONDS
+    for name in os.listdir(CATALOG_JOBS_DIR):
+        path = os.path.join(CATALOG_JOBS_DIR, name)
+        if os.path.isdir(path) and os.path.getmtime(path) < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+# Product selection
+
+def select_products(brand="", category="", search="", group_by="brand"):
+    """[(product_id, group value)] in print order: by group, then name."""
+    group_col = group_by if group_by in GROUP_OPTIONS else "brand"
+    where, params = [], []
+    if brand:
+        where.append("brand = ?")
+        params.append(brand)
+    if category:
+        where.append("category = ?")
+        params.append(category)
+    if search:
+        where.append("name LIKE ?")
+        params.append(f"%{search}%")
+    sql = f"SELECT id, COALESCE({group_col}, '') AS grp FROM products"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY grp, name;"
+    conn = get_readonly_db()
+    cur = conn.cursor()
+    cur.execute(sql, params)
+    rows = [(row["id"], row["grp"]) for row in cur.fetchall()]
+    conn.close()
+    return rows
+
+
+# Worker side (runs in spawned processes; no Flask)
+
+def _thumbnail_uri(photo_path):
+    """file:// URI of a cached JPEG thumbnail of a product image, or None."""
+    if not photo_path:
+        return None
+    src = os.path.join(IMAGE_DIR, photo_path)
+    try:
+        mtime = os.path.getmtime(src)
+    except OSError:
+        return None
+    digest = hashlib.sha1(f"{photo_path}|{mtime}|{_THUMB_SIZE}".encode("utf-8")).hexdigest()
+    dest = os.path.join(_THUMB_DIR, f"{digest}.jpg")
+    if not os.path.exists(dest):
+        from PIL import Image
+        os.makedirs(_THUMB_DIR, exist_ok=True)
+        try:
+            with Image.open(src) as img:
+                img.thumbnail(_THUMB_SIZE)
+                tmp = f"{dest}.{os.getpid()}.tmp"
+                img.convert("RGB").save(tmp, "JPEG", quality=80)
+            os.replace(tmp, dest)
+        except OSError:
+            return None
+    return Path(dest).as_uri()
+
+
+def _load_section(ids):
+    conn = get_readonly_db()
+    cur = conn.cursor()
+    placeholders = ", ".join("?" * len(ids))
+    cur.execute(f"""
+        SELECT p.id, p.name, p.brand, p.category, p.photo_path, p.description, p.description_html,
+               pr.final_price AS current_price,
+               pr.discount_price AS current_discount_price
+        FROM products p
+        LEFT JOIN prices pr
+          ON pr.id = (
+              SELECT MAX(id) FROM prices WHERE product_id = p.id
+          )
+        WHERE p.id IN ({placeholders});
+    """, ids)
+    by_id = {row["id"]: dict(row) for row in cur.fetchall()}
+    conn.close()
+    return [by_id[i] for i in ids if i in by_id]
+
+
+def render_section(ids, section, out_path):
+    """Worker: render one section (list of product ids) to out_path. Returns out_path."""
+    from jinja2 import Environment, FileSystemLoader, select_autoescape
+    from weasyprint import HTML
+    from shared.markdown_render import render_markdown
+    from shared.utils import format_amount
+
+    products = _load_section(ids)
+    for p in products:
+        p["thumb_uri"] = _thumbnail_uri(p["photo_path"])
+        p["description_html"] = p["description_html"] or render_markdown(p["description"])
+
+    env = Environment(loader=FileSystemLoader(_TEMPLATES_DIR), autoescape=select_autoescape(["html"]))
+    html_str = env.get_template("catalog_pdf_section.html").render(
+        products=products, format_amount=format_amount, **section)
+    HTML(string=html_str, base_url=BASE_DIR).write_pdf(out_path)
+    return out_path
+
+
+# Orchestration (background thread in the web process)
+
+def start_job(brand="", category="", search="", group_by="brand", chunk_size=DEFAULT_CHUNK_SIZE):
+    """Queue a catalog PDF job and return its id; progress via job_status()."""
+    _prune_old_jobs()
+    job_id = uuid.uuid4().hex
+    os.makedirs(_job_dir(job_id), exist_ok=True)
+    chunk_size = max(1, min(int(chunk_size or DEFAULT_CHUNK_SIZE), MAX_CHUNK_SIZE))
+    filters = {"brand": brand, "category": category, "search": search,
+               "group_by": group_by if group_by in GROUP_OPTIONS else "brand"}
+    _write_status(job_id, state="queued", done=0, total=0, products=0, error=None, filters=filters)
+    threading.Thread(target=_run_job, args=(job_id, filters, chunk_size),
+                     name=f"catalog-pdf-{job_id[:8]}", daemon=True).start()
+    return job_id
+
+
+def _run_job(job_id, filters, chunk_size):
+    job_dir = _job_dir(job_id)
+    try:
+        rows = select_products(**filters)
+        chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)] or [[]]
+        total = len(chunks)
+        _write_status(job_id, state="running", done=0, total=total, products=len(rows), error=None, filters=filters)
+
+        title_bits = [v for v in (filters["brand"], filters["category"], filters["search"]) if v]
+        jobs = []
+        for n, chunk in enumerate(chunks):
+            section = {
+                "first": n == 0,
+                "title": "Cenovnik" + (f" – {', '.join(title_bits)}" if title_bits else ""),
+                "generated": date.today().isoformat(),
+                "group_by": filters["group_by"],
+                # Group heading is repeated only when a section starts a new group
+                "prev_group": chunks[n - 1][-1][1] if n > 0 and chunks[n - 1] else None,
+                "groups": {pid: grp for pid, grp in chunk},
+                "section_no": n + 1,
+                "section_count": total,
+            }
+            jobs.append(([pid for pid, _ in chunk], section, os.path.join(job_dir, f"section_{n:05d}.pdf")))
+
+        done = 0
+        workers = max(1, min(_MAX_WORKERS, os.cpu_count() or 1, total))
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(render_section, *args) for args in jobs]
+            for fut in as_completed(futures):
+                fut.result()
+                done += 1
+                _write_status(job_id, state="running", done=done, total=total,
+                              products=len(rows), error=None, filters=filters)
+
+        _write_status(job_id, state="merging", done=done, total=total, products=len(rows), error=None, filters=filters)
+
+        def merged(n):
+            # Keeps the status fresh during a long merge (see _JOB_STALE_SECONDS)
+            _write_status(job_id, state="merging", done=done, total=total, merged=n,
+                          products=len(rows), error=None, filters=filters)
+
+        _merge_sections([args[2] for args in jobs], os.path.join(job_dir, "catalog.pdf"), on_section=merged)
+        for _, _, path in jobs:
+            os.remove(path)
+        _write_status(job_id, state="done", done=done, total=total, products=len(rows), error=None, filters=filters)
+    except Exception as e:
+        _write_status(job_id, state="error", done=0, total=0, products=0, error=str(e), filters=filters)
+
+
+def _merge_sections(paths, out_path, on_section=None):
+    """Concatenate section PDFs from disk into out_path, one section in memory at a time.
+
+    Every object a section's pages reference is renumbered and written out
+    straight away; only the page ids, the bookmarks, the named destinations
+    and the xref offsets are kept until the page tree, outline and catalog
+    are written at the end. Named destinations (WeasyPrint's internal links)
+    get a per-section prefix so equal anchors in two sections stay apart.
+    """
+    from pypdf import PdfReader
+    from pypdf.generic import (ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject,
+                               TextStringObject)
+
+    tmp = f"{out_path}.tmp"
+    offsets = {}
+    page_ids = []
+    bookmarks = []  # (level, title, page id, top)
+    dests = {}  # prefixed name -> renumbered destination
+    next_id = [3]  # 1 = page tree, 2 = catalog
+
+    with open(tmp, "wb") as out:
+        out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+        def write_object(obj_id, obj):
+            offsets[obj_id] = out.tell()
+            out.write(f"{obj_id} 0 obj\n".encode("ascii"))
+            obj.write_to_stream(out)
+            out.write(b"\nendobj\n")
+
+        for n, path in enumerate(paths, start=1):
+            reader = PdfReader(path)
+            mapping, queue = {}, []
+
+            def new_ref(ref):
+                key = (ref.idnum, ref.generation)
+                if key not in mapping:
+                    mapping[key] = next_id[0]
+                    next_id[0] += 1
+                    queue.append(ref)
+                return IndirectObject(mapping[key], 0, None)
+
+            def rename(name):
+                return f"{n}/" + (name.decode("latin-1") if isinstance(name, bytes) else str(name))
+
+            first_page = len(page_ids)
+            for page in reader.pages:
+                page_ids.append(new_ref(page.indirect_reference).idnum)
+            for name, dest in _named_destinations(reader):
+                dests.setdefault(rename(name), _renumbered(dest, new_ref, rename))
+            while queue:
+                ref = queue.pop()
+                obj = _renumbered(ref.get_object(), new_ref, rename)
+                if isinstance(obj, DictionaryObject) and obj.get("/Type") == "/Page":
+                    obj[NameObject("/Parent")] = IndirectObject(1, 0, None)
+                write_object(mapping[(ref.idnum, ref.generation)], obj)
+            _collect_bookmarks(reader, reader.outline, 0, page_ids, first_page, bookmarks)
+            if on_section:
+                on_section(n)
+
+        write_object(1, DictionaryObject({
+            NameObject("/Type"): NameObject("/Pages"),
+            NameObject("/Kids"): ArrayObject(IndirectObject(i, 0, None) for i in page_ids),
+            NameObject("/Count"): NumberObject(len(page_ids)),
+        }))
+        catalog = DictionaryObject({
+            NameObject("/Type"): NameObject("/Catalog"),
+            NameObject("/Pages"): IndirectObject(1, 0, None),
+        })
+        if bookmarks:
+            outline_id = next_id[0]
+            next_id[0] = _write_outline(bookmarks, outline_id, write_object)
+            catalog[NameObject("/Outlines")] = IndirectObject(outline_id, 0, None)
+        if dests:
+            names = ArrayObject()
+            for name in sorted(dests):
+                names += [TextStringObject(name), dests[name]]
+            catalog[NameObject("/Names")] = DictionaryObject({
+                NameObject("/Dests"): DictionaryObject({NameObject("/Names"): names}),
+            })
+        write_object(2, catalog)
+
+        xref = out.tell()
+        size = next_id[0]
+        out.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode("ascii"))
+        for obj_id in range(1, size):
+            out.write(f"{offsets.get(obj_id, 0):010d} 00000 n \n".encode("ascii"))
+        out.write(f"trailer\n<< /Size {size} /Root 2 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("ascii"))
+    os.replace(tmp, out_path)
+
+
+def _renumbered(obj, new_ref, rename):
+    """
+    Copy of a direct object with every indirect reference replaced by
+    new_ref(reference) and every named destination a link points at by
+    rename(name).
+    """
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject, TextStringObject
+
+    if isinstance(obj, IndirectObject):
+        return new_ref(obj)
+    if isinstance(obj, StreamObject):
+        copy = obj.__class__()
+        copy._data = obj._data  # still encoded; /Filter is copied with the dictionary
+        for key, value in dict.items(obj):
+            if key != "/Length":  # rewritten from the data when the stream is written
+                copy[key] = _renumbered(value, new_ref, rename)
+        return copy
+    if isinstance(obj, DictionaryObject):
+        copy = DictionaryObject()
+        named_key = "/D" if obj.get("/S") == "/GoTo" else "/Dest"
+        for key, value in dict.items(obj):
+            if key == "/Parent" and obj.get("/Type") == "/Page":
+                continue  # the section's own page tree is not copied
+            if key == named_key and isinstance(value, (str, bytes)):
+                copy[key] = TextStringObject(rename(value))
+            else:
+                copy[key] = _renumbered(value, new_ref, rename)
+        return copy
+    if isinstance(obj, ArrayObject):
+        return ArrayObject(_renumbered(value, new_ref, rename) for value in list.__iter__(obj))
+    return obj
+
+
+def _named_destinations(reader):
+    """(name, destination) pairs of the catalog's /Dests name tree and legacy /Dests dictionary."""
+    root = reader.trailer["/Root"]
+    if "/Dests" in root:
+        for name, dest in dict.items(root["/Dests"]):
+            yield name[1:], dest
+    stack = [root["/Names"].get("/Dests")] if "/Names" in root else []
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        node = node.get_object()
+        stack.extend(node.get("/Kids", ()))
+        names = node.get("/Names", ())
+        for i in range(0, len(names) - 1, 2):
+            yield names[i].get_object(), names[i + 1]
+
+
+def _collect_bookmarks(reader, outline, level, page_ids, first_page, bookmarks):
+    for item in outline:
+        if isinstance(item, list):
+            _collect_bookmarks(reader, item, level + 1, page_ids, first_page, bookmarks)
+            continue
+        page_no = reader.get_destination_page_number(item)
+        if page_no is None or page_no < 0:
+            continue
+        bookmarks.append((level, str(item.title), page_ids[first_page + page_no], item.top))
+
+
+def _write_outline(bookmarks, outline_id, write_object):
+    """Write the outline tree of (level, title, page id, top) entries; returns the next free id."""
+    from pypdf.generic import (ArrayObject, DictionaryObject, FloatObject, IndirectObject, NameObject,
+                               NullObject, NumberObject, TextStringObject)
+
+    ids = list(range(outline_id + 1, outline_id + 1 + len(bookmarks)))
+    parents, children = [], {outline_id: []}
+    stack = [(-1, outline_id)]
+    for obj_id, (level, *_) in zip(ids, bookmarks):
+        while stack[-1][0] >= level:
+            stack.pop()
+        parents.append(stack[-1][1])
+        children[stack[-1][1]].append(obj_id)
+        children[obj_id] = []
+        stack.append((level, obj_id))
+
+    def descendants(obj_id):
+        return sum(1 + descendants(child) for child in children[obj_id])
+
+    def link_children(node, obj_id):
+        kids = children[obj_id]
+        if kids:
+            node[NameObject("/First")] = IndirectObject(kids[0], 0, None)
+            node[NameObject("/Last")] = IndirectObject(kids[-1], 0, None)
+            node[NameObject("/Count")] = NumberObject(descendants(obj_id))
+
+    root = DictionaryObject({NameObject("/Type"): NameObject("/Outlines")})
+    link_children(root, outline_id)
+    write_object(outline_id, root)
+    for obj_id, parent, (level, title, page_id, top) in zip(ids, parents, bookmarks):
+        siblings = children[parent]
+        pos = siblings.index(obj_id)
+        dest = [IndirectObject(page_id, 0, None)]
+        if top is None:
+            dest.append(NameObject("/Fit"))
+        else:
+            dest += [NameObject("/XYZ"), NullObject(), FloatObject(top), NullObject()]
+        node = DictionaryObject({
+            NameObject("/Title"): TextStringObject(title),
+            NameObject("/Parent"): IndirectObject(parent, 0, None),
+            NameObject("/Dest"): ArrayObject(dest),
+        })
+        if pos > 0:
+            node[NameObject("/Prev")] = IndirectObject(siblings[pos - 1], 0, None)
+        if pos < len(siblings) - 1:
+            node[NameObject("/Next")] = IndirectObject(siblings[pos + 1], 0, None)
+        link_children(node, obj_id)
+        write_object(obj_id, node)
+    return outline_id + 1 + len(bookmarks)
@@ -7,18 +7,24 @@ import csv
 import math
 from datetime import date, datetime
 from calendar import monthrange
-from weasyprint import HTML
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PARENT_DIR = os.path.dirname(CURRENT_DIR)
 if PARENT_DIR not in sys.path:
     sys.path.append(PARENT_DIR)
 
-from shared.config import BASE_DIR, APP_DATA_DIR, DATABASE, APP_ASSETS_DIR, STATIC_DIR
+from shared.config import BASE_DIR, APP_DATA_DIR, DATABASE, APP_ASSETS_DIR, STATIC_DIR, PDF_CACHE_DIR
 from shared.db import get_db
 from shared.auth import check_password
 from shared.utils import format_amount
+from shared.sequences import init_sequences_table, next_document_number
+from shared.blobstore import pack_text, unpack_text, content_hash, compress_column
 from rent.import_templates import seed_templates
+from rent.projection import cached_projection, invalidate_projection_cache, parse_month
+from rent.scenarios import scenario_grid, grid_table, INPUT_LABELS
+from rent.doc_templates import normalize_headings, fill_template, normalize_stored_documents
+from rent.pdf_bundle import render_parts, merge_pdfs, zip_pdfs
+from shared.instrumentation import pdf_timer
 
 app = Flask(
     __name__,
@@ -114,6 +120,63 @@ def calculate_rent(price, period_months, downpayment_pct, salvage_pct,
     }
 
 
+# Calculated fields stored on rent_contracts so lists can sort/filter/sum in SQL
+RENT_CALC_COLUMNS = [
+    "ucesce", "ucesce_pdv", "ucesce_bruto", "ostatak",
+    "rata_fin", "osiguranje", "garancija",
+    "rata_neto", "rata_pdv", "rata_bruto",
+    "zatvaranje", "rata_nakon", "admin_pdv", "admin_bruto",
+]
+
+
+def contract_calc_values(c):
+    """Stored calculated fields for a contract (row or dict with the input columns)."""
+    calc = calculate_rent(
+        c["price"] or 0, c["period_months"] or 48, c["downpayment_percent"] or 0,
+        c["salvage_value_percent"] or 0, c["interest_rate"] or 0,
+        c["insurance_rate"] or 0, c["guarantee_rate"] or 0,
+        c["vat_percent"] or 0, c["admin_fee"] or 0,
+    )
+    return {col: calc[col] for col in RENT_CALC_COLUMNS}
+
+
+def bump_contracts_revision(conn):
+    """
+    Mark rent_contracts as changed. Cached portfolio projections are keyed by
+    this counter, so every process sees the change on its next request.
+    """
+    conn.execute("""
+        INSERT INTO global_settings (key, value) VALUES ('rent_contracts_revision', '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1;
+    """)
+    invalidate_projection_cache()
+
+
+def get_contracts_revision(conn):
+    cur = conn.cursor()
+    cur.execute("SELECT value FROM global_settings WHERE key = 'rent_contracts_revision';")
+    row = cur.fetchone()
+    return row["value"] if row else "0"
+
+
+def refresh_contract_calcs(conn, only_missing=False):
+    """
+    Recompute the stored calculated fields of existing contracts.
+    only_missing=True limits the backfill to rows that were never computed.
+    Returns the number of updated rows; the caller commits.
+    """
+    cur = conn.cursor()
+    where = "WHERE rata_bruto IS NULL" if only_missing else ""
+    cur.execute(f"SELECT * FROM rent_contracts {where};")
+    rows = cur.fetchall()
+    sets = ", ".join(f"{col}=?" for col in RENT_CALC_COLUMNS)
+    cur.executemany(
+        f"UPDATE rent_contracts SET {sets} WHERE id=?;",
+        [list(contract_calc_values(r).values()) + [r["id"]] for r in rows]
+    )
+    return len(rows)
+
+
 def _add_months(d, months):
     """Add months to a date using pure stdlib."""
     month = d.month - 1 + months
@@ -237,6 +300,44 @@ def init_db():
         );
     """)
 
+    for col in RENT_CALC_COLUMNS:
+        try:
+            cur.execute(f"ALTER TABLE rent_contracts ADD COLUMN {col} REAL;")
+        except sqlite3.OperationalError:
+            pass
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rent_contracts_date ON rent_contracts(contract_date);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rent_contracts_rata_bruto ON rent_contracts(rata_bruto);")
+    # next_document_number() probes it for every new contract number
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rent_contracts_contract_number ON rent_contracts(contract_number);")
+    # Prefix search for the contract form typeahead (LIKE is case-insensitive)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rent_clients_name ON rent_clients(name COLLATE NOCASE);")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_rent_equipment_name ON rent_equipment(name COLLATE NOCASE);")
+    try:
+        cur.execute("ALTER TABLE rent_contract_documents ADD COLUMN content_hash TEXT;")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cur.execute("ALTER TABLE rent_templates ADD COLUMN source_hash TEXT;")
+    except sqlite3.OperationalError:
+        pass
+
+    conn.commit()
+
+    # Backfill calculated fields for contracts saved before they were stored
+    if refresh_contract_calcs(conn, only_missing=True):
+        bump_contracts_revision(conn)
+    conn.commit()
+
+    # Contract numbers come from document_sequences. Start each month's counter
+    # at the number of contracts already dated in it, as the old COUNT(*) did.
+    init_sequences_table(conn)
+    cur.execute("""
+        INSERT OR IGNORE INTO document_sequences (series, period, last_value)
+        SELECT 'rent_contract', substr(contract_date, 1, 7), COUNT(*)
+        FROM rent_contracts
+        WHERE contract_date LIKE '____-__-%'
+        GROUP BY substr(contract_date, 1, 7);
+    """)
     conn.commit()
 
     # Seed from CSV if tables are empty
@@ -244,6 +345,21 @@ def init_db():
     _seed_equipment(conn)
     seed_templates(conn)
 
+    # Headings are normalized at save time now; convert rows saved before that once
+    cur.execute("SELECT value FROM global_settings WHERE key = 'rent_doc_headings_normalized';")
+    if cur.fetchone() is None:
+        normalize_stored_documents(conn)
+        cur.execute("INSERT OR REPLACE INTO global_settings (key, value) VALUES ('rent_doc_headings_normalized', '1');")
+        conn.commit()
+
+    # Large HTML is stored zlib-compressed; convert rows written as plain text once
+    cur.execute("SELECT value FROM global_settings WHERE key = 'rent_html_compressed';")
+    if cur.fetchone() is None:
+        compress_column(conn, "rent_templates", "content_html")
+        compress_column(conn, "rent_contract_documents", "custom_content_html")
+        cur.execute("INSERT OR REPLACE INTO global_settings (key, value) VALUES ('rent_html_compressed', '1');")
+        conn.commit()
+
     conn.close()
 
 
@@ -343,6 +459,17 @@ def index():
     return redirect(url_for("list_contracts"))
 
 
+CONTRACT_SORT_OPTIONS = {
+    "date_desc": "contract_date DESC, id DESC",
+    "date_asc": "contract_date ASC, id ASC",
+    "rata_desc": "rata_bruto DESC, id DESC",
+    "rata_asc": "rata_bruto ASC, id ASC",
+    "price_desc": "price DESC, id DESC",
+    "ucesce_desc": "ucesce_bruto DESC, id DESC",
+    "ostatak_desc": "ostatak DESC, id DESC",
+}
+
+
 @app.route("/contracts")
 def list_contracts():
     search = request.args.get("search", "").strip()
@@ -368,19 +495,34 @@ def list_contracts():
 
     where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
 
-    cur.execute(f"SELECT COUNT(*) as c FROM rent_contracts {where}", params)
-    total = cur.fetchone()["c"]
+    sort = request.args.get("sort", "date_desc")
+    order_by = CONTRACT_SORT_OPTIONS.get(sort)
+    if order_by is None:
+        sort, order_by = "date_desc", CONTRACT_SORT_OPTIONS["date_desc"]
+
+    # Count and portfolio totals over the whole filtered set, from stored columns
+    cur.execute(f"""
+        SELECT COUNT(*) AS c,
+               COALESCE(SUM(price), 0) AS price,
+               COALESCE(SUM(ucesce_bruto), 0) AS ucesce_bruto,
+               COALESCE(SUM(rata_neto), 0) AS rata_neto,
+               COALESCE(SUM(rata_bruto), 0) AS rata_bruto,
+               COALESCE(SUM(ostatak), 0) AS ostatak
+        FROM rent_contracts {where};
+    """, params)
+    totals = cur.fetchone()
+    total = totals["c"]
     total_pages = math.ceil(total / per_page) if total else 1
 
-    cur.execute(f"SELECT * FROM rent_contracts {where} ORDER BY contract_date DESC, id DESC LIMIT {per_page} OFFSET {offset}", params)
+    cur.execute(f"SELECT * FROM rent_contracts {where} ORDER BY {order_by} LIMIT {per_page} OFFSET {offset}", params)
     contracts = cur.fetchall()
     conn.close()
 
     return render_template("rent_contracts.html",
                            contracts=contracts,
                            search=search, date_from=date_from, date_to=date_to,
-                           current_page=page, total_pages=total_pages, total=total,
-                           calculate_rent=calculate_rent)
+                           sort=sort, totals=totals,
+                           current_page=page, total_pages=total_pages, total=total)
 
 
 @app.route("/contracts/new", methods=["GET", "POST"])
@@ -417,31 +559,19 @@ def _get_rent_defaults():
 
 
 def generate_next_contract_number(db_conn, contract_date_str):
-    """Generate contract number using: counter (zero-padded 2 chars) + month (2 chars) + year (2 chars)."""
-    try:
-        dt = datetime.strptime(contract_date_str, "%Y-%m-%d")
-    except Exception:
-        dt = date.today()
-    
-    year_short = dt.strftime("%y")  # '26'
-    month_str = dt.strftime("%m")   # '06'
-    
-    cur = db_conn.cursor()
-    pattern = f"{dt.year:04d}-{dt.month:02d}-%"
-    cur.execute("SELECT COUNT(*) as cnt FROM rent_contracts WHERE contract_date LIKE ?;", (pattern,))
-    count = cur.fetchone()["cnt"]
-    
-    next_counter = count + 1
-    return f"{next_counter:02d}{month_str}{year_short}"
+    """
+    Allocate the next contract number for the month of contract_date_str.
+    Default format: counter (zero-padded 2 chars) + month (2 chars) + year (2 chars),
+    configurable via the 'sequence_format_rent_contract' setting.
+    Must run in the same transaction as the INSERT of the contract.
+    """
+    return next_document_number(db_conn, 'rent_contract', contract_date_str,
+                                 unique_in=('rent_contracts', 'contract_number'))
 
 
 def _contract_form(contract_id):
     conn = get_db()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM rent_clients ORDER BY name;")
-    clients = cur.fetchall()
-    cur.execute("SELECT * FROM rent_equipment ORDER BY name;")
-    equipment = cur.fetchall()
 
     contract = None
     if contract_id:
@@ -481,17 +611,20 @@ def _contract_form(contract_id):
             "guarantee_rate": float(request.form.get("guarantee_rate") or 5),
             "admin_fee": float(request.form.get("admin_fee") or 50),
         }
+        data.update(contract_calc_values(data))
         cols = ", ".join(data.keys())
         placeholders = ", ".join(["?"] * len(data))
         if contract_id:
             sets = ", ".join(f"{k}=?" for k in data.keys())
             cur.execute(f"UPDATE rent_contracts SET {sets} WHERE id=?;", list(data.values()) + [contract_id])
+            bump_contracts_revision(conn)
             conn.commit()
             conn.close()
             return redirect(url_for("edit_contract", contract_id=contract_id))
         else:
             cur.execute(f"INSERT INTO rent_contracts ({cols}) VALUES ({placeholders});", list(data.values()))
             new_id = cur.lastrowid
+            bump_contracts_revision(conn)
             conn.commit()
             conn.close()
             return redirect(url_for("edit_contract", contract_id=new_id))
@@ -500,8 +633,6 @@ def _contract_form(contract_id):
     rent_defaults = _get_rent_defaults()
     return render_template("rent_contract_form.html",
                            contract=contract,
-                           clients=clients,
-                           equipment=equipment,
                            today=date.today().isoformat(),
                            rent_defaults=rent_defaults)
 
@@ -510,6 +641,7 @@ def _contract_form(contract_id):
 def delete_contract(contract_id):
     conn = get_db()
     conn.execute("DELETE FROM rent_contracts WHERE id=?;", (contract_id,))
+    bump_contracts_revision(conn)
     conn.commit()
     conn.close()
     return redirect(url_for("list_contracts"))
@@ -529,6 +661,7 @@ def duplicate_contract(contract_id):
         placeholders = ", ".join(["?"] * len(d))
         cur.execute(f"INSERT INTO rent_contracts ({cols}) VALUES ({placeholders});", list(d.values()))
         new_id = cur.lastrowid
+        bump_contracts_revision(conn)
         conn.commit()
         conn.close()
         return redirect(url_for("edit_contract", contract_id=new_id))
@@ -561,6 +694,74 @@ def api_equipment(eq_id):
     return jsonify(dict(row))
 
 
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+
+def _prefix_upper_bound(prefix):
+    """Smallest string above every string starting with prefix (NOCASE order), or None."""
+    # NOCASE folds ASCII letters only; compare against the folded form so 'Z' -> '[' cannot happen
+    folded = "".join(c.lower() if c.isascii() else c for c in prefix)
+    while folded:
+        code = ord(folded[-1]) + 1
+        if 0xD800 <= code <= 0xDFFF:
+            code = 0xE000  # surrogates cannot be stored as UTF-8
+        if code <= 0x10FFFF:
+            return folded[:-1] + chr(code)
+        folded = folded[:-1]
+    return None
+
+
+def _prefix_search(table, q, limit):
+    """Full rows of `table` whose name starts with q (case-insensitive), via the NOCASE name index.
+
+    The prefix is an explicit range (name >= q AND name < q with its last
+    character incremented) so SQLite searches the index; a LIKE with ESCAPE
+    would walk all of it. The LIKE stays on as an exact post-filter.
+    """
+    where, params = ["name IS NOT NULL"], []
+    if q:
+        where.append("name >= ? COLLATE NOCASE")
+        params.append(q)
+        upper = _prefix_upper_bound(q)
+        if upper is not None:
+            where.append("name < ? COLLATE NOCASE")
+            params.append(upper)
+        where.append("name LIKE ? ESCAPE '\\'")
+        params.append(q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute(f"""
+        SELECT * FROM {table}
+        WHERE {" AND ".join(where)}
+        ORDER BY name COLLATE NOCASE
+        LIMIT ?;
+    """, params + [limit])
+    rows = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+
+def _search_limit():
+    try:
+        limit = int(request.args.get("limit", SEARCH_DEFAULT_LIMIT))
+    except ValueError:
+        limit = SEARCH_DEFAULT_LIMIT
+    return max(1, min(limit, SEARCH_MAX_LIMIT))
+
+
+@app.route("/api/clients/search")
+def api_clients_search():
+    """Typeahead: ?q=<prefix>&limit=N -> top N clients by name, full records."""
+    return jsonify(_prefix_search("rent_clients", request.args.get("q", "").strip(), _search_limit()))
+
+
+@app.route("/api/equipment/search")
+def api_equipment_search():
+    """Typeahead: ?q=<prefix>&limit=N -> top N equipment items by name, full records."""
+    return jsonify(_prefix_search("rent_equipment", request.args.get("q", "").strip(), _search_limit()))
+
+
 @app.route("/api/calculate")
 def api_calculate():
     try:
@@ -579,7 +780,124 @@ def api_calculate():
         return jsonify({"error": str(e)}), 400
 
 
+@app.route("/api/calculate_grid", methods=["GET", "POST"])
+def api_calculate_grid():
+    """
+    Evaluate calculate_rent over a grid. Every input accepts a single value,
+    a comma list ('24,36,48') or a range ('10:30:5'); JSON bodies may also use lists.
+    """
+    params = request.get_json(silent=True) if request.method == "POST" else None
+    if params is None:
+        params = request.values
+    elif not isinstance(params, dict):
+        return jsonify({"error": "Telo zahteva mora biti JSON objekat."}), 400
+    try:
+        return jsonify(scenario_grid(params))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+
+@app.route("/contracts/pdf/scenarios")
+def pdf_scenarios():
+    field = request.args.get("field", "rata_bruto")
+    try:
+        grid = scenario_grid(request.args)
+    except ValueError as e:
+        return str(e), 400
+    if field not in grid["results"]:
+        field = "rata_bruto"
+    col_axis, rows = grid_table(grid, field)
+
+    html_str = render_template("rent_pdf_scenarios.html",
+                               grid=grid, col_axis=col_axis, rows=rows, field=field, input_labels=INPUT_LABELS,
+                               equipment_model=request.args.get("equipment_model", ""),
+                               client_name=request.args.get("client_name", ""),
+                               today=date.today().strftime("%d.%m.%Y"),
+                               logo_url=_logo_url(), pdf_mode=True)
+    from weasyprint import HTML
+    with pdf_timer():
+        pdf_bytes = HTML(string=html_str, base_url=BASE_DIR).write_pdf()
+    buf = io.BytesIO(pdf_bytes)
+    buf.seek(0)
+    return send_file(buf, mimetype="application/pdf",
+                     as_attachment=False, download_name="Uporedni_pregled_scenarija.pdf")
+
+
+# ─── Portfolio projection ──────────────────────────────────────────────────────
+def _projection_from_request():
+    months = request.args.get("months", 60, type=int)
+    months = min(max(months, 1), 240)
+    start_month = parse_month(request.args.get("start", ""))
+    top = request.args.get("top", 20, type=int)
+    conn = get_db()
+    try:
+        return cached_projection(conn, get_contracts_revision(conn), start_month, months, top)
+    finally:
+        conn.close()
+
+
+@app.route("/portfolio")
+def portfolio():
+    projection = _projection_from_request()
+    return render_template("rent_portfolio.html",
+                           projection=projection,
+                           months=len(projection["months"]),
+                           start=projection["start"])
+
+
+@app.route("/api/portfolio/projection")
+def api_portfolio_projection():
+    return jsonify(_projection_from_request())
+
+
+@app.route("/portfolio/projection.csv")
+def portfolio_projection_csv():
+    projection = _projection_from_request()
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=";")
+    writer.writerow(["Mesec", "Aktivni ugovori", "Rate neto", "Rate bruto", "Avans + naknade bruto", "Ukupno bruto"])
+    for i, month in enumerate(projection["months"]):
+        gross = projection["installments_gross"][i]
+        upfront = projection["upfront_gross"][i]
+        writer.writerow([
+            month, projection["active_contracts"][i],
+            f"{projection['installments_net'][i]:.2f}", f"{gross:.2f}",
+            f"{upfront:.2f}", f"{gross + upfront:.2f}",
+        ])
+    data = io.BytesIO(out.getvalue().encode("utf-8-sig"))
+    return send_file(data, mimetype="text/csv", as_attachment=True,
+                     download_name=f"projekcija_{projection['start']}.csv")
+
+
 # ─── PDF Routes ────────────────────────────────────────────────────────────────
+def _logo_url():
+    logo_path = os.path.join(APP_ASSETS_DIR, "logo_company.jpg")
+    return f"file://{logo_path}" if os.path.exists(logo_path) else ""
+
+
+def _offer_pdf_html(c):
+    calc = calculate_rent(
+        c["price"], c["period_months"], c["downpayment_percent"],
+        c["salvage_value_percent"], c["interest_rate"], c["insurance_rate"],
+        c["guarantee_rate"], c["vat_percent"], c["admin_fee"]
+    )
+    return render_template("rent_pdf_offer.html",
+                           contract=c, calc=calc,
+                           logo_url=_logo_url(), pdf_mode=True)
+
+
+def _schedule_pdf_html(c):
+    calc = calculate_rent(
+        c["price"], c["period_months"], c["downpayment_percent"],
+        c["salvage_value_percent"], c["interest_rate"], c["insurance_rate"],
+        c["guarantee_rate"], c["vat_percent"], c["admin_fee"]
+    )
+    schedule = generate_schedule(calc, c["contract_date"], c["period_months"])
+    return render_template("rent_pdf_schedule.html",
+                           contract=c, calc=calc, schedule=schedule,
+                           logo_url=_logo_url(), pdf_mode=True)
+
+
 @app.route("/contracts/pdf/offer/<int:contract_id>")
 def pdf_offer(contract_id):
     conn = get_db()
@@ -591,19 +909,10 @@ def pdf_offer(contract_id):
         return "Not found", 404
 
     c = dict(contract)
-    calc = calculate_rent(
-        c["price"], c["period_months"], c["downpayment_percent"],
-        c["salvage_value_percent"], c["interest_rate"], c["insurance_rate"],
-        c["guarantee_rate"], c["vat_percent"], c["admin_fee"]
-    )
-
-    logo_path = os.path.join(APP_ASSETS_DIR, "logo_company.jpg")
-    logo_url = f"file://{logo_path}" if os.path.exists(logo_path) else ""
-
-    html_str = render_template("rent_pdf_offer.html",
-                               contract=c, calc=calc,
-                               logo_url=logo_url, pdf_mode=True)
-    pdf_bytes = HTML(string=html_str, base_url=BASE_DIR).write_pdf()
+    html_str = _offer_pdf_html(c)
+    from weasyprint import HTML
+    with pdf_timer():
+        pdf_bytes = HTML(string=html_str, base_url=BASE_DIR).write_pdf()
     buf = io.BytesIO(pdf_bytes)
     buf.seek(0)
     filename = f"Prilog_3_Ponuda_{c.get('contract_number','') or contract_id}.pdf"
@@ -622,20 +931,10 @@ def pdf_schedule(contract_id):
         return "Not found", 404
 
     c = dict(contract)
-    calc = calculate_rent(
-        c["price"], c["period_months"], c["downpayment_percent"],
-        c["salvage_value_percent"], c["interest_rate"], c["insurance_rate"],
-        c["guarantee_rate"], c["vat_percent"], c["admin_fee"]
-    )
-    schedule = generate_schedule(calc, c["contract_date"], c["period_months"])
-
-    logo_path = os.path.join(APP_ASSETS_DIR, "logo_company.jpg")
-    logo_url = f"file://{logo_path}" if os.path.exists(logo_path) else ""
-
-    html_str = render_template("rent_pdf_schedule.html",
-                               contract=c, calc=calc, schedule=schedule,
-                               logo_url=logo_url, pdf_mode=True)
-    pdf_bytes = HTML(string=html_str, base_url=BASE_DIR).write_pdf()
+    html_str = _schedule_pdf_html(c)
+    from weasyprint import HTML
+    with pdf_timer():
+        pdf_bytes = HTML(string=html_str, base_url=BASE_DIR).write_pdf()
     buf = io.BytesIO(pdf_bytes)
     buf.seek(0)
     filename = f"Prilog_4_Plan_Placanja_{c.get('contract_number','') or contract_id}.pdf"
@@ -741,40 +1040,6 @@ def list_equipment():
     return render_template("rent_equipment.html", equipment=equipment, edit_eq=edit_eq, msg=msg)
 
 
-# ─── Helper: format document HTML with official headings ───────────────────────
-def format_document_html(html: str) -> str:
-    if not html:
-        return ""
-    import re
-    # 1. Replace <p><strong>Član 1</strong></p> with <h3 class="clan-header">Član \1.</h3>
-    html = re.sub(
-        r'<p>\s*<strong>\s*Član\s+(\d+)\s*\.?\s*</strong>\s*</p>',
-        r'<h3 class="clan-header">Član \1.</h3>',
-        html
-    )
-    # 2. Replace specific section headers that are wrapped in <p><strong>...</strong></p>
-    headers = [
-        'Predmet ugovora',
-        'Predmet zakupa, trajanje zakupa i zakupnina',
-        'Primopredaja Predmeta zakupa',
-        'Odgovornost Ugovarača u vezi Predmeta zakupa',
-        'Plaćanje zakupnine',
-        'Kašnjenje u plaćanju',
-        'Održavanje i upotreba Predmeta zakupa',
-        'Osiguranje predmeta',
-        'Obaveze obaveštavanja i dozvola pristupa',
-        'Sredstva obezbeđenja',
-        'Završne odredbe'
-    ]
-    for h in headers:
-        html = re.sub(
-            rf'<p>\s*<strong>\s*({h})[\s\t\.]*\s*</strong>\s*</p>',
-            r'<h4 class="section-header">\1</h4>',
-            html
-        )
-    return html
-
-
 # ─── Helper: build template context for a contract ─────────────────────────────
 def _build_doc_context(contract: dict, calc: dict) -> dict:
     """Return a flat dict mapping all Jinja placeholders to human-readable values."""
@@ -822,6 +1087,17 @@ def _build_doc_context(contract: dict, calc: dict) -> dict:
     }
 
 
+def _fill_contract_document(contract, template_html):
+    """Fill a (heading-normalized, possibly packed) master template with contract data."""
+    c = dict(contract)
+    calc = calculate_rent(
+        c["price"], c["period_months"], c["downpayment_percent"],
+        c["salvage_value_percent"], c["interest_rate"], c["insurance_rate"],
+        c["guarantee_rate"], c["vat_percent"], c["admin_fee"]
+    )
+    return fill_template(unpack_text(template_html), _build_doc_context(c, calc))
+
+
 # ─── Document list for a contract ──────────────────────────────────────────────
 # Preferred display order for rent templates (slugs not listed go to the end)
 TEMPLATE_SORT_ORDER = [
@@ -917,16 +1193,31 @@ def document_editor(contract_id, slug):
         return "Šablon nije pronađen", 404
 
     if request.method == "POST":
-        content = request.form.get("content", "")
-        cur.execute("""
-            INSERT INTO rent_contract_documents (contract_id, template_slug, custom_content_html, updated_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(contract_id, template_slug) DO UPDATE SET
-                custom_content_html = excluded.custom_content_html,
-                updated_at = excluded.updated_at;
-        """, (contract_id, slug, content, datetime.now().isoformat()))
-        conn.commit()
+        content = normalize_headings(request.form.get("content", ""))
+        digest = content_hash(content)
+        cur.execute("SELECT content_hash FROM rent_contract_documents WHERE contract_id=? AND template_slug=?;",
+                    (contract_id, slug))
+        row = cur.fetchone()
+        # Autosave posts the whole document; only write when it actually changed
+        if not row or row["content_hash"] != digest:
+            # A document still identical to the filled master template stores no
+            # content; readers fall back to the template for an empty value.
+            if content == _fill_contract_document(contract, template["content_html"]):
+                stored = ""
+            else:
+                stored = pack_text(content)
+            cur.execute("""
+                INSERT INTO rent_contract_documents (contract_id, template_slug, custom_content_html, content_hash, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(contract_id, template_slug) DO UPDATE SET
+                    custom_content_html = excluded.custom_content_html,
+                    content_hash = excluded.content_hash,
+                    updated_at = excluded.updated_at;
+            """, (contract_id, slug, stored, digest, datetime.now().isoformat()))
+            conn.commit()
         conn.close()
+        if request.form.get("autosave"):
+            return "", 204
         return redirect(url_for("document_editor", contract_id=contract_id, slug=slug))
 
     # GET — check if a draft already exists
@@ -934,22 +1225,13 @@ def document_editor(contract_id, slug):
                 (contract_id, slug))
     row = cur.fetchone()
 
-    if row:
-        html_content = format_document_html(row["custom_content_html"])
+    # Stored templates and drafts already have normalized headings
+    saved_html = unpack_text(row["custom_content_html"]) if row else ""
+    if saved_html:
+        html_content = saved_html
     else:
-        # Pre-fill master template with contract data using simple string replace
-        c = dict(contract)
-        calc = calculate_rent(
-            c["price"], c["period_months"], c["downpayment_percent"],
-            c["salvage_value_percent"], c["interest_rate"], c["insurance_rate"],
-            c["guarantee_rate"], c["vat_percent"], c["admin_fee"]
-        )
-        ctx = _build_doc_context(c, calc)
-        raw_html = template["content_html"]
-        for key, value in ctx.items():
-            raw_html = raw_html.replace("{{ " + key + " }}", str(value))
-            raw_html = raw_html.replace("{{" + key + "}}", str(value))
-        html_content = format_document_html(raw_html)
+        # Pre-fill master template with contract data
+        html_content = _fill_contract_document(contract, template["content_html"])
 
     conn.close()
     return render_template("rent_document_editor.html",
@@ -958,6 +1240,20 @@ def document_editor(contract_id, slug):
                            html_content=html_content)
 
 
+def _document_pdf_html(contract, template, saved_html=None):
+    saved_html = unpack_text(saved_html)
+    if saved_html:
+        html_content = saved_html
+    else:
+        html_content = _fill_contract_document(contract, template["content_html"])
+    return render_template("rent_pdf_document.html",
+                           contract=dict(contract),
+                           template_name=template["name"],
+                           html_content=html_content,
+                           logo_url=_logo_url(),
+                           pdf_mode=True)
+
+
 # ─── Print document to PDF ─────────────────────────────────────────────────────
 @app.route("/contracts/<int:contract_id>/documents/<slug>/pdf")
 def document_pdf(contract_id, slug):
@@ -977,35 +1273,60 @@ def document_pdf(contract_id, slug):
     row = cur.fetchone()
     conn.close()
 
-    if row:
-        html_content = format_document_html(row["custom_content_html"])
-    else:
-        c = dict(contract)
-        calc = calculate_rent(
-            c["price"], c["period_months"], c["downpayment_percent"],
-            c["salvage_value_percent"], c["interest_rate"], c["insurance_rate"],
-            c["guarantee_rate"], c["vat_percent"], c["admin_fee"]
-        )
-        ctx = _build_doc_context(c, calc)
-        raw_html = template["content_html"]
-        for key, value in ctx.items():
-            raw_html = raw_html.replace("{{ " + key + " }}", str(value))
-            raw_html = raw_html.replace("{{" + key + "}}", str(value))
-        html_content = format_document_html(raw_html)
-
-    logo_path = os.path.join(APP_ASSETS_DIR, "logo_company.jpg")
-    logo_url = f"file://{logo_path}" if os.path.exists(logo_path) else ""
-
-    html_str = render_template("rent_pdf_document.html",
-                               contract=dict(contract),
-                               template_name=template["name"],
-                               html_content=html_content,
-                               logo_url=logo_url,
-                               pdf_mode=True)
-    pdf_bytes = HTML(string=html_str, base_url=BASE_DIR).write_pdf()
+    html_str = _document_pdf_html(contract, template, row["custom_content_html"] if row else None)
+    from weasyprint import HTML
+    with pdf_timer():
+        pdf_bytes = HTML(string=html_str, base_url=BASE_DIR).write_pdf()
     buf = io.BytesIO(pdf_bytes)
     buf.seek(0)
     cnum = dict(contract).get("contract_number") or str(contract_id)
     filename = f"{slug}_{cnum}.pdf"
     return send_file(buf, mimetype="application/pdf", as_attachment=False, download_name=filename)
 
+
+# ─── Full document package (all templates + Prilog 3 & 4) ──────────────────────
+@app.route("/contracts/<int:contract_id>/documents/bundle")
+def documents_bundle(contract_id):
+    """
+    Render every document of a contract in one request. HTML is built here,
+    the PDF conversion runs in worker processes and unchanged parts come from
+    the on-disk cache. ?format=zip returns separate files instead of one PDF.
+    """
+    fmt = request.args.get("format", "pdf")
+    conn = get_db()
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM rent_contracts WHERE id=?;", (contract_id,))
+    contract = cur.fetchone()
+    if not contract:
+        conn.close()
+        return "Ugovor nije pronađen", 404
+    cur.execute("SELECT * FROM rent_templates ORDER BY id;")
+    templates = _sort_templates(cur.fetchall())
+    cur.execute("SELECT template_slug, custom_content_html FROM rent_contract_documents WHERE contract_id=?;",
+                (contract_id,))
+    saved = {row["template_slug"]: row["custom_content_html"] for row in cur.fetchall()}
+    conn.close()
+
+    c = dict(contract)
+    cnum = c.get("contract_number") or str(contract_id)
+    parts = []
+    # Same order as the documents page: three templates, then Prilog 3 and 4, then the rest
+    for i, t in enumerate(templates, start=1):
+        parts.append((f"{i if i <= 3 else i + 2:02d}_{t['slug']}_{cnum}.pdf",
+                      _document_pdf_html(contract, t, saved.get(t["slug"]))))
+        if i == 3:
+            parts.append((f"04_Prilog_3_Ponuda_{cnum}.pdf", _offer_pdf_html(c)))
+            parts.append((f"05_Prilog_4_Plan_Placanja_{cnum}.pdf", _schedule_pdf_html(c)))
+    if len(templates) < 3:
+        parts.append((f"Prilog_3_Ponuda_{cnum}.pdf", _offer_pdf_html(c)))
+        parts.append((f"Prilog_4_Plan_Placanja_{cnum}.pdf", _schedule_pdf_html(c)))
+
+    with pdf_timer():
+        pdf_parts = render_parts(parts, BASE_DIR, PDF_CACHE_DIR)
+
+    if fmt == "zip":
+        return send_file(zip_pdfs(pdf_parts), mimetype="application/zip",
+                         as_attachment=True, download_name=f"Dokumenta_{cnum}.zip")
+    return send_file(merge_pdfs(pdf_parts), mimetype="application/pdf",
+                     as_attachment=False, download_name=f"Dokumenta_{cnum}.pdf")
+
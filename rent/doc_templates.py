@@ -0,0 +1,112 @@
+"""
+Rent document templating.
+
+Templates and saved documents are stored with their headings already
+normalized (normalize_headings runs when a template or document is saved),
+so viewing or printing a document only has to fill placeholders. A template
+is compiled once into a list of literal / placeholder segments and cached by
+content hash; filling it is a single join over that list.
+"""
+import hashlib
+import re
+import threading
+
+from shared.blobstore import pack_text, unpack_text
+
+# Section titles that are turned into <h4 class="section-header">
+SECTION_HEADERS = [
+    'Predmet ugovora',
+    'Predmet zakupa, trajanje zakupa i zakupnina',
+    'Primopredaja Predmeta zakupa',
+    'Odgovornost Ugovarača u vezi Predmeta zakupa',
+    'Plaćanje zakupnine',
+    'Kašnjenje u plaćanju',
+    'Održavanje i upotreba Predmeta zakupa',
+    'Osiguranje predmeta',
+    'Obaveze obaveštavanja i dozvola pristupa',
+    'Sredstva obezbeđenja',
+    'Završne odredbe',
+]
+
+_CLAN_RE = re.compile(r'<p>\s*<strong>\s*Član\s+(\d+)\s*\.?\s*</strong>\s*</p>')
+_SECTION_RE = re.compile(
+    r'<p>\s*<strong>\s*('
+    + '|'.join(re.escape(h) for h in sorted(SECTION_HEADERS, key=len, reverse=True))
+    + r')[\s\t\.]*\s*</strong>\s*</p>'
+)
+_PLACEHOLDER_RE = re.compile(r'\{\{\s*(\w+)\s*\}\}')
+
+_CACHE_MAX_ENTRIES = 256
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def normalize_headings(html):
+    """Turn bold 'Član N' paragraphs and known section titles into official headings."""
+    if not html:
+        return ""
+    html = _CLAN_RE.sub(r'<h3 class="clan-header">Član \1.</h3>', html)
+    return _SECTION_RE.sub(r'<h4 class="section-header">\1</h4>', html)
+
+
+def compile_template(html):
+    """
+    Split a template into [literal, key, raw, literal, key, raw, ..., literal].
+    `raw` is the original placeholder text, kept for keys missing from the context.
+    """
+    parts = []
+    pos = 0
+    for m in _PLACEHOLDER_RE.finditer(html):
+        parts.append(html[pos:m.start()])
+        parts.append(m.group(1))
+        parts.append(m.group(0))
+        pos = m.end()
+    parts.append(html[pos:])
+    return parts
+
+
+def _get_compiled(html):
+    key = hashlib.sha1(html.encode("utf-8")).hexdigest()
+    with _compiled_lock:
+        plan = _compiled.get(key)
+    if plan is None:
+        plan = compile_template(html)
+        with _compiled_lock:
+            if len(_compiled) >= _CACHE_MAX_ENTRIES:
+                _compiled.clear()
+            _compiled[key] = plan
+    return plan
+
+
+def fill_template(html, ctx):
+    """Substitute {{ key }} placeholders from ctx in one pass; unknown keys are left as-is."""
+    if not html:
+        return ""
+    plan = _get_compiled(html)
+    out = [plan[0]]
+    for i in range(1, len(plan), 3):
+        key, raw = plan[i], plan[i + 1]
+        out.append(str(ctx[key]) if key in ctx else raw)
+        out.append(plan[i + 2])
+    return "".join(out)
+
+
+def normalize_stored_documents(conn):
+    """
+    One-time migration: normalize headings of templates and saved documents
+    stored before normalization moved to save time. The caller commits.
+    """
+    cur = conn.cursor()
+    cur.execute("SELECT id, content_html FROM rent_templates;")
+    for row in cur.fetchall():
+        old = unpack_text(row["content_html"])
+        html = normalize_headings(old)
+        if html != old:
+            conn.execute("UPDATE rent_templates SET content_html=? WHERE id=?;", (pack_text(html), row["id"]))
+    cur.execute("SELECT id, custom_content_html FROM rent_contract_documents;")
+    for row in cur.fetchall():
+        old = unpack_text(row["custom_content_html"])
+        html = normalize_headings(old)
+        if html != old:
+            conn.execute("UPDATE rent_contract_documents SET custom_content_html=? WHERE id=?;",
+                         (pack_text(html), row["id"]))
@@ -6,10 +6,27 @@ Priority order:
   1. If rent_templates is already populated → skip (idempotent).
   2. If rent_templates_defaults.json exists next to this file → seed from JSON.
   3. If .docx source files exist (legacy path) → convert and seed (kept for compatibility).
+
+The .docx conversion also backs the admin "re-import" action
+(import_docx_folder): files are converted in parallel worker processes, the
+HTML is cached by file hash, and files unchanged since their last import are
+skipped.
 """
 import os
 import sys
+import io
+import re
 import json
+import hashlib
+import unicodedata
+import zipfile
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+
+from rent.doc_templates import normalize_headings
+from shared.blobstore import pack_text
+from shared.config import DOCX_CACHE_DIR
 
 # ---------------------------------------------------------------------------
 # Paths
@@ -92,7 +109,7 @@ def seed_templates(conn):
         for entry in entries:
             cur.execute(
                 "INSERT INTO rent_templates (slug, name, content_html) VALUES (?, ?, ?);",
-                (entry["slug"], entry["name"], entry["content_html"]),
+                (entry["slug"], entry["name"], pack_text(normalize_headings(entry["content_html"]))),
             )
             print(f"[import_templates] Seeded: {entry['name']}")
         conn.commit()
@@ -103,113 +120,259 @@ def seed_templates(conn):
 
 
 # ---------------------------------------------------------------------------
-# Legacy .docx conversion (kept for compatibility)
+# .docx conversion (legacy seed path and admin re-import)
 # ---------------------------------------------------------------------------
+NS_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+# Bump when the conversion output changes so cached HTML is not reused
+CONVERTER_VERSION = 1
+
+_MAX_WORKERS = 4
+
+
+def _resolve_field(raw_name):
+    key = raw_name.strip('"«» ').lower()
+    return FIELD_MAP.get(key, key)
+
+
+def _clean_xml_fields(xml_bytes):
+    """Replace Word MERGEFIELD / DATE fields with {{ placeholder }} runs."""
+    for prefix, uri in [
+        ('w',   NS_W),
+        ('r',   'http://schemas.openxmlformats.org/officeDocument/2006/relationships'),
+        ('w14', 'http://schemas.microsoft.com/office/word/2010/wordml'),
+        ('mc',  'http://schemas.openxmlformats.org/markup-compatibility/2006'),
+    ]:
+        ET.register_namespace(prefix, uri)
+
+    root = ET.fromstring(xml_bytes)
+    for para in root.iter(f'{{{NS_W}}}p'):
+        children = list(para)
+        new_children = []
+        i = 0
+        while i < len(children):
+            child = children[i]
+            is_begin = False
+            if child.tag == f'{{{NS_W}}}r':
+                fc = child.find(f'{{{NS_W}}}fldChar')
+                if fc is not None and fc.get(f'{{{NS_W}}}fldCharType') == 'begin':
+                    is_begin = True
+            if is_begin:
+                field_var = None
+                end_idx = -1
+                for j in range(i + 1, len(children)):
+                    sib = children[j]
+                    if sib.tag != f'{{{NS_W}}}r':
+                        continue
+                    instr = sib.find(f'{{{NS_W}}}instrText')
+                    if instr is not None and instr.text:
+                        txt = instr.text.strip()
+                        if txt.upper().startswith('MERGEFIELD'):
+                            parts = txt.split(None, 2)
+                            if len(parts) > 1:
+                                field_var = '{{ ' + _resolve_field(parts[1]) + ' }}'
+                        elif txt.upper().startswith('DATE'):
+                            field_var = '{{ contract_date }}'
+                    fc = sib.find(f'{{{NS_W}}}fldChar')
+                    if fc is not None and fc.get(f'{{{NS_W}}}fldCharType') == 'end':
+                        end_idx = j
+                        break
+                if field_var and end_idx != -1:
+                    r_new = ET.Element(f'{{{NS_W}}}r')
+                    rpr = child.find(f'{{{NS_W}}}rPr')
+                    if rpr is not None:
+                        r_new.append(rpr)
+                    t = ET.SubElement(r_new, f'{{{NS_W}}}t')
+                    t.text = field_var
+                    new_children.append(r_new)
+                    i = end_idx + 1
+                    continue
+            new_children.append(child)
+            i += 1
+        for c in list(para):
+            para.remove(c)
+        for c in new_children:
+            para.append(c)
+    return ET.tostring(root, encoding='utf-8', xml_declaration=True)
+
+
+def docx_to_html(docx_bytes):
+    """.docx file contents -> HTML with merge fields turned into placeholders."""
+    import mammoth
+
+    with zipfile.ZipFile(io.BytesIO(docx_bytes), 'r') as z_in:
+        patched_xml = _clean_xml_fields(z_in.read('word/document.xml'))
+        buf = io.BytesIO()
+        # Only document.xml changes; the other members are copied without recompressing
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as z_out:
+            for item in z_in.infolist():
+                if item.filename == 'word/document.xml':
+                    z_out.writestr(item.filename, patched_xml)
+                else:
+                    z_out.writestr(item.filename, z_in.read(item.filename))
+        buf.seek(0)
+    return mammoth.convert_to_html(buf).value
+
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"{digest}-v{CONVERTER_VERSION}.html")
+
+
+def convert_docx_files(docx_files, cache_dir=None):
+    """
+    docx_files: {key: docx_bytes}. Returns {key: html} for the files that
+    converted, and {key: error message} for those that failed.
+
+    Converted HTML is cached on disk by SHA-256 of the .docx bytes; files not
+    in the cache are converted in parallel worker processes.
+    """
+    cache_dir = cache_dir or DOCX_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    results, errors, pending = {}, {}, {}
+    for key, data in docx_files.items():
+        digest = hashlib.sha256(data).hexdigest()
+        path = _cache_path(cache_dir, digest)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                results[key] = f.read()
+        else:
+            pending[key] = digest
+
+    if len(pending) == 1:
+        # Not worth starting a worker process for a single file
+        key = next(iter(pending))
+        try:
+            converted = {key: docx_to_html(docx_files[key])}
+        except Exception as e:
+            converted = {}
+            errors[key] = str(e)
+    elif pending:
+        workers = max(1, min(_MAX_WORKERS, os.cpu_count() or 1, len(pending)))
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {key: executor.submit(docx_to_html, docx_files[key]) for key in pending}
+            converted = {}
+            for key, fut in futures.items():
+                try:
+                    converted[key] = fut.result()
+                except Exception as e:
+                    errors[key] = str(e)
+    else:
+        converted = {}
+
+    for key, html in converted.items():
+        path = _cache_path(cache_dir, pending[key])
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(html)
+        os.replace(tmp, path)
+        results[key] = html
+    return results, errors
+
+
+# Serbian Cyrillic -> Latin, plus the Latin letters NFKD does not decompose
+_TRANSLITERATION = str.maketrans({
+    "а": "a", "б": "b", "в": "v", "г": "g", "д": "d", "ђ": "dj", "е": "e", "ж": "z", "з": "z",
+    "и": "i", "ј": "j", "к": "k", "л": "l", "љ": "lj", "м": "m", "н": "n", "њ": "nj", "о": "o",
+    "п": "p", "р": "r", "с": "s", "т": "t", "ћ": "c", "у": "u", "ф": "f", "х": "h", "ц": "c",
+    "ч": "c", "џ": "dz", "ш": "s", "đ": "dj", "ß": "ss", "æ": "ae", "ø": "o", "ł": "l",
+})
+
+
+def _slug_for(filename):
+    """Slug and display name for a .docx file; unknown files get one from the file name."""
+    for known_file, slug, display_name in TEMPLATES:
+        if known_file == filename:
+            return slug, display_name
+    stem = os.path.splitext(filename)[0]
+    latin = unicodedata.normalize("NFKD", stem.lower().translate(_TRANSLITERATION))
+    slug = re.sub(r"[^a-z0-9]+", "-", latin.encode("ascii", "ignore").decode("ascii")).strip("-")
+    # Nothing transliterable left (another script, only symbols): a stable id from the file name
+    return slug or "sablon-" + hashlib.sha1(filename.encode("utf-8")).hexdigest()[:8], stem
+
+
+def import_docx_folder(conn, folder=None, only_known=False, force=False):
+    """
+    Convert every .docx in `folder` and upsert it into rent_templates.
+
+    A file whose SHA-256 matches the source_hash stored with its template is
+    skipped without converting, unless force is set. A template without a
+    source_hash (seeded from the JSON defaults or edited in admin) is kept
+    as it is, unless force is set, so a reimport never overwrites those
+    edits. only_known limits the import to the files listed in TEMPLATES.
+    Returns counts per outcome.
+    """
+    folder = folder or DOCX_DIR
+    stats = {"imported": 0, "updated": 0, "unchanged": 0, "kept": 0, "failed": 0}
+    if not os.path.isdir(folder):
+        return stats
+
+    cur = conn.cursor()
+    cur.execute("SELECT slug, source_hash FROM rent_templates;")
+    existing = {row["slug"]: row["source_hash"] for row in cur.fetchall()}
+
+    known_files = {t[0] for t in TEMPLATES}
+    to_convert, digests, slugs = {}, {}, {}
+    for filename in sorted(os.listdir(folder)):
+        if not filename.lower().endswith(".docx") or filename.startswith("~$"):
+            continue
+        if only_known and filename not in known_files:
+            continue
+        slug, _ = _slug_for(filename)
+        if slug in slugs.values():
+            # Two files would overwrite the same template: the first keeps it, the other is refused
+            other = next(name for name, s in slugs.items() if s == slug)
+            print(f"[import_templates] ERROR: {filename} and {other} both map to template '{slug}'; "
+                  f"skipping {filename}, rename one of them.")
+            stats["failed"] += 1
+            continue
+        slugs[filename] = slug
+        with open(os.path.join(folder, filename), "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if not force and slug in existing:
+            if existing[slug] is None:
+                stats["kept"] += 1
+                continue
+            if existing[slug] == digest:
+                stats["unchanged"] += 1
+                continue
+        to_convert[filename] = data
+        digests[filename] = digest
+
+    converted, errors = convert_docx_files(to_convert)
+    for filename, err in errors.items():
+        print(f"[import_templates] ERROR importing {filename}: {err}")
+        stats["failed"] += 1
+
+    for filename in to_convert:
+        if filename not in converted:
+            continue
+        slug, display_name = slugs[filename], _slug_for(filename)[1]
+        cur.execute("""
+            INSERT INTO rent_templates (slug, name, content_html, source_hash)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(slug) DO UPDATE SET
+                content_html = excluded.content_html,
+                source_hash = excluded.source_hash;
+        """, (slug, display_name, pack_text(normalize_headings(converted[filename])), digests[filename]))
+        stats["updated" if slug in existing else "imported"] += 1
+        print(f"[import_templates] Imported: {display_name}")
+    conn.commit()
+    return stats
+
 
 def _seed_from_docx(cur, conn):
     """Convert Word .docx files to HTML and seed the database."""
     try:
-        import zipfile
-        import xml.etree.ElementTree as ET
-        import mammoth
+        import mammoth  # noqa: F401
     except ImportError:
         print("[import_templates] mammoth not installed – skipping docx seed.")
         return
 
-    NS_W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
-
-    def _resolve_field(raw_name):
-        key = raw_name.strip('"«» ').lower()
-        return FIELD_MAP.get(key, key)
-
-    def _clean_xml_fields(xml_bytes):
-        for prefix, uri in [
-            ('w',   NS_W),
-            ('r',   'http://schemas.openxmlformats.org/officeDocument/2006/relationships'),
-            ('w14', 'http://schemas.microsoft.com/office/word/2010/wordml'),
-            ('mc',  'http://schemas.openxmlformats.org/markup-compatibility/2006'),
-        ]:
-            ET.register_namespace(prefix, uri)
-
-        root = ET.fromstring(xml_bytes)
-        for para in root.iter(f'{{{NS_W}}}p'):
-            children = list(para)
-            new_children = []
-            i = 0
-            while i < len(children):
-                child = children[i]
-                is_begin = False
-                if child.tag == f'{{{NS_W}}}r':
-                    fc = child.find(f'{{{NS_W}}}fldChar')
-                    if fc is not None and fc.get(f'{{{NS_W}}}fldCharType') == 'begin':
-                        is_begin = True
-                if is_begin:
-                    field_var = None
-                    end_idx = -1
-                    for j in range(i + 1, len(children)):
-                        sib = children[j]
-                        if sib.tag != f'{{{NS_W}}}r':
-                            continue
-                        instr = sib.find(f'{{{NS_W}}}instrText')
-                        if instr is not None and instr.text:
-                            txt = instr.text.strip()
-                            if txt.upper().startswith('MERGEFIELD'):
-                                parts = txt.split(None, 2)
-                                if len(parts) > 1:
-                                    field_var = '{{ ' + _resolve_field(parts[1]) + ' }}'
-                            elif txt.upper().startswith('DATE'):
-                                field_var = '{{ contract_date }}'
-                        fc = sib.find(f'{{{NS_W}}}fldChar')
-                        if fc is not None and fc.get(f'{{{NS_W}}}fldCharType') == 'end':
-                            end_idx = j
-                            break
-                    if field_var and end_idx != -1:
-                        r_new = ET.Element(f'{{{NS_W}}}r')
-                        rpr = child.find(f'{{{NS_W}}}rPr')
-                        if rpr is not None:
-                            r_new.append(rpr)
-                        t = ET.SubElement(r_new, f'{{{NS_W}}}t')
-                        t.text = field_var
-                        new_children.append(r_new)
-                        i = end_idx + 1
-                        continue
-                new_children.append(child)
-                i += 1
-            for c in list(para):
-                para.remove(c)
-            for c in new_children:
-                para.append(c)
-        return ET.tostring(root, encoding='utf-8', xml_declaration=True)
-
-    def _docx_to_html(docx_path):
-        import io as _io
-        with zipfile.ZipFile(docx_path, 'r') as z_in:
-            doc_xml = z_in.read('word/document.xml')
-            patched_xml = _clean_xml_fields(doc_xml)
-            buf = _io.BytesIO()
-            with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z_out:
-                for item in z_in.infolist():
-                    if item.filename == 'word/document.xml':
-                        z_out.writestr(item, patched_xml)
-                    else:
-                        z_out.writestr(item, z_in.read(item.filename))
-            buf.seek(0)
-        result = mammoth.convert_to_html(buf)
-        return result.value
-
     print("[import_templates] JSON defaults not found – trying .docx conversion ...")
     for filename, slug, display_name in TEMPLATES:
-        docx_path = os.path.join(DOCX_DIR, filename)
-        if not os.path.exists(docx_path):
+        if not os.path.exists(os.path.join(DOCX_DIR, filename)):
             print(f"[import_templates] WARNING: {filename} not found, skipping.")
-            continue
-        try:
-            html = _docx_to_html(docx_path)
-            cur.execute(
-                "INSERT INTO rent_templates (slug, name, content_html) VALUES (?, ?, ?);",
-                (slug, display_name, html),
-            )
-            print(f"[import_templates] Imported: {display_name}")
-        except Exception as e:
-            print(f"[import_templates] ERROR importing {filename}: {e}")
-    conn.commit()
+    import_docx_folder(conn, DOCX_DIR, only_known=True)
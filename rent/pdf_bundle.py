@@ -0,0 +1,217 @@
+"""
+Contract document bundle: render many HTML documents to PDF in parallel
+worker processes and merge them into one PDF (or a ZIP of separate files).
+
+Rendered parts are cached on disk under PDF_CACHE_DIR, keyed by a SHA-256
+of the final HTML plus the path, size and mtime of every local file it
+references (the logo, images, stylesheets), so a bundle only re-renders
+documents whose content or resources changed since they were last printed.
+A cache hit refreshes the file's mtime; prune_cache() drops parts unused
+for CACHE_MAX_AGE_SECONDS and then the least recently used ones until the
+cache fits CACHE_MAX_BYTES.
+
+Kept free of Flask imports: worker processes are started with 'spawn' and
+import only this module.
+"""
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+import zipfile
+from pathlib import Path
+from urllib.parse import unquote, urljoin, urlparse
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+
+_executor = None
+_executor_lock = threading.Lock()
+
+_MAX_WORKERS = 4
+# A bundle part that takes longer is abandoned (the gunicorn timeout is 120 s)
+RENDER_TIMEOUT_SECONDS = 90
+
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+CACHE_MAX_AGE_SECONDS = 30 * 24 * 3600
+_PRUNE_INTERVAL_SECONDS = 3600
+_last_prune = 0.0
+
+_RESOURCE_RE = re.compile(r"""(?:\bsrc|\bhref)\s*=\s*["']([^"']+)["']|url\(\s*["']?([^"')]+)["']?\s*\)""", re.I)
+
+
+def _render_pdf(html_str, base_url):
+    """Worker: HTML string -> PDF bytes."""
+    from weasyprint import HTML
+    return HTML(string=html_str, base_url=base_url).write_pdf()
+
+
+def _pool_size():
+    """Render processes for this web process: the cores shared out between the gunicorn workers."""
+    # gunicorn.conf.py exports QP_WORKERS; the development server is a single process
+    web_workers = max(1, int(os.environ.get("QP_WORKERS") or 1))
+    return max(1, min(_MAX_WORKERS, (os.cpu_count() or 1) // web_workers))
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=_pool_size(),
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def _discard_executor(executor):
+    """Drop a broken or stuck pool (the next _get_executor() starts a new one) and stop its processes."""
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+    # shutdown() leaves a running render alone; a stuck one would hold its process forever
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+
+
+def _render_in_pool(jobs, base_url):
+    """{key: pdf bytes} for {key: html}; a pool broken by a crashed child is replaced and retried once."""
+    for attempt in range(2):
+        executor = _get_executor()
+        try:
+            futures = {key: executor.submit(_render_pdf, html_str, base_url) for key, html_str in jobs.items()}
+            _, not_done = wait(futures.values(), timeout=RENDER_TIMEOUT_SECONDS)
+            if not_done:
+                _discard_executor(executor)
+                raise TimeoutError(f"PDF rendering took longer than {RENDER_TIMEOUT_SECONDS} s")
+            return {key: fut.result() for key, fut in futures.items()}
+        except BrokenProcessPool:
+            _discard_executor(executor)
+            if attempt:
+                raise
+
+
+def _local_resources(html_str, base_url):
+    """Paths of the local files html_str references, resolved the way WeasyPrint resolves them."""
+    base = Path(base_url).as_uri() + "/" if base_url else ""
+    paths = set()
+    for match in _RESOURCE_RE.finditer(html_str):
+        ref = (match.group(1) or match.group(2)).strip()
+        url = urlparse(urljoin(base, ref))
+        if url.scheme == "file":
+            paths.add(unquote(url.path))
+    return sorted(paths)
+
+
+def part_hash(html_str, base_url=None):
+    digest = hashlib.sha256(html_str.encode("utf-8"))
+    for path in _local_resources(html_str, base_url):
+        try:
+            st = os.stat(path)
+            digest.update(f"\0{path}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8"))
+        except OSError:
+            digest.update(f"\0{path}|missing".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"{digest}.pdf")
+
+
+def render_parts(parts, base_url, cache_dir):
+    """
+    parts: list of (filename, html_str). Returns list of (filename, pdf_bytes)
+    in the same order. Cached parts are read from disk; the rest are rendered
+    in parallel and written to the cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    results = [None] * len(parts)
+    pending = {}
+    for i, (filename, html_str) in enumerate(parts):
+        digest = part_hash(html_str, base_url)
+        path = _cache_path(cache_dir, digest)
+        try:
+            with open(path, "rb") as f:
+                results[i] = (filename, f.read())
+            os.utime(path)  # recently used: pruned last
+        except OSError:
+            pending[i] = digest
+
+    if pending:
+        if len(pending) == 1:
+            # Not worth a round-trip to a worker process
+            i = next(iter(pending))
+            rendered = {i: _render_pdf(parts[i][1], base_url)}
+        else:
+            rendered = _render_in_pool({i: parts[i][1] for i in pending}, base_url)
+        for i, pdf_bytes in rendered.items():
+            path = _cache_path(cache_dir, pending[i])
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(pdf_bytes)
+            os.replace(tmp, path)
+            results[i] = (parts[i][0], pdf_bytes)
+        _maybe_prune(cache_dir)
+    return results
+
+
+def _maybe_prune(cache_dir):
+    global _last_prune
+    now = time.time()
+    if now - _last_prune >= _PRUNE_INTERVAL_SECONDS:
+        _last_prune = now
+        prune_cache(cache_dir)
+
+
+def prune_cache(cache_dir, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE_SECONDS):
+    """Delete cached parts unused for max_age seconds, then the least recently used beyond max_bytes.
+
+    Only the *.pdf parts directly in cache_dir are touched (thumbs/ belongs to the catalog).
+    """
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return
+    entries = []
+    for name in names:
+        if not name.endswith(".pdf"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    entries.sort(reverse=True)
+    cutoff = time.time() - max_age
+    total = 0
+    for mtime, size, path in entries:
+        total += size
+        if mtime < cutoff or total > max_bytes:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def merge_pdfs(pdf_parts):
+    """Concatenate PDF byte strings into one PDF."""
+    from pypdf import PdfWriter, PdfReader
+    writer = PdfWriter()
+    for _, pdf_bytes in pdf_parts:
+        writer.append(PdfReader(io.BytesIO(pdf_bytes)))
+    out = io.BytesIO()
+    writer.write(out)
+    out.seek(0)
+    return out
+
+
+def zip_pdfs(pdf_parts):
+    buf = io.BytesIO()
+    # PDFs are already compressed; storing them keeps the ZIP step cheap
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:
+        for filename, pdf_bytes in pdf_parts:
+            zf.writestr(filename, pdf_bytes)
+    buf.seek(0)
+    return buf
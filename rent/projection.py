@@ -0,0 +1,176 @@
+"""
+Portfolio cash-flow projection for rent contracts.
+
+Every contract pays its admin fee and down payment in the month of the
+contract date, followed by `period_months` equal installments starting the
+month after (see generate_schedule in rent/app.py). Instead of expanding
+those schedules row by row, each contract is turned into a +rata/-rata pair
+on a month axis; a cumulative sum then yields the installment total per
+month for the whole portfolio (and per client / equipment group with a 2D
+array). The cost is O(contracts + months), independent of contract length.
+
+Results are cached per process and keyed by the contracts revision counter
+that rent/app.py bumps on every contract write.
+"""
+import threading
+from datetime import date
+
+# numpy is imported by the functions that use it, so importing rent.app stays cheap
+
+_cache = {}
+_cache_lock = threading.Lock()
+_CACHE_MAX_ENTRIES = 32
+
+
+def month_index(d):
+    return d.year * 12 + d.month - 1
+
+
+def month_label(idx):
+    return f"{idx // 12:04d}-{idx % 12 + 1:02d}"
+
+
+def parse_month(value):
+    """'YYYY-MM' / 'YYYY-MM-DD' -> month index, or None."""
+    try:
+        y, m = str(value)[:7].split("-")
+        return int(y) * 12 + int(m) - 1
+    except (ValueError, TypeError):
+        return None
+
+
+def load_contracts(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT id, contract_date, client_name, equipment_model, period_months,
+               rata_neto, rata_bruto, ucesce_bruto, admin_bruto
+        FROM rent_contracts;
+    """)
+    return cur.fetchall()
+
+
+def _contract_arrays(rows):
+    import numpy as np
+    start, period, rata_neto, rata_bruto, upfront, clients, equipment = [], [], [], [], [], [], []
+    for r in rows:
+        m = parse_month(r["contract_date"])
+        if m is None:
+            continue
+        start.append(m)
+        period.append(max(int(r["period_months"] or 0), 0))
+        rata_neto.append(r["rata_neto"] or 0.0)
+        rata_bruto.append(r["rata_bruto"] or 0.0)
+        upfront.append((r["ucesce_bruto"] or 0.0) + (r["admin_bruto"] or 0.0))
+        clients.append((r["client_name"] or "").strip() or "—")
+        equipment.append((r["equipment_model"] or "").strip() or "—")
+    return {
+        "start": np.asarray(start, dtype=np.int64),
+        "period": np.asarray(period, dtype=np.int64),
+        "rata_neto": np.asarray(rata_neto, dtype=np.float64),
+        "rata_bruto": np.asarray(rata_bruto, dtype=np.float64),
+        "upfront": np.asarray(upfront, dtype=np.float64),
+        "clients": np.asarray(clients, dtype=object),
+        "equipment": np.asarray(equipment, dtype=object),
+    }
+
+
+def _installment_series(first, last, values, horizon_start, months, groups=None, n_groups=1):
+    """
+    Sum `values` over every month in [first, last] (inclusive, month indexes),
+    clipped to the horizon. Returns shape (n_groups, months).
+    """
+    import numpy as np
+    lo = np.clip(first - horizon_start, 0, months)
+    hi = np.clip(last - horizon_start + 1, 0, months)
+    active = hi > lo
+    if groups is None:
+        groups = np.zeros(len(values), dtype=np.int64)
+    delta = np.zeros((n_groups, months + 1), dtype=np.float64)
+    np.add.at(delta, (groups[active], lo[active]), values[active])
+    np.add.at(delta, (groups[active], hi[active]), -values[active])
+    return np.cumsum(delta, axis=1)[:, :months]
+
+
+def _point_series(at, values, horizon_start, months):
+    import numpy as np
+    idx = at - horizon_start
+    inside = (idx >= 0) & (idx < months)
+    out = np.zeros(months, dtype=np.float64)
+    np.add.at(out, idx[inside], values[inside])
+    return out
+
+
+def _grouped(keys, arr, horizon_start, months, top):
+    import numpy as np
+    names, inverse = np.unique(keys, return_inverse=True)
+    first = arr["start"] + 1
+    last = arr["start"] + arr["period"]
+    series = _installment_series(first, last, arr["rata_bruto"], horizon_start, months,
+                                 groups=inverse.astype(np.int64), n_groups=len(names))
+    totals = series.sum(axis=1)
+    order = np.argsort(-totals, kind="stable")
+    result = []
+    for i in order[:top] if top else order:
+        if totals[i] <= 0:
+            break
+        result.append({
+            "name": str(names[i]),
+            "total": round(float(totals[i]), 2),
+            "series": [round(float(v), 2) for v in series[i]],
+        })
+    return result
+
+
+def project_portfolio(rows, start_month=None, months=60, top=20):
+    """
+    Project receivables for `months` months starting at `start_month`
+    (month index, default: current month). Returns a JSON-serialisable dict.
+    """
+    import numpy as np
+    if start_month is None:
+        start_month = month_index(date.today())
+    months = max(1, int(months))
+    arr = _contract_arrays(rows)
+
+    first = arr["start"] + 1
+    last = arr["start"] + arr["period"]
+    ones = np.ones(len(first), dtype=np.float64)
+
+    stacked = np.vstack([arr["rata_neto"], arr["rata_bruto"], ones])
+    neto, bruto, active = (
+        _installment_series(first, last, stacked[k], start_month, months)[0] for k in range(3)
+    )
+    upfront = _point_series(arr["start"], arr["upfront"], start_month, months)
+
+    return {
+        "start": month_label(start_month),
+        "months": [month_label(start_month + i) for i in range(months)],
+        "installments_net": [round(float(v), 2) for v in neto],
+        "installments_gross": [round(float(v), 2) for v in bruto],
+        "upfront_gross": [round(float(v), 2) for v in upfront],
+        "active_contracts": [int(round(v)) for v in active],
+        "total_gross": round(float(bruto.sum() + upfront.sum()), 2),
+        "by_client": _grouped(arr["clients"], arr, start_month, months, top),
+        "by_equipment": _grouped(arr["equipment"], arr, start_month, months, top),
+    }
+
+
+def cached_projection(conn, revision, start_month=None, months=60, top=20):
+    if start_month is None:
+        start_month = month_index(date.today())
+    key = (revision, start_month, months, top)
+    with _cache_lock:
+        hit = _cache.get(key)
+    if hit is not None:
+        return hit
+    result = project_portfolio(load_contracts(conn), start_month, months, top)
+    with _cache_lock:
+        if len(_cache) >= _CACHE_MAX_ENTRIES:
+            _cache.clear()
+        _cache[key] = result
+    return result
+
+
+def invalidate_projection_cache():
+    with _cache_lock:
+        _cache.clear()
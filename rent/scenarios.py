@@ -0,0 +1,192 @@
+"""
+Scenario grid for the rent calculator.
+
+calculate_rent (rent/app.py) evaluates one parameter set. Here every input
+may be given as a list or range; the inputs are broadcast against each other
+with NumPy and the whole grid is evaluated in one pass with a vectorized PMT.
+"""
+import math
+
+# numpy is imported by the functions that use it, so importing rent.app stays cheap
+
+# calculate_rent inputs in argument order, with the defaults of /api/calculate
+RENT_INPUTS = [
+    ("price", 0.0),
+    ("period_months", 48),
+    ("downpayment_percent", 20.0),
+    ("salvage_value_percent", 20.0),
+    ("interest_rate", 14.0),
+    ("insurance_rate", 1.13),
+    ("guarantee_rate", 5.0),
+    ("vat_percent", 20.0),
+    ("admin_fee", 50.0),
+]
+
+INPUT_LABELS = {
+    "price": "Cena neto (€)",
+    "period_months": "Broj meseci",
+    "downpayment_percent": "Učešće (%)",
+    "salvage_value_percent": "Ostatak vrednosti (%)",
+    "interest_rate": "Kamata (%)",
+    "insurance_rate": "Osiguranje (%)",
+    "guarantee_rate": "Garancija (%)",
+    "vat_percent": "PDV (%)",
+    "admin_fee": "Adm. trošak (€)",
+}
+
+MAX_GRID_CELLS = 20000
+_MAX_AXIS_VALUES = 200
+
+
+def parse_axis(raw, default):
+    """
+    '24,36,48'   -> [24, 36, 48]
+    '10:30:5'    -> [10, 15, 20, 25, 30]   (from:to:step, inclusive)
+    '' / None    -> [default]
+    Raises ValueError on malformed input.
+    """
+    if raw is None or str(raw).strip() == "":
+        return [float(default)]
+    if isinstance(raw, (int, float)):
+        return [float(raw)]
+    if isinstance(raw, (list, tuple)):
+        if len(raw) > _MAX_AXIS_VALUES:
+            raise ValueError("Previše vrednosti u jednom parametru.")
+        try:
+            values = [float(v) for v in raw]
+        except TypeError:
+            raise ValueError(f"Neispravne vrednosti: {raw}")
+    else:
+        raw = str(raw).strip()
+        if ":" in raw:
+            parts = [float(p) for p in raw.split(":")]
+            if len(parts) != 3 or parts[2] <= 0 or parts[1] < parts[0]:
+                raise ValueError(f"Neispravan opseg: {raw}")
+            try:
+                count = int(round((parts[1] - parts[0]) / parts[2])) + 1
+            except OverflowError:
+                raise ValueError(f"Neispravan opseg: {raw}")
+            # Checked before the list is built: '0:30000000:1' must not allocate first
+            if count > _MAX_AXIS_VALUES:
+                raise ValueError("Previše vrednosti u jednom parametru.")
+            values = [parts[0] + i * parts[2] for i in range(count)]
+        else:
+            values = [float(p) for p in raw.split(",") if p.strip()]
+    if not values:
+        return [float(default)]
+    if len(values) > _MAX_AXIS_VALUES:
+        raise ValueError("Previše vrednosti u jednom parametru.")
+    if not all(math.isfinite(v) for v in values):
+        raise ValueError("Vrednosti moraju biti konačni brojevi.")
+    return values
+
+
+def pmt_array(rate, nper, pv, fv=0.0):
+    """Vectorized Excel PMT (payment at period end); arguments broadcast."""
+    import numpy as np
+    rate, nper, pv, fv = np.broadcast_arrays(*(np.asarray(a, dtype=np.float64) for a in (rate, nper, pv, fv)))
+    zero = rate == 0
+    safe_rate = np.where(zero, 1.0, rate)
+    factor = (1 + safe_rate) ** nper
+    annuity = -(pv * factor + fv) / ((factor - 1) / safe_rate)
+    return np.where(zero, -(pv + fv) / nper, annuity)
+
+
+def calculate_rent_grid(price, period_months, downpayment_pct, salvage_pct,
+                        interest_rate, insurance_rate, guarantee_rate, vat_pct, admin_fee):
+    """Array version of calculate_rent; arguments broadcast against each other."""
+    import numpy as np
+    price = np.asarray(price, dtype=np.float64)
+    period_months = np.asarray(period_months, dtype=np.float64)
+
+    ucesce = price * downpayment_pct / 100.0
+    ucesce_pdv = ucesce * vat_pct / 100.0
+    ucesce_bruto = ucesce + ucesce_pdv
+
+    ostatak = price * salvage_pct / 100.0
+
+    monthly_rate = np.asarray(interest_rate, dtype=np.float64) / 100.0 / 12.0
+    rata_fin = pmt_array(monthly_rate, period_months, -(price - ucesce), ostatak)
+
+    osiguranje = insurance_rate / 100.0 * price / 12.0
+    garancija = price * guarantee_rate / 100.0 / period_months
+
+    rata_neto = rata_fin + osiguranje + garancija
+    rata_pdv = rata_neto * vat_pct / 100.0
+    rata_bruto = rata_neto + rata_pdv
+
+    zatvaranje = ucesce_bruto / period_months
+    rata_nakon = rata_bruto - zatvaranje
+
+    admin_fee = np.asarray(admin_fee, dtype=np.float64)
+    admin_pdv = admin_fee * vat_pct / 100.0
+    admin_bruto = admin_fee + admin_pdv
+
+    results = {
+        "ucesce": ucesce, "ucesce_pdv": ucesce_pdv, "ucesce_bruto": ucesce_bruto,
+        "ostatak": ostatak, "rata_fin": rata_fin, "osiguranje": osiguranje,
+        "garancija": garancija, "rata_neto": rata_neto, "rata_pdv": rata_pdv,
+        "rata_bruto": rata_bruto, "zatvaranje": zatvaranje, "rata_nakon": rata_nakon,
+        "admin_fee": admin_fee, "admin_pdv": admin_pdv, "admin_bruto": admin_bruto,
+    }
+    shape = np.broadcast_shapes(*(np.shape(v) for v in results.values()))
+    return {k: np.broadcast_to(v, shape) for k, v in results.items()}
+
+
+def scenario_grid(params):
+    """
+    Evaluate the grid described by `params` (mapping of input name -> raw value,
+    list or range). Inputs with more than one value become axes, in RENT_INPUTS order.
+    """
+    import numpy as np
+    values = {name: parse_axis(params.get(name), default) for name, default in RENT_INPUTS}
+    if min(values["period_months"]) <= 0:
+        raise ValueError("Broj meseci mora biti veći od nule.")
+    axes = [(name, values[name]) for name, _ in RENT_INPUTS if len(values[name]) > 1]
+
+    cells = 1
+    for _, v in axes:
+        cells *= len(v)
+    if cells > MAX_GRID_CELLS:
+        raise ValueError(f"Mreža je prevelika ({cells} kombinacija, najviše {MAX_GRID_CELLS}).")
+
+    # Each axis gets its own dimension; scalars broadcast everywhere
+    ndim = len(axes)
+    axis_pos = {name: i for i, (name, _) in enumerate(axes)}
+    args = []
+    for name, _ in RENT_INPUTS:
+        arr = np.asarray(values[name], dtype=np.float64)
+        if name in axis_pos:
+            shape = [1] * ndim
+            shape[axis_pos[name]] = len(arr)
+            arr = arr.reshape(shape)
+        else:
+            arr = arr[0]
+        args.append(arr)
+
+    results = calculate_rent_grid(*args)
+    return {
+        "base": {name: values[name][0] for name, _ in RENT_INPUTS if name not in axis_pos},
+        "axes": [{"name": name, "label": INPUT_LABELS[name], "values": v} for name, v in axes],
+        "shape": [len(v) for _, v in axes],
+        "results": {k: np.round(v, 4).tolist() for k, v in results.items()},
+    }
+
+
+def grid_table(grid, field="rata_bruto"):
+    """
+    Flatten a grid into printable rows: the last axis becomes the columns,
+    every combination of the remaining axes becomes one row.
+    """
+    import numpy as np
+    axes = grid["axes"]
+    data = np.asarray(grid["results"][field], dtype=np.float64)
+    if not axes:
+        return None, [{"labels": [], "cells": [float(data)]}]
+    col_axis = axes[-1]
+    row_axes = axes[:-1]
+    rows = []
+    for idx in np.ndindex(*[len(a["values"]) for a in row_axes]):
+        labels = [(a["label"], a["values"][i]) for a, i in zip(row_axes, idx)]
+        rows.append({"labels": labels, "cells": [float(v) for v in data[idx]]})
+    return col_axis, rows
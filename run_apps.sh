@@ -101,12 +101,22 @@ venv/bin/pip install Werkzeug
 #############################################
 
 echo "Stopping any old instances (if running)..."
-pkill -f "main.py" || true
+PIDFILE="app_data/gunicorn.pid"
+if [ -f "$PIDFILE" ] && kill -0 "$(cat "$PIDFILE")" 2>/dev/null; then
+  # TERM = graceful shutdown: in-flight requests are allowed to finish
+  kill -TERM "$(cat "$PIDFILE")" || true
+  for _ in $(seq 1 35); do
+    kill -0 "$(cat "$PIDFILE" 2>/dev/null)" 2>/dev/null || break
+    sleep 1
+  done
+fi
+pkill -f "main.py" || true  # old single-process dev server
 sleep 2  # Allow port 5000 to be fully released
 
 echo "Starting merged app on port 5000..."
-# We use nohup to keep it running after shell closes
-nohup venv/bin/python main.py > main.log 2>&1 &
+# Pre-forked workers (see gunicorn.conf.py); nohup keeps it running after shell closes
+# For development with auto-reload and debugger use: venv/bin/python main.py
+nohup venv/bin/gunicorn -c gunicorn.conf.py main:application > main.log 2>&1 &
 
 echo "All done. App should now be up:"
 echo "  - QP-CRM : http://localhost:5000/"
@@ -1,9 +1,6 @@
 import os
 import sys
-import sqlite3
-import math
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, session, abort
-import markdown
+from flask import Flask, render_template, request, redirect, url_for, send_from_directory, session, abort, jsonify, make_response
 
 # Ensure shared modules can be imported
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -11,8 +8,11 @@ PARENT_DIR = os.path.dirname(CURRENT_DIR)
 if PARENT_DIR not in sys.path:
     sys.path.append(PARENT_DIR)
 
-from shared.config import STATIC_DIR, DATABASE, IMAGE_DIR
+from shared.config import STATIC_DIR, IMAGE_DIR
 from shared.utils import format_amount
+from shared.markdown_render import render_markdown
+from sale.snapshot import get_snapshot
+from sale.sync import manifest, changes_since, full_catalog
 
 app = Flask(
     __name__,
@@ -23,11 +23,6 @@ app = Flask(
 app.secret_key = "sale_readonly_secret_change_me"
 app.config['SESSION_COOKIE_NAME'] = 'sale_readonly_session'
 
-def get_db():
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def get_theme():
     """Fetch the theme setting from cookies."""
     from flask import request
@@ -40,6 +35,23 @@ def inject_helpers():
         theme=get_theme()
     )
 
+def conditional_response(snap, etag, render):
+    """
+    Serve render() with ETag / Last-Modified from the catalog snapshot, or an
+    empty 304 when the client already has this version. Pages depend on the
+    session and theme cookie, so only the ETag decides and caches are private.
+    """
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.last_modified = snap.last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
 @app.route("/product-image/<path:filename>")
 def product_image(filename):
     return send_from_directory(IMAGE_DIR, filename)
@@ -84,139 +96,112 @@ def list_sale():
 
     page = request.args.get("page", 1, type=int)
 
-    conn = get_db()
-    cur = conn.cursor()
-
-    # Fetch default items per page
-    cur.execute("SELECT value FROM global_settings WHERE key = 'default_items_per_page';")
-    row = cur.fetchone()
-    items_per_page = int(row["value"]) if row else 25
-    offset = (page - 1) * items_per_page
-
-    # Base query: count total
-    count_query = "SELECT COUNT(*) AS total_count FROM products p"
-
-    # Base query: products + latest price
-    query = """
-        SELECT p.*,
-               pr.final_price AS current_price,
-               pr.discount_price AS current_discount_price
-        FROM products p
-        LEFT JOIN prices pr
-          ON pr.id = (
-              SELECT MAX(id) FROM prices WHERE product_id = p.id
-          )
-    """
-    params = []
-
-    where_clauses = []
-    if brand_filter:
-        where_clauses.append("p.brand = ?")
-        params.append(brand_filter)
-    if category_filter:
-        where_clauses.append("p.category = ?")
-        params.append(category_filter)
-    if search_term:
-        where_clauses.append("p.name LIKE ?")
-        params.append(f"%{search_term}%")
-
-    if where_clauses:
-        where_stmt = " WHERE " + " AND ".join(where_clauses)
-        count_query += where_stmt
-        query += where_stmt
-
-    # Execute count before applying sort/limit
-    cur.execute(count_query, params)
-    total_count = cur.fetchone()["total_count"]
-
-    total_pages = math.ceil(total_count / items_per_page) if total_count > 0 else 1
-
-    # Sorting Logic
-    if sort_option == "name_asc":
-        query += " ORDER BY p.name ASC"
-    elif sort_option == "name_desc":
-        query += " ORDER BY p.name DESC"
-    elif sort_option == "price_asc":
-        query += " ORDER BY COALESCE(pr.final_price, 0) ASC"
-    elif sort_option == "price_desc":
-        query += " ORDER BY COALESCE(pr.final_price, 0) DESC"
-    else:
-        # Fallback
-        query += " ORDER BY p.name ASC"
-
-    query += f" LIMIT {items_per_page} OFFSET {offset};"
-
-    cur.execute(query, params)
-    products = cur.fetchall()
-
-    # Distinct brands for dropdown
-    cur.execute("""
-        SELECT DISTINCT brand
-        FROM products
-        WHERE brand IS NOT NULL AND brand != ''
-        ORDER BY brand;
-    """)
-    brand_rows = cur.fetchall()
-    brand_options = [row["brand"] for row in brand_rows]
-
-    # Categories for dropdown (from category defaults)
-    cur.execute("""
-        SELECT category
-        FROM category_pricing_defaults
-        ORDER BY category;
-    """)
-    cat_rows = cur.fetchall()
-    category_options = [row["category"] for row in cat_rows]
-
-    conn.close()
-
-    return render_template(
-        "sale.html",
-        products=products,
-        brand_filter=brand_filter,
-        category_filter=category_filter,
-        brand_options=brand_options,
-        category_options=category_options,
-        search_term=search_term,
-        sort_option=sort_option,
-        current_page=page,
-        total_pages=total_pages,
-        total_count=total_count
+    snap = get_snapshot()
+    key = (brand_filter, category_filter, search_term, sort_option, page)
+    theme = get_theme()
+
+    def render():
+        result = snap.page(*key)
+        rows_html = snap.cached(("rows",) + key,
+                                lambda: render_template("sale_rows.html", products=result["products"]))
+        return render_template(
+            "sale.html",
+            rows_html=rows_html,
+            brand_filter=brand_filter,
+            category_filter=category_filter,
+            brand_options=snap.brand_options,
+            category_options=snap.category_options,
+            search_term=search_term,
+            sort_option=sort_option,
+            current_page=page,
+            total_pages=result["total_pages"],
+            total_count=result["total_count"]
+        )
+
+    return conditional_response(snap, snap.etag("list", theme, *key), render)
+
+
+@app.route("/api/pricelist")
+def api_pricelist():
+    """JSON of one price list page; same filters as /pricelist but never touches the session."""
+    snap = get_snapshot()
+    key = (
+        request.args.get("brand", ""),
+        request.args.get("category", ""),
+        request.args.get("search", ""),
+        request.args.get("sort", "name_asc"),
+        request.args.get("page", 1, type=int),
     )
 
+    def render():
+        result = snap.page(*key)
+        return jsonify({
+            "version": snap.version,
+            "items_per_page": snap.items_per_page,
+            "total_count": result["total_count"],
+            "total_pages": result["total_pages"],
+            "page": result["page"],
+            "products": [
+                {k: p[k] for k in ("id", "name", "category", "brand", "photo_path",
+                                   "current_price", "current_discount_price")}
+                for p in result["products"]
+            ],
+        })
+
+    return conditional_response(snap, snap.etag("json", *key), render)
+
+# Offline price list: service worker + IndexedDB client (sale_offline.html)
+@app.route("/pricelist/offline")
+def offline_pricelist():
+    return render_template("sale_offline.html")
+
+
+@app.route("/sw.js")
+def service_worker():
+    response = make_response(render_template("sale_sw.js"))
+    response.mimetype = "application/javascript"
+    response.cache_control.no_cache = True
+    return response
+
+
+@app.route("/api/catalog/manifest")
+def api_catalog_manifest():
+    snap = get_snapshot()
+    data = manifest(snap)
+    return conditional_response(snap, snap.etag("manifest", data["version"]), lambda: jsonify(data))
+
+
+@app.route("/api/catalog/changes")
+def api_catalog_changes():
+    """?since=N -> products changed after version N; no/invalid N returns the full catalog."""
+    since = request.args.get("since", type=int)
+    response = jsonify(full_catalog() if since is None else changes_since(since))
+    response.cache_control.no_store = True
+    return response
+
+
 @app.route("/product/<int:product_id>")
 def view_product(product_id):
-    conn = get_db()
-    cur = conn.cursor()
-
-    query = """
-        SELECT p.*,
-               pr.final_price AS current_price,
-               pr.discount_price AS current_discount_price
-        FROM products p
-        LEFT JOIN prices pr
-          ON pr.id = (
-              SELECT MAX(id) FROM prices WHERE product_id = p.id
-          )
-        WHERE p.id = ?
-    """
-    cur.execute(query, (product_id,))
-    product = cur.fetchone()
-    conn.close()
-
+    snap = get_snapshot()
+    product = snap.by_id.get(product_id)
     if not product:
         abort(404)
 
-    # Convert markdown description to HTML safely
-    description_html = ""
-    if product["description"]:
-        description_html = markdown.markdown(product["description"])
-
-    return render_template(
-        "view_product.html",
-        product=product,
-        description_html=description_html
-    )
+    def render():
+        # Use the HTML pre-rendered on save; older rows fall back to the cached renderer
+        description_html = ""
+        if product.get("description_html"):
+            description_html = product["description_html"]
+        elif product["description"]:
+            description_html = render_markdown(product["description"])
+
+        return render_template(
+            "view_product.html",
+            product=product,
+            description_html=description_html
+        )
+
+    return conditional_response(snap, snap.etag("product", get_theme(), product_id), render)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001, debug=True)
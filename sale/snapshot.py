@@ -0,0 +1,201 @@
+"""
+In-memory snapshot of the public price list for the Sale app.
+
+The whole catalog (products with their latest price, brand and category
+options) is loaded once over a read-only connection and then filtered,
+sorted and paged in Python. Pages and rendered HTML fragments are cached per
+snapshot, so repeated views cost no database work at all.
+
+Freshness: pricing/app.py installs triggers that bump global_settings
+'catalog_revision' whenever products, prices or category defaults change.
+At most every CHECK_SECONDS a request reads that one row; when it moved, a
+new snapshot is built in a background thread while the old one keeps being
+served.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from shared.db import get_readonly_db
+
+CHECK_SECONDS = 5
+DEFAULT_ITEMS_PER_PAGE = 25
+_CACHE_MAX_ENTRIES = 512
+
+SORT_OPTIONS = ("name_asc", "name_desc", "price_asc", "price_desc")
+
+_snapshot = None
+_lock = threading.Lock()
+_rebuilding = False
+_last_check = 0.0
+
+
+class Snapshot:
+    def __init__(self, version, last_modified, products, brand_options, category_options, items_per_page):
+        self.version = version
+        self.last_modified = last_modified
+        self.products = products
+        self.by_id = {p["id"]: p for p in products}
+        self.brand_options = brand_options
+        self.category_options = category_options
+        self.items_per_page = items_per_page
+        self._search_keys = [(p["name"] or "").casefold() for p in products]
+        self._orders = {}
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def etag(self, *parts):
+        raw = "|".join(str(p) for p in (self.version,) + parts)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:20]
+
+    def _order(self, sort_option):
+        """Product indexes in the requested order (same keys as the old SQL ORDER BY)."""
+        order = self._orders.get(sort_option)
+        if order is None:
+            idx = range(len(self.products))
+            if sort_option == "name_desc":
+                order = sorted(idx, key=lambda i: self.products[i]["name"], reverse=True)
+            elif sort_option == "price_asc":
+                order = sorted(idx, key=lambda i: self.products[i]["current_price"] or 0)
+            elif sort_option == "price_desc":
+                order = sorted(idx, key=lambda i: self.products[i]["current_price"] or 0, reverse=True)
+            else:
+                order = sorted(idx, key=lambda i: self.products[i]["name"])
+            self._orders[sort_option] = order
+        return order
+
+    def cached(self, key, build):
+        """Memoize build() under key for the lifetime of this snapshot (small LRU)."""
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        value = build()
+        with self._cache_lock:
+            self._cache[key] = value
+            while len(self._cache) > _CACHE_MAX_ENTRIES:
+                self._cache.popitem(last=False)
+        return value
+
+    def page(self, brand="", category="", search="", sort_option="name_asc", page=1):
+        """One page of the filtered list: dict(products, total_count, total_pages, page)."""
+        if sort_option not in SORT_OPTIONS:
+            sort_option = "name_asc"
+        key = ("page", brand, category, search, sort_option, page)
+        return self.cached(key, lambda: self._page(brand, category, search, sort_option, page))
+
+    def _page(self, brand, category, search, sort_option, page):
+        needle = search.casefold() if search else ""
+        matches = [
+            i for i in self._order(sort_option)
+            if (not brand or self.products[i]["brand"] == brand)
+            and (not category or self.products[i]["category"] == category)
+            and (not needle or needle in self._search_keys[i])
+        ]
+        total_count = len(matches)
+        per_page = self.items_per_page
+        start = (page - 1) * per_page
+        return {
+            "products": [self.products[i] for i in matches[start:start + per_page]] if start >= 0 else [],
+            "total_count": total_count,
+            "total_pages": math.ceil(total_count / per_page) if total_count > 0 else 1,
+            "page": page,
+        }
+
+
+def _read_version(cur):
+    cur.execute("""
+        SELECT key, value FROM global_settings
+        WHERE key IN ('catalog_revision', 'catalog_updated_at', 'default_items_per_page');
+    """)
+    settings = {row["key"]: row["value"] for row in cur.fetchall()}
+    try:
+        items_per_page = int(settings.get("default_items_per_page") or DEFAULT_ITEMS_PER_PAGE)
+    except ValueError:
+        items_per_page = DEFAULT_ITEMS_PER_PAGE
+    version = f"{settings.get('catalog_revision', '0')}-{items_per_page}"
+    return version, settings.get("catalog_updated_at"), max(1, items_per_page)
+
+
+def _parse_updated_at(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def build_snapshot():
+    conn = get_readonly_db()
+    cur = conn.cursor()
+    # One read transaction, so the version matches the rows it describes
+    cur.execute("BEGIN;")
+    version, updated_at, items_per_page = _read_version(cur)
+    cur.execute("""
+        SELECT p.*,
+               pr.final_price AS current_price,
+               pr.discount_price AS current_discount_price
+        FROM products p
+        LEFT JOIN prices pr
+          ON pr.id = (
+              SELECT MAX(id) FROM prices WHERE product_id = p.id
+          );
+    """)
+    products = [dict(row) for row in cur.fetchall()]
+    cur.execute("""
+        SELECT DISTINCT brand
+        FROM products
+        WHERE brand IS NOT NULL AND brand != ''
+        ORDER BY brand;
+    """)
+    brand_options = [row["brand"] for row in cur.fetchall()]
+    cur.execute("SELECT category FROM category_pricing_defaults ORDER BY category;")
+    category_options = [row["category"] for row in cur.fetchall()]
+    conn.rollback()
+    conn.close()
+    return Snapshot(version, _parse_updated_at(updated_at), products,
+                    brand_options, category_options, items_per_page)
+
+
+def _rebuild():
+    global _snapshot, _rebuilding
+    try:
+        snap = build_snapshot()
+        with _lock:
+            _snapshot = snap
+    finally:
+        with _lock:
+            _rebuilding = False
+
+
+def get_snapshot():
+    """
+    Current snapshot. The first call builds it synchronously; later calls
+    check the catalog revision at most every CHECK_SECONDS and rebuild in
+    the background when it changed.
+    """
+    global _snapshot, _rebuilding, _last_check
+    with _lock:
+        snap = _snapshot
+        due = time.monotonic() - _last_check >= CHECK_SECONDS
+        if due:
+            _last_check = time.monotonic()
+    if snap is None:
+        snap = build_snapshot()
+        with _lock:
+            _snapshot = snap
+        return snap
+    if due:
+        conn = get_readonly_db()
+        version = _read_version(conn.cursor())[0]
+        conn.close()
+        with _lock:
+            start = version != snap.version and not _rebuilding
+            if start:
+                _rebuilding = True
+        if start:
+            threading.Thread(target=_rebuild, name="sale-snapshot", daemon=True).start()
+    return snap
+
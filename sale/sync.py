@@ -0,0 +1,93 @@
+"""
+Incremental catalog sync for the offline Sale client.
+
+pricing/app.py logs the id of every product whose row or price changed in
+catalog_changes; the newest log id is the catalog version. A client keeps
+its copy in IndexedDB and asks for the products changed since the version
+it holds, so a refresh transfers only those rows. Clients older than the
+oldest retained log entry (or newer than the server, e.g. after a restore)
+are told to download the full catalog again.
+"""
+from shared.db import get_readonly_db
+
+# Fields the client stores per product
+PRODUCT_FIELDS = ("id", "name", "brand", "category", "photo_path", "current_price", "current_discount_price")
+
+_PRODUCT_SELECT = """
+    SELECT p.id, p.name, p.brand, p.category, p.photo_path,
+           pr.final_price AS current_price,
+           pr.discount_price AS current_discount_price
+    FROM products p
+    LEFT JOIN prices pr
+      ON pr.id = (
+          SELECT MAX(id) FROM prices WHERE product_id = p.id
+      )
+"""
+
+
+def _versions(cur):
+    """(current version, oldest version a delta can start from)."""
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'catalog_changes';")
+    row = cur.fetchone()
+    version = row["seq"] if row else 0
+    cur.execute("SELECT MIN(id) AS min_id FROM catalog_changes;")
+    min_id = cur.fetchone()["min_id"]
+    return version, (min_id - 1 if min_id is not None else version)
+
+
+def _product_rows(rows):
+    return [[row[f] for f in PRODUCT_FIELDS] for row in rows]
+
+
+def manifest(snap):
+    """Catalog version plus the small lookup lists, taken from the Sale snapshot."""
+    conn = get_readonly_db()
+    version, min_version = _versions(conn.cursor())
+    conn.close()
+    return {
+        "version": version,
+        "min_version": min_version,
+        "fields": list(PRODUCT_FIELDS),
+        "items_per_page": snap.items_per_page,
+        "brands": snap.brand_options,
+        "categories": snap.category_options,
+    }
+
+
+def full_catalog():
+    """Every product, as rows in PRODUCT_FIELDS order, with the version they belong to."""
+    conn = get_readonly_db()
+    cur = conn.cursor()
+    cur.execute("BEGIN;")
+    version, _ = _versions(cur)
+    cur.execute(_PRODUCT_SELECT + ";")
+    products = _product_rows(cur.fetchall())
+    conn.rollback()
+    conn.close()
+    return {"version": version, "reset": True, "upserts": products, "deletes": []}
+
+
+def changes_since(since):
+    """Products changed after version `since`; falls back to the full catalog when the log cannot cover it."""
+    conn = get_readonly_db()
+    cur = conn.cursor()
+    cur.execute("BEGIN;")
+    version, min_version = _versions(cur)
+    if since < min_version or since > version:
+        conn.rollback()
+        conn.close()
+        return full_catalog()
+    cur.execute(_PRODUCT_SELECT + """
+        WHERE p.id IN (SELECT product_id FROM catalog_changes WHERE id > ?);
+    """, (since,))
+    upserts = _product_rows(cur.fetchall())
+    cur.execute("""
+        SELECT DISTINCT c.product_id
+        FROM catalog_changes c
+        WHERE c.id > ?
+          AND NOT EXISTS (SELECT 1 FROM products p WHERE p.id = c.product_id);
+    """, (since,))
+    deletes = [row["product_id"] for row in cur.fetchall()]
+    conn.rollback()
+    conn.close()
+    return {"version": version, "reset": False, "upserts": upserts, "deletes": deletes}
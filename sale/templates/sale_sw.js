@@ -0,0 +1,62 @@
+// Service worker for the Sale price list (served from {{ url_for('service_worker') }}).
+// The offline page shell and static assets are cached on install; product
+// images are cached as they are viewed. Catalog data itself lives in
+// IndexedDB (see sale_offline.html), so API calls always go to the network.
+const CACHE = "sale-shell-v1";
+const SHELL = [
+    "{{ url_for('offline_pricelist') }}",
+    "{{ url_for('static', filename='css/main.css') }}",
+    "{{ url_for('static', filename='img/logo_company.jpg') }}",
+];
+const OFFLINE_PAGE = "{{ url_for('offline_pricelist') }}";
+const API_PREFIX = "{{ url_for('api_catalog_manifest').rsplit('/', 1)[0] }}/";
+const IMAGE_PREFIX = "{{ url_for('product_image', filename='_')[:-1] }}";
+
+self.addEventListener("install", event => {
+    event.waitUntil(caches.open(CACHE).then(cache => cache.addAll(SHELL)).then(() => self.skipWaiting()));
+});
+
+self.addEventListener("activate", event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys.filter(k => k !== CACHE).map(k => caches.delete(k))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener("fetch", event => {
+    const req = event.request;
+    const url = new URL(req.url);
+    if (req.method !== "GET" || url.origin !== self.location.origin || url.pathname.startsWith(API_PREFIX)) {
+        return;
+    }
+
+    // Pages: network first, cached copy (or the offline price list) when offline
+    if (req.mode === "navigate") {
+        event.respondWith(
+            fetch(req)
+                .then(resp => {
+                    if (resp.ok) {
+                        const copy = resp.clone();
+                        caches.open(CACHE).then(cache => cache.put(req, copy));
+                    }
+                    return resp;
+                })
+                .catch(() => caches.match(req).then(hit => hit || caches.match(OFFLINE_PAGE)))
+        );
+        return;
+    }
+
+    // Images and static files: cache first, filled on first use
+    if (url.pathname.startsWith(IMAGE_PREFIX) || SHELL.includes(url.pathname)) {
+        event.respondWith(
+            caches.match(req).then(hit => hit || fetch(req).then(resp => {
+                if (resp.ok) {
+                    const copy = resp.clone();
+                    caches.open(CACHE).then(cache => cache.put(req, copy));
+                }
+                return resp;
+            }))
+        );
+    }
+});
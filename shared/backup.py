@@ -0,0 +1,320 @@
+# shared/backup.py
+"""
+Backups of the live data without taking the apps offline.
+
+snapshot_database() copies pricing.db with SQLite's online backup API
+(sqlite3.Connection.backup), BACKUP_STEP_PAGES pages per step. The copy is
+a consistent snapshot that includes transactions still sitting in the WAL,
+and the source is only read-locked for one step at a time, so requests keep
+writing meanwhile (a write between two steps makes SQLite restart the copy
+from the new state). The snapshot is switched to journal_mode=DELETE so it
+is a single self-contained file.
+
+stream_zip() produces a ZIP archive chunk by chunk, so a full backup is sent
+while it is being built, in constant memory however big the image store is.
+Files that are already compressed (JPEG, PNG, PDF, ...) are STORED rather
+than deflated a second time. Caches (pdf_cache, docx_cache, ...) are not
+part of a backup; they are rebuilt on demand.
+
+Restores (restore_database(), restore_archive()) stream the upload into
+a .restore-<token> staging directory next to each target, so memory use is
+constant and the final renames never cross filesystems. The database is
+checked (integrity_check, QP-CRM tables, a schema version this code can
+migrate) before anything live is touched. A COMMITTED marker is then
+written, the live database gets the new content in one transaction through
+the backup API (open connections keep working and simply see the new data
+afterwards, unlike a file replaced under a WAL database), and the image and
+asset directories are swapped in by rename. If the process dies half-way,
+recover_interrupted_restores() at the next start finishes a committed
+restore and throws away one that was not committed.
+"""
+import os
+import secrets
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+
+from shared.config import APP_ASSETS_DIR, APP_DATA_DIR, DATABASE, IMAGE_DIR
+
+BACKUP_STEP_PAGES = 1024
+CHUNK_SIZE = 1024 * 1024
+
+# deflating these again costs CPU and saves next to nothing
+STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".pdf",
+    ".zip", ".gz", ".docx", ".xlsx", ".odt", ".woff", ".woff2",
+}
+
+
+def snapshot_database(dest_path, source=DATABASE):
+    """Copy the live database at source to dest_path with the online backup API."""
+    src = sqlite3.connect(source, timeout=20.0)
+    dst = sqlite3.connect(dest_path)
+    try:
+        src.backup(dst, pages=BACKUP_STEP_PAGES)
+        dst.execute("PRAGMA journal_mode = DELETE;")
+    finally:
+        dst.close()
+        src.close()
+    return dest_path
+
+
+def temporary_snapshot():
+    """Snapshot of the live database in a new file next to it; remove it with discard()."""
+    fd, path = tempfile.mkstemp(prefix=".snapshot-", suffix=".db", dir=APP_DATA_DIR)
+    os.close(fd)
+    try:
+        return snapshot_database(path)
+    except Exception:
+        discard(path)
+        raise
+
+
+def remove_stale_snapshots():
+    """Delete snapshots left behind by a worker that died mid-download (call at startup only)."""
+    if not os.path.isdir(APP_DATA_DIR):
+        return
+    for name in os.listdir(APP_DATA_DIR):
+        if name.startswith(".snapshot-") and name.endswith(".db"):
+            discard(os.path.join(APP_DATA_DIR, name))
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def full_backup_members(db_snapshot):
+    """(name in the archive, path) of a full backup: the database, product images, app assets."""
+    yield "pricing.db", db_snapshot
+    yield from data_files()
+
+
+def data_files():
+    """(name in a backup, path) of every product image and app asset."""
+    for base in (IMAGE_DIR, APP_ASSETS_DIR):
+        if not os.path.isdir(base):
+            continue
+        parent = os.path.dirname(base)
+        for root, dirs, files in os.walk(base):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                # 'product_images/foo.jpg', 'app_assets/logo.jpg'
+                yield os.path.relpath(path, parent).replace(os.sep, "/"), path
+
+
+class _ChunkSink:
+    """Write-only, unseekable file object for ZipFile; drain() hands out what was written."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def stream_zip(members):
+    """Yield a ZIP archive of members ((arcname, path) pairs) as byte chunks."""
+    sink = _ChunkSink()
+    # Unseekable output: ZipFile writes sizes and CRCs in data descriptors after each file
+    with zipfile.ZipFile(sink, "w", strict_timestamps=False) as zf:
+        for arcname, path in members:
+            info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+            if os.path.splitext(arcname)[1].lower() in STORED_EXTENSIONS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, "rb") as src, zf.open(info, "w") as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield from sink.drain()
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+# ─── Restore ───────────────────────────────────────────────────────────────────
+
+# top-level directory in a backup -> live directory it replaces
+_RESTORE_TARGETS = {"product_images": IMAGE_DIR, "app_assets": APP_ASSETS_DIR}
+_RESTORE_PREFIX = ".restore-"
+_COMMITTED = "COMMITTED"
+
+
+def check_database(path, latest_version=None):
+    """Schema version of the database file at path; ValueError unless it is an intact QP-CRM database
+    no newer than latest_version."""
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            problems = [row[0] for row in conn.execute("PRAGMA integrity_check;").fetchall()]
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table';")}
+            version = conn.execute("PRAGMA user_version;").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"Not a usable SQLite database: {e}")
+    if problems != ["ok"]:
+        raise ValueError("Database failed the integrity check: " + "; ".join(problems[:3]))
+    if not {"products", "global_settings"} <= tables:
+        raise ValueError("Not a QP-CRM database (products/global_settings tables missing).")
+    if latest_version is not None and version > latest_version:
+        raise ValueError(f"The backup's schema version ({version}) is newer than this installation's "
+                         f"({latest_version}); update the application first.")
+    return version
+
+
+def swap_database(staged_path, live_path=DATABASE):
+    """Give the live database the content of staged_path in one write transaction (backup API)."""
+    src = sqlite3.connect(staged_path)
+    dst = sqlite3.connect(live_path, timeout=60.0)
+    try:
+        page_size = dst.execute("PRAGMA page_size;").fetchone()[0]
+        if src.execute("PRAGMA page_size;").fetchone()[0] != page_size:
+            # A WAL database only accepts a backup with its own page size
+            src.execute("PRAGMA journal_mode = DELETE;")
+            src.execute(f"PRAGMA page_size = {int(page_size)};")
+            src.execute("VACUUM;")
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _stage_dirs(token):
+    """{parent directory: staging directory} for every place a restore writes to."""
+    parents = {os.path.dirname(DATABASE)} | {os.path.dirname(live) for live in _RESTORE_TARGETS.values()}
+    return {parent: os.path.join(parent, _RESTORE_PREFIX + token) for parent in parents}
+
+
+def _staged_path(name, stages):
+    """Where archive member name is extracted to (None for members that are not restored)."""
+    if name == "pricing.db":
+        return os.path.join(stages[os.path.dirname(DATABASE)], "pricing.db")
+    top, _, rel = name.partition("/")
+    if top not in _RESTORE_TARGETS or not rel or rel.endswith("/") or "\\" in rel:
+        return None
+    parts = rel.split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        return None  # path traversal
+    return os.path.join(stages[os.path.dirname(_RESTORE_TARGETS[top])], top, *parts)
+
+
+def _commit(token):
+    # Everything staged must be on disk before the marker says it may be swapped in
+    os.sync()
+    marker = os.path.join(_stage_dirs(token)[os.path.dirname(DATABASE)], _COMMITTED)
+    with open(marker, "w") as f:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _discard_stages(token):
+    for stage in _stage_dirs(token).values():
+        shutil.rmtree(stage, ignore_errors=True)
+
+
+def _finish_restore(token):
+    """Swap a committed restore in: database first, then directories. Safe to run again after a crash."""
+    stages = _stage_dirs(token)
+    primary = stages[os.path.dirname(DATABASE)]
+    staged_db = os.path.join(primary, "pricing.db")
+    if os.path.exists(staged_db):
+        swap_database(staged_db)
+        os.remove(staged_db)
+    for top, live in _RESTORE_TARGETS.items():
+        stage = stages[os.path.dirname(live)]
+        staged = os.path.join(stage, top)
+        if not os.path.isdir(staged):
+            continue  # not in the backup, or already swapped
+        if os.path.exists(live):
+            os.rename(live, os.path.join(stage, f"previous-{top}"))
+        os.rename(staged, live)
+    # The marker goes last: until then a restart finishes this restore
+    for stage in sorted(stages.values(), key=lambda path: path == primary):
+        shutil.rmtree(stage, ignore_errors=True)
+
+
+def restore_database(fileobj, latest_version=None):
+    """Restore pricing.db from a database file object; returns the restored schema version."""
+    token = secrets.token_hex(6)
+    primary = _stage_dirs(token)[os.path.dirname(DATABASE)]
+    try:
+        os.makedirs(primary)
+        staged_db = os.path.join(primary, "pricing.db")
+        with open(staged_db, "wb") as out:
+            shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+        version = check_database(staged_db, latest_version)
+        _commit(token)
+    except Exception:
+        _discard_stages(token)
+        raise
+    _finish_restore(token)
+    return version
+
+
+def restore_archive(fileobj, latest_version=None):
+    """Restore a full backup ZIP (seekable file object); returns the restored schema version.
+
+    Directories the archive has no entries for are left as they are.
+    """
+    token = secrets.token_hex(6)
+    stages = _stage_dirs(token)
+    try:
+        for stage in stages.values():
+            os.makedirs(stage)
+        with zipfile.ZipFile(fileobj) as zf:
+            if "pricing.db" not in zf.namelist():
+                raise ValueError("Invalid Backup: pricing.db not found in archive.")
+            for info in zf.infolist():
+                target = _staged_path(info.filename, stages)
+                if target is None:
+                    continue
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with zf.open(info) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+        # defaults/ ships with the code (factory reset copies from it); keep it if the backup lacks it
+        staged_assets = os.path.join(stages[os.path.dirname(APP_ASSETS_DIR)], "app_assets")
+        defaults = os.path.join(APP_ASSETS_DIR, "defaults")
+        if (os.path.isdir(staged_assets) and os.path.isdir(defaults)
+                and not os.path.exists(os.path.join(staged_assets, "defaults"))):
+            shutil.copytree(defaults, os.path.join(staged_assets, "defaults"))
+
+        version = check_database(os.path.join(stages[os.path.dirname(DATABASE)], "pricing.db"), latest_version)
+        _commit(token)
+    except Exception:
+        _discard_stages(token)
+        raise
+    _finish_restore(token)
+    return version
+
+
+def recover_interrupted_restores():
+    """Finish committed restores a crash interrupted and delete uncommitted ones (call at startup only)."""
+    primary_parent = os.path.dirname(DATABASE)
+    for parent in _stage_dirs("").keys():
+        if not os.path.isdir(parent):
+            continue
+        for name in os.listdir(parent):
+            if not name.startswith(_RESTORE_PREFIX) or not os.path.isdir(os.path.join(parent, name)):
+                continue
+            token = name[len(_RESTORE_PREFIX):]
+            if os.path.exists(os.path.join(primary_parent, name, _COMMITTED)):
+                _finish_restore(token)
+            else:
+                _discard_stages(token)
@@ -0,0 +1,413 @@
+# shared/backup_schedule.py
+"""
+Scheduled, incremental backups with retention.
+
+Backups live in BACKUPS_DIR:
+
+    objects/ab/abcdef...       content-addressed copies (SHA-256) of backed-up files
+    manifests/<id>.json        summary of one backup (shown on the admin Backups page)
+    manifests/<id>.files.json  name in the backup -> hash, size, mtime of every file
+    history.jsonl              one line per run, failed ones included
+
+A run takes an online snapshot of the database (shared.backup), checks it
+with PRAGMA quick_check, and records the snapshot plus every product image
+and app asset. Only content that is not in the store yet is copied, and a
+file whose size and mtime match the previous backup is not read at all, so
+a nightly run where little has changed takes seconds. Each backup is
+complete on its own (its file list names everything), which keeps retention
+simple: pruning deletes manifests, then the objects no remaining manifest
+references.
+
+Retention keeps the newest backup of each of the last keep_daily days,
+keep_weekly ISO weeks and keep_monthly months, and always the newest one.
+
+Every worker process runs the scheduler thread (gunicorn post_fork hook);
+a lock file lets only one of them back up at a time, and whether a backup
+is due is checked again under the lock.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from shared.backup import CHUNK_SIZE, data_files, discard, temporary_snapshot
+from shared.config import BACKUPS_DIR
+from shared.db import get_db
+
+# global_settings keys; backup_interval_hours = 0 turns scheduled backups off
+SETTING_DEFAULTS = {
+    "backup_interval_hours": 24,
+    "backup_start_hour": 2,
+    "backup_keep_daily": 7,
+    "backup_keep_weekly": 4,
+    "backup_keep_monthly": 12,
+}
+
+SCHEDULER_POLL_SECONDS = 60
+RETRY_AFTER_FAILURE = timedelta(hours=1)
+HISTORY_KEEP = 200
+
+OBJECTS_DIR = os.path.join(BACKUPS_DIR, "objects")
+MANIFESTS_DIR = os.path.join(BACKUPS_DIR, "manifests")
+_HISTORY_FILE = os.path.join(BACKUPS_DIR, "history.jsonl")
+_LOCK_FILE = os.path.join(BACKUPS_DIR, "lock")
+
+_ID_FORMAT = "%Y%m%d-%H%M%S"
+_CREATED_FORMAT = "%Y-%m-%d %H:%M:%S"
+_ID_RE = re.compile(r"^\d{8}-\d{6}$")
+
+_scheduler_started = False
+_scheduler_lock = threading.Lock()
+
+
+# ─── Settings ──────────────────────────────────────────────────────────────────
+
+def backup_settings():
+    conn = get_db()
+    placeholders = ",".join("?" * len(SETTING_DEFAULTS))
+    rows = conn.execute(f"SELECT key, value FROM global_settings WHERE key IN ({placeholders});",
+                        list(SETTING_DEFAULTS)).fetchall()
+    conn.close()
+    settings = dict(SETTING_DEFAULTS)
+    for key, value in rows:
+        try:
+            settings[key] = max(0, int(value))
+        except (TypeError, ValueError):
+            pass
+    return settings
+
+
+def save_backup_settings(values):
+    conn = get_db()
+    for key in SETTING_DEFAULTS:
+        if key in values:
+            conn.execute("INSERT OR REPLACE INTO global_settings (key, value) VALUES (?, ?);",
+                         (key, str(max(0, int(values[key])))))
+    conn.commit()
+    conn.close()
+
+
+# ─── Manifests and history ─────────────────────────────────────────────────────
+
+def _manifest_path(backup_id, suffix="json"):
+    if not backup_id or not _ID_RE.match(backup_id):
+        return None
+    return os.path.join(MANIFESTS_DIR, f"{backup_id}.{suffix}")
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (TypeError, OSError, ValueError):
+        return None
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def list_backups():
+    """Summaries of the kept backups, newest first."""
+    if not os.path.isdir(MANIFESTS_DIR):
+        return []
+    result = []
+    for name in sorted(os.listdir(MANIFESTS_DIR), reverse=True):
+        if name.endswith(".json") and not name.endswith(".files.json"):
+            manifest = load_backup(name[:-5])
+            if manifest:
+                result.append(manifest)
+    return result
+
+
+def load_backup(backup_id):
+    return _read_json(_manifest_path(backup_id))
+
+
+def backup_files(backup_id):
+    """{name in the backup: {"sha256", "size", "mtime_ns"}} of one backup, the database included."""
+    return _read_json(_manifest_path(backup_id, "files.json")) or {}
+
+
+def object_path(digest):
+    return os.path.join(OBJECTS_DIR, digest[:2], digest)
+
+
+def backup_members(backup_id):
+    """(name in the archive, path in the store) of one backup, for shared.backup.stream_zip()."""
+    return [(name, object_path(entry["sha256"])) for name, entry in backup_files(backup_id).items()]
+
+
+def read_history(limit=50):
+    """Recent runs, newest first."""
+    try:
+        with open(_HISTORY_FILE, encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return []
+    runs = []
+    for line in reversed(lines[-limit:]):
+        try:
+            runs.append(json.loads(line))
+        except ValueError:
+            pass
+    return runs
+
+
+def _log_run(entry):
+    os.makedirs(BACKUPS_DIR, exist_ok=True)
+    with open(_HISTORY_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(entry) + "\n")
+    with open(_HISTORY_FILE, encoding="utf-8") as f:
+        lines = f.readlines()
+    if len(lines) > HISTORY_KEEP * 2:
+        tmp = f"{_HISTORY_FILE}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines[-HISTORY_KEEP:])
+        os.replace(tmp, _HISTORY_FILE)
+
+
+# ─── Schedule ──────────────────────────────────────────────────────────────────
+
+def next_due(settings):
+    """When the next scheduled backup is due (None when scheduled backups are off).
+
+    Daily intervals (multiples of 24 h) are aligned to backup_start_hour.
+    After a failed run the schedule waits RETRY_AFTER_FAILURE before retrying.
+    """
+    interval = settings["backup_interval_hours"]
+    if interval <= 0:
+        return None
+    backups = list_backups()
+    if backups:
+        due = datetime.strptime(backups[0]["created"], _CREATED_FORMAT) + timedelta(hours=interval)
+        if interval % 24 == 0:
+            due = due.replace(hour=settings["backup_start_hour"] % 24, minute=0, second=0)
+    else:
+        due = datetime.now()
+    last_run = next(iter(read_history(1)), None)
+    if last_run and not last_run["ok"]:
+        due = max(due, datetime.strptime(last_run["started"], _CREATED_FORMAT) + RETRY_AFTER_FAILURE)
+    return due
+
+
+def _is_due(settings):
+    due = next_due(settings)
+    return due is not None and due <= datetime.now()
+
+
+def backup_running():
+    """True while some process holds the backup lock."""
+    os.makedirs(BACKUPS_DIR, exist_ok=True)
+    with open(_LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    return False
+
+
+def start_scheduler():
+    """Start the backup scheduler thread in this process (once)."""
+    global _scheduler_started
+    with _scheduler_lock:
+        if _scheduler_started:
+            return
+        _scheduler_started = True
+    threading.Thread(target=_scheduler_loop, name="backup-scheduler", daemon=True).start()
+
+
+def _scheduler_loop():
+    while True:
+        time.sleep(SCHEDULER_POLL_SECONDS)
+        try:
+            if _is_due(backup_settings()):
+                run_backup("scheduled")
+        except Exception as e:
+            print(f"[backup] Scheduled backup failed: {e}")
+
+
+def start_backup():
+    """Run a manual backup in a background thread; False when one is already running."""
+    if backup_running():
+        return False
+
+    def run():
+        try:
+            run_backup("manual")
+        except Exception as e:
+            print(f"[backup] Manual backup failed: {e}")
+
+    threading.Thread(target=run, name="backup-manual", daemon=True).start()
+    return True
+
+
+# ─── Running a backup ──────────────────────────────────────────────────────────
+
+def run_backup(kind="manual"):
+    """Take one backup and apply retention; returns its manifest.
+
+    Returns None when another process is backing up, or, for kind
+    "scheduled", when no backup is due any more. Failures are recorded in
+    the history and re-raised.
+    """
+    os.makedirs(BACKUPS_DIR, exist_ok=True)
+    with open(_LOCK_FILE, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        settings = backup_settings()
+        if kind == "scheduled" and not _is_due(settings):
+            return None
+
+        started = datetime.now()
+        # Ids are per second; a run right after another waits for the next one
+        while os.path.exists(_manifest_path(started.strftime(_ID_FORMAT))):
+            time.sleep(1)
+            started = datetime.now()
+        run = {"kind": kind, "started": started.strftime(_CREATED_FORMAT)}
+        try:
+            manifest = _take_backup(kind, started)
+            run["pruned"] = apply_retention(settings)
+        except Exception as e:
+            _log_run({**run, "ok": False, "error": str(e),
+                      "seconds": round((datetime.now() - started).total_seconds(), 1)})
+            raise
+        _log_run({**run, "ok": True, "id": manifest["id"], "seconds": manifest["seconds"],
+                  "changed_files": manifest["changed_files"], "new_bytes": manifest["new_bytes"]})
+        return manifest
+
+
+def _quick_check(path):
+    conn = sqlite3.connect(path)
+    try:
+        rows = [row[0] for row in conn.execute("PRAGMA quick_check;").fetchall()]
+        version = conn.execute("PRAGMA user_version;").fetchone()[0]
+    finally:
+        conn.close()
+    return "ok" if rows == ["ok"] else "; ".join(rows[:5]), version
+
+
+def _store(path):
+    """Copy path into the object store while hashing it; (digest, size, whether it was new)."""
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    tmp = os.path.join(OBJECTS_DIR, f".tmp-{os.getpid()}-{threading.get_ident()}")
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as src, open(tmp, "wb") as dst:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+    digest = digest.hexdigest()
+    target = object_path(digest)
+    if os.path.exists(target):
+        discard(tmp)
+        return digest, size, False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(tmp, target)
+    return digest, size, True
+
+
+def _take_backup(kind, started):
+    os.makedirs(MANIFESTS_DIR, exist_ok=True)
+    backup_id = started.strftime(_ID_FORMAT)
+    previous = list_backups()
+    previous_files = backup_files(previous[0]["id"]) if previous else {}
+    files = {}
+    changed = new_objects = new_bytes = 0
+
+    snapshot = temporary_snapshot()
+    try:
+        check, schema_version = _quick_check(snapshot)
+        if check != "ok":
+            raise RuntimeError(f"Database snapshot failed PRAGMA quick_check: {check}")
+        digest, size, new = _store(snapshot)
+        files["pricing.db"] = {"sha256": digest, "size": size, "mtime_ns": 0}
+        new_objects += new
+        new_bytes += size if new else 0
+    finally:
+        discard(snapshot)
+
+    for name, path in data_files():
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue  # deleted while we were walking
+        old = previous_files.get(name)
+        if (old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns
+                and os.path.exists(object_path(old["sha256"]))):
+            files[name] = old
+            continue
+        digest, size, new = _store(path)
+        files[name] = {"sha256": digest, "size": size, "mtime_ns": st.st_mtime_ns}
+        changed += 1
+        new_objects += new
+        new_bytes += size if new else 0
+
+    manifest = {
+        "id": backup_id,
+        "created": started.strftime(_CREATED_FORMAT),
+        "kind": kind,
+        "quick_check": check,
+        "schema_version": schema_version,
+        "database_size": files["pricing.db"]["size"],
+        "file_count": len(files) - 1,
+        "total_bytes": sum(entry["size"] for entry in files.values()),
+        "changed_files": changed,
+        "new_objects": new_objects,
+        "new_bytes": new_bytes,
+        "seconds": round((datetime.now() - started).total_seconds(), 1),
+    }
+    # File list first: a summary without its file list is never visible
+    _write_json(_manifest_path(backup_id, "files.json"), files)
+    _write_json(_manifest_path(backup_id), manifest)
+    return manifest
+
+
+# ─── Retention ─────────────────────────────────────────────────────────────────
+
+def select_kept(backups, keep_daily, keep_weekly, keep_monthly):
+    """Ids of the backups to keep: the newest of each of the last N days, ISO weeks and months."""
+    ordered = sorted(backups, key=lambda b: b["created"], reverse=True)
+    kept = {ordered[0]["id"]} if ordered else set()
+    for count, period in ((keep_daily, "%Y-%m-%d"), (keep_weekly, "%G-W%V"), (keep_monthly, "%Y-%m")):
+        periods = set()
+        for backup in ordered:
+            key = datetime.strptime(backup["created"], _CREATED_FORMAT).strftime(period)
+            if key in periods:
+                continue
+            if len(periods) >= count:
+                break
+            periods.add(key)
+            kept.add(backup["id"])
+    return kept
+
+
+def apply_retention(settings):
+    """Delete the backups the policy does not keep, then unreferenced objects; returns the deleted ids."""
+    backups = list_backups()
+    kept = select_kept(backups, settings["backup_keep_daily"], settings["backup_keep_weekly"],
+                       settings["backup_keep_monthly"])
+    pruned = [b["id"] for b in backups if b["id"] not in kept]
+    for backup_id in pruned:
+        discard(_manifest_path(backup_id))
+        discard(_manifest_path(backup_id, "files.json"))
+
+    referenced = {entry["sha256"] for backup_id in kept for entry in backup_files(backup_id).values()}
+    if os.path.isdir(OBJECTS_DIR):
+        for root, dirs, names in os.walk(OBJECTS_DIR):
+            for name in names:
+                if name not in referenced:
+                    discard(os.path.join(root, name))
+    return pruned
@@ -0,0 +1,70 @@
+"""
+Compressed storage for large HTML/CSS columns.
+
+Values are written with pack_text() and read back with unpack_text(). Long
+strings are stored as a BLOB made of a short version header followed by
+zlib-compressed UTF-8; short strings stay plain TEXT. unpack_text() accepts
+both, so rows written before compression was introduced keep working and
+can be converted lazily or with compress_column().
+"""
+import hashlib
+import zlib
+
+# b"QZ" + format version. Bump the version byte if the encoding ever changes.
+_HEADER_V1 = b"QZ\x01"
+
+# Below this many bytes the header and zlib framing are not worth it
+_MIN_COMPRESS_BYTES = 256
+_LEVEL = 6
+
+
+def pack_text(text):
+    """str -> value to store (plain str for short text, compressed bytes otherwise)."""
+    if text is None:
+        return None
+    data = text.encode("utf-8")
+    if len(data) < _MIN_COMPRESS_BYTES:
+        return text
+    packed = _HEADER_V1 + zlib.compress(data, _LEVEL)
+    return packed if len(packed) < len(data) else text
+
+
+def unpack_text(value):
+    """Stored value -> str. Plain TEXT (legacy rows) is returned unchanged."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value.startswith(_HEADER_V1):
+        return zlib.decompress(value[len(_HEADER_V1):]).decode("utf-8")
+    return value.decode("utf-8")
+
+
+def unpack_row(row, *columns):
+    """sqlite3.Row -> dict with the given columns unpacked."""
+    d = dict(row)
+    for col in columns:
+        d[col] = unpack_text(d.get(col))
+    return d
+
+
+def content_hash(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def compress_column(conn, table, column, key="id"):
+    """
+    Re-store every value of table.column through pack_text(). Values that are
+    already packed, or too small to compress, are left alone. Returns the
+    number of rows rewritten; the caller commits.
+    """
+    cur = conn.cursor()
+    cur.execute(f"SELECT {key}, {column} FROM {table} WHERE typeof({column}) = 'text';")
+    updated = 0
+    for row in cur.fetchall():
+        packed = pack_text(row[1])
+        if not isinstance(packed, str):
+            conn.execute(f"UPDATE {table} SET {column}=? WHERE {key}=?;", (packed, row[0]))
+            updated += 1
+    return updated
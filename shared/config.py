@@ -12,8 +12,8 @@ import os
 # The shared folder is inside QP-CRM. So parent of shared is QP-CRM.
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# app_data folder inside QP-CRM
-APP_DATA_DIR = os.path.join(BASE_DIR, "app_data")
+# app_data folder inside QP-CRM (QP_APP_DATA_DIR points the apps at another data set, e.g. the benchmarks)
+APP_DATA_DIR = os.environ.get("QP_APP_DATA_DIR") or os.path.join(BASE_DIR, "app_data")
 
 # pricing.db inside app_data
 DATABASE = os.path.join(APP_DATA_DIR, "pricing.db")
@@ -21,6 +21,24 @@ DATABASE = os.path.join(APP_DATA_DIR, "pricing.db")
 # product image data
 IMAGE_DIR = os.path.join(APP_DATA_DIR, "product_images")
 
+# rendered PDF parts, keyed by content hash (safe to delete)
+PDF_CACHE_DIR = os.path.join(APP_DATA_DIR, "pdf_cache")
+
+# .docx -> HTML conversions of rent templates, keyed by file hash (safe to delete)
+DOCX_CACHE_DIR = os.path.join(APP_DATA_DIR, "docx_cache")
+
+# background catalog PDF jobs: status JSON + output per job (old jobs are pruned)
+CATALOG_JOBS_DIR = os.path.join(APP_DATA_DIR, "catalog_jobs")
+
+# per-worker request metrics (merged by /metrics and the admin Performance page; cleared on start)
+METRICS_DIR = os.path.join(APP_DATA_DIR, "metrics")
+
+# on-demand request profiles (cProfile + SQL plans); only the newest ones are kept
+PROFILES_DIR = os.path.join(APP_DATA_DIR, "profiles")
+
+# scheduled backups (manifests + content-addressed file store); QP_BACKUPS_DIR puts them on another disk
+BACKUPS_DIR = os.environ.get("QP_BACKUPS_DIR") or os.path.join(APP_DATA_DIR, "backups")
+
 # static/css path
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 
@@ -1,9 +1,11 @@
 import sqlite3
+from pathlib import Path
 from .config import DATABASE
+from .instrumentation import InstrumentedConnection
 
 def get_db():
     # Increase timeout to 20 seconds to prevent "database is locked" errors
-    conn = sqlite3.connect(DATABASE, timeout=20.0)
+    conn = sqlite3.connect(DATABASE, timeout=20.0, factory=InstrumentedConnection)
     conn.row_factory = sqlite3.Row
     # Enforce foreign keys for data integrity
     conn.execute("PRAGMA foreign_keys = ON;")
@@ -12,3 +14,16 @@ def get_db():
     # Set synchronous to NORMAL for better performance with WAL
     conn.execute("PRAGMA synchronous = NORMAL;")
     return conn
+
+
+def get_readonly_db():
+    """
+    Read-only connection (mode=ro + query_only) for pages that never write,
+    such as the Sale catalog. It cannot take the write lock, so heavy read
+    traffic does not contend with the apps that edit data.
+    """
+    uri = Path(DATABASE).as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=20.0, factory=InstrumentedConnection)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA query_only = ON;")
+    return conn
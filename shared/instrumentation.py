@@ -0,0 +1,473 @@
+# shared/instrumentation.py
+"""
+Per-request performance instrumentation for the merged app (main.py).
+
+InstrumentationMiddleware wraps the DispatcherMiddleware and measures every
+request per sub-app and Flask endpoint: wall time, number of SQL statements
+and the time spent in them, and time spent rendering PDFs.
+
+- SQL is timed by the connection class shared.db hands out
+  (InstrumentedConnection: execute/executemany/executescript and fetches).
+  Statements outside a request (startup, background jobs) are not counted.
+- PDF rendering is timed where the apps call WeasyPrint, via pdf_timer().
+
+Each response carries a Server-Timing header (browser dev tools, Network
+tab), each finished request writes one JSON line to the "qp.access" logger,
+and the numbers feed latency histograms and a per-statement table. Every
+worker process keeps its own numbers and writes them to METRICS_DIR every
+few seconds; metrics_text() (/metrics) and snapshot() (admin Performance
+page) merge all workers, including ones that have exited.
+"""
+import atexit
+import contextvars
+import fcntl
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from shared.config import METRICS_DIR
+
+# Histogram bucket upper bounds, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_QUERY_TABLE_MAX = 500
+_DUMP_INTERVAL_SECONDS = 5.0
+_RETIRED_FILE = "retired.json"
+
+_current = contextvars.ContextVar("qp_request_stats", default=None)
+
+access_log = logging.getLogger("qp.access")
+if not access_log.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    access_log.addHandler(_handler)
+    access_log.setLevel(logging.INFO)
+    access_log.propagate = False
+
+# String and number literals, so statements built with f-strings group together
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_sql(sql):
+    sql = _SPACE_RE.sub(" ", sql).strip()
+    return _LITERAL_RE.sub("?", sql)[:400]
+
+
+class RequestStats:
+    __slots__ = ("sql_count", "sql_seconds", "pdf_seconds", "queries", "trace")
+
+    def __init__(self):
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.pdf_seconds = 0.0
+        self.queries = {}
+        # [(sql, parameters, seconds)] of every statement; only kept while profiling (shared/profiler.py)
+        self.trace = None
+
+    def add_query(self, sql, seconds, statement=True):
+        if statement:
+            self.sql_count += 1
+        self.sql_seconds += seconds
+        entry = self.queries.get(sql)
+        if entry is None:
+            self.queries[sql] = [1 if statement else 0, seconds, seconds]
+        else:
+            entry[0] += 1 if statement else 0
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    def server_timing(self, total_seconds):
+        return (f'app;dur={total_seconds * 1000:.1f}, '
+                f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.sql_count} queries", '
+                f'pdf;dur={self.pdf_seconds * 1000:.1f}')
+
+
+# ─── Database and PDF hooks ────────────────────────────────────────────────────
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _qp_sql = None
+
+    def _timed(self, method, sql, *args, params=None):
+        stats = _current.get()
+        if stats is None:
+            return method(sql, *args)
+        started = time.perf_counter()
+        try:
+            return method(sql, *args)
+        finally:
+            elapsed = time.perf_counter() - started
+            self._qp_sql = sql
+            stats.add_query(sql, elapsed)
+            if stats.trace is not None:
+                stats.trace.append((sql, params, elapsed))
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters, params=parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self._timed(super().executescript, sql_script)
+
+    def _timed_fetch(self, method, *args):
+        stats = _current.get()
+        if stats is None or self._qp_sql is None:
+            return method(*args)
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            # Rows are produced lazily; charge the fetch to the statement that produced them
+            stats.add_query(self._qp_sql, time.perf_counter() - started, statement=False)
+
+    def fetchone(self):
+        return self._timed_fetch(super().fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed_fetch(super().fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed_fetch(super().fetchall)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+
+def current_stats():
+    """RequestStats of the request being served in this context, or None."""
+    return _current.get()
+
+
+@contextmanager
+def pdf_timer():
+    """Charge the enclosed block (WeasyPrint rendering) to the current request's PDF time."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.pdf_seconds += time.perf_counter() - started
+
+
+# ─── Per-process registry ──────────────────────────────────────────────────────
+
+def _new_endpoint():
+    return {"count": 0, "errors": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * (len(BUCKETS) + 1),
+            "sql_count": 0, "sql_seconds": 0.0, "pdf_seconds": 0.0}
+
+
+def _merge_endpoint(into, other):
+    for k in ("count", "errors", "sum", "sql_count", "sql_seconds", "pdf_seconds"):
+        into[k] += other[k]
+    into["max"] = max(into["max"], other["max"])
+    into["buckets"] = [a + b for a, b in zip(into["buckets"], other["buckets"])]
+
+
+def _merge_queries(into, other):
+    for sql, (count, seconds, longest) in other.items():
+        entry = into.get(sql)
+        if entry is None:
+            into[sql] = [count, seconds, longest]
+        else:
+            entry[0] += count
+            entry[1] += seconds
+            entry[2] = max(entry[2], longest)
+
+
+def _trim_queries(queries):
+    if len(queries) > _QUERY_TABLE_MAX:
+        keep = sorted(queries.items(), key=lambda kv: kv[1][1], reverse=True)[:_QUERY_TABLE_MAX]
+        queries.clear()
+        queries.update(keep)
+
+
+class _Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.queries = {}
+        self.last_dump = 0.0
+
+    def record(self, key, seconds, status, stats):
+        queries = {}
+        for sql, value in stats.queries.items():
+            _merge_queries(queries, {normalize_sql(sql): value})
+        with self.lock:
+            ep = self.endpoints.get(key)
+            if ep is None:
+                ep = self.endpoints[key] = _new_endpoint()
+            ep["count"] += 1
+            ep["errors"] += status >= 500
+            ep["sum"] += seconds
+            ep["max"] = max(ep["max"], seconds)
+            ep["buckets"][next((i for i, b in enumerate(BUCKETS) if seconds <= b), len(BUCKETS))] += 1
+            ep["sql_count"] += stats.sql_count
+            ep["sql_seconds"] += stats.sql_seconds
+            ep["pdf_seconds"] += stats.pdf_seconds
+            _merge_queries(self.queries, queries)
+            if len(self.queries) > 2 * _QUERY_TABLE_MAX:
+                _trim_queries(self.queries)
+            due = time.monotonic() - self.last_dump >= _DUMP_INTERVAL_SECONDS
+            if due:
+                self.last_dump = time.monotonic()
+        if due:
+            self.dump()
+
+    def data(self):
+        with self.lock:
+            return {
+                "endpoints": [[*key, dict(ep, buckets=list(ep["buckets"]))] for key, ep in self.endpoints.items()],
+                "queries": {sql: list(v) for sql, v in self.queries.items()},
+            }
+
+    def dump(self):
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data(), f)
+        os.replace(tmp, path)
+
+
+_registry = _Registry()
+_retired = False
+
+
+def retire_worker():
+    """Fold this worker's numbers into the shared retired file (on worker exit)."""
+    global _retired
+    if _retired or not _registry.endpoints:
+        return
+    _retired = True
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    with open(os.path.join(METRICS_DIR, "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        merged = _merge([_read(os.path.join(METRICS_DIR, _RETIRED_FILE)), _registry.data()])
+        _write(os.path.join(METRICS_DIR, _RETIRED_FILE), merged)
+        try:
+            os.remove(os.path.join(METRICS_DIR, f"{os.getpid()}.json"))
+        except OSError:
+            pass
+
+
+atexit.register(retire_worker)
+
+
+def reset_metrics():
+    """Forget all recorded numbers (called once at server start)."""
+    if os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            if name.endswith(".json"):
+                os.remove(os.path.join(METRICS_DIR, name))
+
+
+def _read(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _merge(parts):
+    endpoints, queries = {}, {}
+    for part in parts:
+        if not part:
+            continue
+        for app, endpoint, method, ep in part["endpoints"]:
+            key = (app, endpoint, method)
+            if key in endpoints:
+                _merge_endpoint(endpoints[key], ep)
+            else:
+                endpoints[key] = ep
+        _merge_queries(queries, part["queries"])
+    _trim_queries(queries)
+    return {"endpoints": [[*key, ep] for key, ep in endpoints.items()], "queries": queries}
+
+
+def collect():
+    """Numbers of all workers merged: {"endpoints": [[app, endpoint, method, stats]], "queries": {...}}."""
+    own = f"{os.getpid()}.json"
+    parts = [_registry.data()]
+    if os.path.isdir(METRICS_DIR):
+        for name in os.listdir(METRICS_DIR):
+            if name.endswith(".json") and name != own:
+                parts.append(_read(os.path.join(METRICS_DIR, name)))
+    return _merge(parts)
+
+
+# ─── Reports ───────────────────────────────────────────────────────────────────
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def metrics_text():
+    """All workers' numbers in the Prometheus text exposition format."""
+    data = collect()
+    out = [
+        "# HELP qp_request_duration_seconds Request wall time by sub-app and endpoint.",
+        "# TYPE qp_request_duration_seconds histogram",
+    ]
+    counters = []
+    for app, endpoint, method, ep in sorted(data["endpoints"], key=lambda e: e[:3]):
+        labels = f'app="{_label(app)}",endpoint="{_label(endpoint)}",method="{_label(method)}"'
+        cumulative = 0
+        for bound, n in zip((*BUCKETS, "+Inf"), ep["buckets"]):
+            cumulative += n
+            out.append(f'qp_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        out.append(f"qp_request_duration_seconds_sum{{{labels}}} {ep['sum']:.6f}")
+        out.append(f"qp_request_duration_seconds_count{{{labels}}} {ep['count']}")
+        counters.append((labels, ep))
+    for name, key, help_text in (
+        ("qp_request_errors_total", "errors", "Requests answered with a 5xx status."),
+        ("qp_sql_queries_total", "sql_count", "SQL statements executed while serving requests."),
+        ("qp_sql_seconds_total", "sql_seconds", "Time spent in SQL while serving requests."),
+        ("qp_pdf_render_seconds_total", "pdf_seconds", "Time spent rendering PDFs while serving requests."),
+    ):
+        out.append(f"# HELP {name} {help_text}")
+        out.append(f"# TYPE {name} counter")
+        for labels, ep in counters:
+            value = ep[key]
+            out.append(f"{name}{{{labels}}} {value:.6f}" if isinstance(value, float) else f"{name}{{{labels}}} {value}")
+    return "\n".join(out) + "\n"
+
+
+def _p95(ep):
+    target = ep["count"] * 0.95
+    seen = 0
+    for bound, n in zip(BUCKETS, ep["buckets"]):
+        seen += n
+        if seen >= target:
+            return bound
+    return ep["max"]
+
+
+def snapshot(limit=50):
+    """Slowest endpoints (by average) and statements (by total time) for the admin page."""
+    data = collect()
+    endpoints = []
+    for app, endpoint, method, ep in data["endpoints"]:
+        n = ep["count"] or 1
+        endpoints.append({
+            "app": app, "endpoint": endpoint, "method": method,
+            "count": ep["count"], "errors": ep["errors"],
+            "avg_ms": ep["sum"] / n * 1000, "p95_ms": _p95(ep) * 1000, "max_ms": ep["max"] * 1000,
+            "sql_per_request": ep["sql_count"] / n, "sql_ms": ep["sql_seconds"] / n * 1000,
+            "pdf_ms": ep["pdf_seconds"] / n * 1000,
+        })
+    endpoints.sort(key=lambda e: e["avg_ms"], reverse=True)
+    queries = [
+        {"sql": sql, "count": count, "total_ms": seconds * 1000,
+         "avg_ms": seconds / count * 1000 if count else 0.0, "max_ms": longest * 1000}
+        for sql, (count, seconds, longest) in data["queries"].items()
+    ]
+    queries.sort(key=lambda q: q["total_ms"], reverse=True)
+    return {"endpoints": endpoints[:limit], "queries": queries[:limit]}
+
+
+# ─── WSGI ──────────────────────────────────────────────────────────────────────
+
+def instrument_app(flask_app):
+    """Let the middleware see which endpoint served the request (set before any before_request hook)."""
+    from flask import request
+
+    @flask_app.url_value_preprocessor
+    def _record_endpoint(endpoint, values):
+        request.environ["qp.endpoint"] = endpoint
+
+
+class InstrumentationMiddleware:
+    def __init__(self, app, mounts):
+        self.app = app
+        self.prefixes = sorted(mounts, key=len, reverse=True)
+
+    def _sub_app(self, path):
+        for prefix in self.prefixes:
+            if path == prefix or path.startswith(prefix + "/"):
+                return prefix.strip("/")
+        return "main"
+
+    def __call__(self, environ, start_response):
+        # DispatcherMiddleware rewrites PATH_INFO; keep the original
+        path = environ.get("PATH_INFO", "")
+        method = environ.get("REQUEST_METHOD", "GET")
+        stats = RequestStats()
+        _current.set(stats)
+        started = time.perf_counter()
+        status = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split(" ", 1)[0]))
+            headers.append(("Server-Timing", stats.server_timing(time.perf_counter() - started)))
+            return start_response(status_line, headers, exc_info)
+
+        def finish():
+            _current.set(None)
+            seconds = time.perf_counter() - started
+            app = self._sub_app(path)
+            endpoint = environ.get("qp.endpoint") or "<unmatched>"
+            code = status[0] if status else 500
+            _registry.record((app, endpoint, method), seconds, code, stats)
+            access_log.info(json.dumps({
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "pid": os.getpid(),
+                "method": method, "path": path, "app": app, "endpoint": endpoint, "status": code,
+                "ms": round(seconds * 1000, 1), "sql_count": stats.sql_count,
+                "sql_ms": round(stats.sql_seconds * 1000, 1), "pdf_ms": round(stats.pdf_seconds * 1000, 1),
+            }))
+
+        try:
+            body = self.app(environ, _start_response)
+        except Exception:
+            finish()
+            raise
+
+        # File responses (send_file) keep the server's sendfile path; they are timed up to here
+        file_wrapper = environ.get("wsgi.file_wrapper")
+        if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+            finish()
+            return body
+        return _ClosingBody(body, finish)
+
+
+class _ClosingBody:
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, "close"):
+                self.body.close()
+        finally:
+            self.on_close()
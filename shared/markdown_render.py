@@ -0,0 +1,88 @@
+# shared/markdown_render.py
+"""
+Markdown rendering shared by the pricing, offer and sale apps.
+
+Building a markdown.Markdown object loads and registers every extension,
+which costs far more than converting a short product description. Each
+thread therefore keeps one preconfigured instance per extension set and
+calls reset() between conversions, and rendered HTML is kept in a small
+LRU cache keyed by a hash of the source text, so an offer that lists the
+same product description on many lines renders it only once.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+DEFAULT_EXTENSIONS = ('extra', 'nl2br')
+
+_CACHE_MAX_ENTRIES = 2048
+
+_local = threading.local()
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+_LIST_ITEM_RE = re.compile(r'^[ \t]*([*+-]|\d+\.)[ \t]+')
+
+
+def fix_markdown_lists(text):
+    """Insert the blank line Markdown needs before a list that directly follows a paragraph."""
+    if not text:
+        return text
+    lines = text.split('\n')
+    fixed_lines = []
+    in_list = False
+    for line in lines:
+        is_list_item = bool(_LIST_ITEM_RE.match(line))
+        is_empty = not line.strip()
+        if is_list_item and not in_list and fixed_lines and fixed_lines[-1].strip():
+            fixed_lines.append('')
+        fixed_lines.append(line)
+        if is_empty:
+            in_list = False
+        elif is_list_item:
+            in_list = True
+    return '\n'.join(fixed_lines)
+
+
+def _markdown_instance(extensions):
+    pool = getattr(_local, 'pool', None)
+    if pool is None:
+        pool = _local.pool = {}
+    md = pool.get(extensions)
+    if md is None:
+        import markdown
+        md = pool[extensions] = markdown.Markdown(extensions=list(extensions))
+    return md
+
+
+def _cache_key(text, extensions, fix_lists):
+    digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    return (digest, extensions, fix_lists)
+
+
+def render_markdown(text, extensions=DEFAULT_EXTENSIONS, fix_lists=True):
+    """Render Markdown to HTML using a pooled Markdown instance and the LRU cache."""
+    if not text:
+        return ""
+    extensions = tuple(extensions)
+    key = _cache_key(text, extensions, fix_lists)
+    with _cache_lock:
+        html = _cache.get(key)
+        if html is not None:
+            _cache.move_to_end(key)
+            return html
+
+    source = fix_markdown_lists(text) if fix_lists else text
+    html = _markdown_instance(extensions).reset().convert(source)
+
+    with _cache_lock:
+        _cache[key] = html
+        if len(_cache) > _CACHE_MAX_ENTRIES:
+            _cache.popitem(last=False)
+    return html
+
+
+def clear_markdown_cache():
+    with _cache_lock:
+        _cache.clear()
@@ -0,0 +1,71 @@
+# shared/migrations.py
+"""
+Schema migrations keyed on SQLite's PRAGMA user_version.
+
+The apps' init_db()/migrate_schema() functions are idempotent (CREATE ...
+IF NOT EXISTS, ALTERs that tolerate "duplicate column", flag-gated data
+fixes, seeding only into empty tables), but running all of them on every
+start costs PRAGMA table_info loops, full-table scans and template file
+reads. run_migrations() runs only the steps numbered above the version
+stored in the database file and records each step's number once it has
+finished, so a current database costs one PRAGMA read at startup.
+
+Whenever a change touches one of the init/migrate functions, append a step
+with the next number that re-runs it (see MIGRATIONS in main.py).
+"""
+import time
+
+from shared.db import get_db
+
+# Steps of the running code, kept by run_migrations() so a restored database can be migrated too
+_steps = []
+
+
+def schema_version(conn=None):
+    own = conn is None
+    conn = conn or get_db()
+    version = conn.execute("PRAGMA user_version;").fetchone()[0]
+    if own:
+        conn.close()
+    return version
+
+
+def _set_schema_version(version):
+    conn = get_db()
+    # PRAGMA does not accept bound parameters; version is always an int here
+    conn.execute(f"PRAGMA user_version = {int(version)};")
+    conn.commit()
+    conn.close()
+
+
+def mark_schema_stale(conn):
+    """Make the next start re-run every step (e.g. after seeded tables were emptied)."""
+    conn.execute("PRAGMA user_version = 0;")
+
+
+def run_migrations(steps):
+    """
+    Run the (version, description, func) steps newer than the database.
+    Returns [(version, description, seconds)] for the steps that ran.
+    """
+    _steps[:] = steps
+    current = schema_version()
+    ran = []
+    for version, description, func in sorted(steps, key=lambda s: s[0]):
+        if version <= current:
+            continue
+        started = time.perf_counter()
+        func()
+        _set_schema_version(version)
+        ran.append((version, description, time.perf_counter() - started))
+    return ran
+
+
+def latest_schema_version():
+    """Newest version this code migrates to (None until run_migrations() has run)."""
+    return max(step[0] for step in _steps) if _steps else None
+
+
+def migrate_to_current():
+    """Run the steps a database swapped in since startup (e.g. a restored backup) is missing."""
+    return run_migrations(list(_steps))
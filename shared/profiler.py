@@ -0,0 +1,222 @@
+# shared/profiler.py
+"""
+On-demand profiling of single requests, for admins.
+
+Add ?_profile=1 to any URL of the merged app (or send the header
+X-QP-Profile: 1) while logged in to the admin app, and that one request
+runs under cProfile. The response body is consumed inside the profiler, so
+streamed responses and PDF rendering are included. Every SQL statement the
+request executes is recorded together with its EXPLAIN QUERY PLAN.
+
+Profiles are stored in PROFILES_DIR as <id>.json (summary, top functions,
+statements and plans) plus <id>.prof (raw pstats, for snakeviz & co.); the
+response carries the id in an X-QP-Profile header and the admin Profiles
+page lists them. Only one request is profiled at a time per process; a
+second request asking for a profile meanwhile is served normally.
+"""
+import cProfile
+import json
+import os
+import pstats
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from urllib.parse import parse_qs
+
+from shared.config import BASE_DIR, DATABASE, PROFILES_DIR
+from shared.instrumentation import current_stats
+
+PROFILE_KEEP = 50
+
+_TOP_FUNCTIONS = 60
+_ID_RE = re.compile(r"^\d{8}-\d{6}-[0-9a-f]{6}$")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+_profile_lock = threading.Lock()
+
+
+def _requested(environ):
+    if environ.get("HTTP_X_QP_PROFILE"):
+        return True
+    return "_profile" in parse_qs(environ.get("QUERY_STRING", ""))
+
+
+# ─── Storage ───────────────────────────────────────────────────────────────────
+
+def _path(profile_id, ext):
+    if not profile_id or not _ID_RE.match(profile_id):
+        return None
+    return os.path.join(PROFILES_DIR, f"{profile_id}.{ext}")
+
+
+def list_profiles():
+    """Summaries of the stored profiles, newest first."""
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    result = []
+    for name in sorted(os.listdir(PROFILES_DIR), reverse=True):
+        if name.endswith(".json"):
+            profile = load_profile(name[:-5])
+            if profile:
+                profile.pop("functions", None)
+                profile.pop("queries", None)
+                result.append(profile)
+    return result
+
+
+def load_profile(profile_id):
+    path = _path(profile_id, "json")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (TypeError, OSError, ValueError):
+        return None
+
+
+def profile_stats_path(profile_id):
+    path = _path(profile_id, "prof")
+    return path if path and os.path.exists(path) else None
+
+
+def _prune():
+    ids = sorted(name[:-5] for name in os.listdir(PROFILES_DIR) if name.endswith(".json"))
+    for profile_id in ids[:-PROFILE_KEEP]:
+        for ext in ("json", "prof"):
+            try:
+                os.remove(_path(profile_id, ext))
+            except OSError:
+                pass
+
+
+# ─── Report building ───────────────────────────────────────────────────────────
+
+def _location(filename, line):
+    try:
+        filename = str(Path(filename).relative_to(BASE_DIR))
+    except ValueError:
+        pass
+    return f"{filename}:{line}"
+
+
+def _functions(profiler):
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda kv: kv[1][3], reverse=True)[:_TOP_FUNCTIONS]
+    return [{
+        "function": func,
+        "location": _location(filename, line),
+        "calls": ncalls,
+        "tottime_ms": round(tottime * 1000, 2),
+        "cumtime_ms": round(cumtime * 1000, 2),
+    } for (filename, line, func), (_, ncalls, tottime, cumtime, _) in rows]
+
+
+def _plan(conn, sql, params):
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return []
+    try:
+        rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall()
+    except (sqlite3.Error, ValueError):
+        return []
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+def _queries(trace):
+    grouped = {}
+    for sql, params, seconds in trace:
+        entry = grouped.get(sql)
+        if entry is None:
+            grouped[sql] = entry = {"sql": sql.strip(), "params": params, "count": 0, "total_ms": 0.0}
+        entry["count"] += 1
+        entry["total_ms"] += seconds * 1000
+    # Plans come from a separate read-only connection, so they are not charged to the request
+    conn = sqlite3.connect(Path(DATABASE).as_uri() + "?mode=ro", uri=True, timeout=5.0)
+    try:
+        for sql, entry in grouped.items():
+            entry["plan"] = _plan(conn, sql, entry["params"])
+            entry["params"] = repr(entry["params"])[:200] if entry["params"] else ""
+            entry["total_ms"] = round(entry["total_ms"], 2)
+    finally:
+        conn.close()
+    return sorted(grouped.values(), key=lambda q: q["total_ms"], reverse=True)
+
+
+def _save(profile_id, profiler, summary, trace):
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    profiler.dump_stats(_path(profile_id, "prof"))
+    summary["functions"] = _functions(profiler)
+    summary["queries"] = _queries(trace or [])
+    tmp = f"{_path(profile_id, 'json')}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    os.replace(tmp, _path(profile_id, "json"))
+    _prune()
+
+
+# ─── WSGI ──────────────────────────────────────────────────────────────────────
+
+class ProfilerMiddleware:
+    """Profile requests that ask for it, if is_allowed(environ) (admin session) agrees."""
+
+    def __init__(self, app, is_allowed):
+        self.app = app
+        self.is_allowed = is_allowed
+
+    def __call__(self, environ, start_response):
+        if not _requested(environ) or not self.is_allowed(environ):
+            return self.app(environ, start_response)
+        if not _profile_lock.acquire(blocking=False):
+            return self.app(environ, start_response)
+        try:
+            return self._profile(environ, start_response)
+        finally:
+            _profile_lock.release()
+
+    def _profile(self, environ, start_response):
+        profile_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        summary = {
+            "id": profile_id,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "method": environ.get("REQUEST_METHOD", "GET"),
+            "path": environ.get("PATH_INFO", ""),
+            "query": environ.get("QUERY_STRING", ""),
+            "status": 500,
+        }
+        stats = current_stats()
+        if stats is not None:
+            stats.trace = []
+
+        def _start_response(status_line, headers, exc_info=None):
+            summary["status"] = int(status_line.split(" ", 1)[0])
+            headers.append(("X-QP-Profile", profile_id))
+            return start_response(status_line, headers, exc_info)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            body = self.app(environ, _start_response)
+            try:
+                chunks = list(body)
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+        finally:
+            profiler.disable()
+            summary["ms"] = round((time.perf_counter() - started) * 1000, 1)
+            summary["endpoint"] = environ.get("qp.endpoint") or ""
+            if stats is not None:
+                summary["sql_count"] = stats.sql_count
+                summary["sql_ms"] = round(stats.sql_seconds * 1000, 1)
+                summary["pdf_ms"] = round(stats.pdf_seconds * 1000, 1)
+            trace = stats.trace if stats is not None else None
+            if stats is not None:
+                stats.trace = None
+            _save(profile_id, profiler, summary, trace)
+        return chunks
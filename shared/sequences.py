@@ -0,0 +1,117 @@
+# shared/sequences.py
+"""
+Document number sequences (offers, rent contracts, ...).
+
+Every series keeps one counter row per period in `document_sequences`.
+A number is allocated with a single UPSERT ... RETURNING, which takes the
+SQLite write lock, so two concurrent writers can never receive the same
+value. Call `next_document_number` on the same connection that inserts the
+document and commit both together: if the insert fails and is rolled back,
+the counter goes back as well.
+
+Format patterns are stored in global_settings under
+`sequence_format_<series>` and use str.format placeholders:
+
+    {n}     counter (e.g. {n:02d}, {n:04d})
+    {yyyy}  four-digit year
+    {yy}    two-digit year
+    {mm}    two-digit month
+
+The period a counter resets on follows from the pattern: monthly if it
+contains {mm}, yearly if it contains a year, otherwise never.
+"""
+from datetime import date, datetime
+
+DEFAULT_SEQUENCE_FORMATS = {
+    'offer': '{n:03d}/{yyyy}',
+    'rent_contract': '{n:02d}{mm}{yy}',
+}
+
+# Guard against a hand-typed number that already occupies the next slot
+_MAX_SKIP = 1000
+
+
+def init_sequences_table(conn):
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS document_sequences (
+            series TEXT NOT NULL,
+            period TEXT NOT NULL DEFAULT '',
+            last_value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (series, period)
+        );
+    """)
+    conn.commit()
+
+
+def get_sequence_format(conn, series):
+    cur = conn.cursor()
+    cur.execute("SELECT value FROM global_settings WHERE key = ?;", (f"sequence_format_{series}",))
+    row = cur.fetchone()
+    if row and row["value"]:
+        return row["value"]
+    return DEFAULT_SEQUENCE_FORMATS.get(series, '{n}')
+
+
+def sequence_period(pattern, dt):
+    """Counter bucket for a pattern: 'YYYY-MM', 'YYYY' or '' (never resets)."""
+    if '{mm' in pattern:
+        return f"{dt.year:04d}-{dt.month:02d}"
+    if '{yy' in pattern:
+        return f"{dt.year:04d}"
+    return ''
+
+
+def format_document_number(pattern, n, dt):
+    try:
+        return pattern.format(n=n, yyyy=f"{dt.year:04d}", yy=dt.strftime("%y"), mm=f"{dt.month:02d}")
+    except (KeyError, IndexError, ValueError):
+        # Broken pattern in settings; fall back to the bare counter
+        return str(n)
+
+
+def _parse_date(on_date):
+    if on_date is None:
+        return date.today()
+    if isinstance(on_date, (date, datetime)):
+        return on_date
+    try:
+        return datetime.strptime(str(on_date)[:10], "%Y-%m-%d").date()
+    except ValueError:
+        return date.today()
+
+
+def next_document_number(conn, series, on_date=None, unique_in=None):
+    """
+    Allocate the next number of `series` for the period of `on_date`.
+
+    unique_in: optional (table, column) pair; numbers already present there
+    (e.g. typed in by hand) are skipped. The column should be indexed: it is
+    probed once per allocation. Raises ValueError when _MAX_SKIP numbers in
+    a row are taken.
+
+    Runs inside the caller's transaction; the caller commits.
+    """
+    dt = _parse_date(on_date)
+    pattern = get_sequence_format(conn, series)
+    period = sequence_period(pattern, dt)
+    cur = conn.cursor()
+
+    for _ in range(_MAX_SKIP):
+        cur.execute("""
+            INSERT INTO document_sequences (series, period, last_value)
+            VALUES (?, ?, 1)
+            ON CONFLICT (series, period) DO UPDATE SET last_value = last_value + 1
+            RETURNING last_value;
+        """, (series, period))
+        n = cur.fetchone()[0]
+        number = format_document_number(pattern, n, dt)
+        if unique_in is None:
+            return number
+        table, column = unique_in
+        cur.execute(f"SELECT 1 FROM {table} WHERE {column} = ? LIMIT 1;", (number,))
+        if cur.fetchone() is None:
+            return number
+    raise ValueError(f"No free {series} number: {_MAX_SKIP} numbers in a row up to {number!r} "
+                     f"are all taken in {table}.{column}")
+
@@ -121,13 +121,13 @@ def translate(text, lang='en'):
 def _(text, lang='en'):
     return translate(text, lang)
 
-import requests
-
 def get_nbs_rate(currency="eur"):
     """
     Get today's middle rate for a currency from Kurs API (uses NBS data).
     Returns float or None on error.
     """
+    import requests
+
     url = f"https://kurs.resenje.org/api/v1/currencies/{currency.lower()}/rates/today"
     try:
         resp = requests.get(url, timeout=5)
@@ -0,0 +1,48 @@
+"""Round trip of pricing.catalog_pdf._merge_sections through pypdf's reader."""
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, DictionaryObject, FloatObject, NameObject, TextStringObject
+
+from pricing.catalog_pdf import _merge_sections
+
+
+def _section(path, title, pages):
+    """A WeasyPrint-like section: a bookmark, a named 'top' anchor and a link to it on the last page."""
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(595, 842)
+    writer.add_outline_item(title, 0)
+    writer.add_named_destination("top", 0)
+    link = DictionaryObject({
+        NameObject("/Type"): NameObject("/Annot"),
+        NameObject("/Subtype"): NameObject("/Link"),
+        NameObject("/Rect"): ArrayObject([FloatObject(0), FloatObject(0), FloatObject(100), FloatObject(20)]),
+        NameObject("/A"): DictionaryObject({
+            NameObject("/S"): NameObject("/GoTo"),
+            NameObject("/D"): TextStringObject("top"),
+        }),
+    })
+    writer.pages[-1][NameObject("/Annots")] = ArrayObject([writer._add_object(link)])
+    writer.write(path)
+    return str(path)
+
+
+def test_merge_keeps_pages_outline_and_links(tmp_path):
+    paths = [_section(tmp_path / "a.pdf", "Group A", 2), _section(tmp_path / "b.pdf", "Group B", 3)]
+    out = tmp_path / "catalog.pdf"
+    done = []
+
+    _merge_sections(paths, out, on_section=done.append)
+
+    reader = PdfReader(out, strict=True)
+    assert done == [1, 2]
+    assert len(reader.pages) == 5
+    assert [item.title for item in reader.outline] == ["Group A", "Group B"]
+    assert [reader.get_destination_page_number(item) for item in reader.outline] == [0, 2]
+
+    dests = reader.named_destinations
+    assert {name: reader.get_destination_page_number(dest) for name, dest in dests.items()} == {
+        "1/top": 0, "2/top": 2,
+    }
+    for last_page, first_page in ((1, 0), (4, 2)):
+        action = reader.pages[last_page]["/Annots"][0].get_object()["/A"]
+        assert reader.get_destination_page_number(dests[action["/D"]]) == first_page